@@ -0,0 +1,97 @@
+"""Markdown语法高亮的性能测试
+
+生成一个约2万行的Markdown文档，分别用旧的高亮器（每行重新解析12个正则）和
+src/editor.py中的MarkdownHighlighter完整高亮一遍，输出每行的平均用时。
+
+运行：python benchmarks/highlighter_benchmark.py [行数]
+"""
+import os
+import re
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QTextDocument, QSyntaxHighlighter, QTextCharFormat, QFont, QColor
+from editor import MarkdownHighlighter
+
+class LegacyHighlighter(QSyntaxHighlighter):
+    """改写前的高亮器，用于对比"""
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        header_format = QTextCharFormat()
+        header_format.setFontWeight(QFont.Bold)
+        header_format.setForeground(QColor("#0000FF"))
+        bold_format = QTextCharFormat()
+        bold_format.setFontWeight(QFont.Bold)
+        italic_format = QTextCharFormat()
+        italic_format.setFontItalic(True)
+        code_format = QTextCharFormat()
+        code_format.setBackground(QColor("#F0F0F0"))
+        link_format = QTextCharFormat()
+        link_format.setFontUnderline(True)
+        list_format = QTextCharFormat()
+        list_format.setForeground(QColor("#AA0000"))
+        self.highlighting_rules = [
+            (r'^\s*#\s+.+$', header_format),
+            (r'^\s*##\s+.+$', header_format),
+            (r'\*\*(.+?)\*\*', bold_format),
+            (r'__(.+?)__', bold_format),
+            (r'\*(.+?)\*', italic_format),
+            (r'_(.+?)_', italic_format),
+            (r'`(.+?)`', code_format),
+            (r'\[(.+?)\]\((.+?)\)', link_format),
+            (r'^\s*[\*\-\+]\s+', list_format),
+            (r'^\s*\d+\.\s+', list_format),
+        ]
+    
+    def highlightBlock(self, text):
+        for pattern, format in self.highlighting_rules:
+            for match in re.finditer(pattern, text, re.MULTILINE):
+                self.setFormat(match.start(), match.end() - match.start(), format)
+
+def make_document(line_count):
+    random.seed(0)
+    words = ["笔记", "积累", "知识", "markdown", "editor", "性能", "测试", "段落", "example", "文本"]
+    lines = []
+    while len(lines) < line_count:
+        kind = random.random()
+        sentence = " ".join(random.choice(words) for _ in range(random.randint(5, 20)))
+        if kind < 0.05:
+            lines.append("## " + sentence)
+        elif kind < 0.2:
+            lines.append("- " + sentence + " **重点** 和 `code`")
+        elif kind < 0.25:
+            lines.append("```python")
+            lines.extend(f"    value_{i} = compute(x * {i})" for i in range(random.randint(3, 15)))
+            lines.append("```")
+        elif kind < 0.35:
+            lines.append(sentence + " [链接](https://example.com/page) *强调* 和 snake_case_name")
+        else:
+            lines.append(sentence)
+    return "\n".join(lines[:line_count])
+
+def measure(highlighter_class, text):
+    document = QTextDocument()
+    document.setPlainText(text)
+    highlighter = highlighter_class(document)
+    start = time.perf_counter()
+    highlighter.rehighlight()
+    elapsed = time.perf_counter() - start
+    return elapsed, document.blockCount()
+
+def main():
+    line_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    app = QApplication(sys.argv[:1])
+    text = make_document(line_count)
+    for name, highlighter_class in (("改写前", LegacyHighlighter), ("MarkdownHighlighter", MarkdownHighlighter)):
+        # 取三次中最快的一次
+        elapsed, blocks = min(measure(highlighter_class, text) for _ in range(3))
+        print(f"{name}: {blocks} 行，共 {elapsed * 1000:.0f} ms，每行 {elapsed / blocks * 1e6:.1f} µs")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
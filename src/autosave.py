@@ -0,0 +1,339 @@
+import os
+import json
+import tempfile
+from PyQt5.QtGui import QTextCursor, QTextDocument
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal
+from file_cache import content_hash
+
+# 新建文件的权限按umask计算（临时文件创建时只有当前用户可读写）
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def atomic_write(file_path, text):
+    """先写入同一目录下的临时文件并fsync，再用os.replace替换原文件
+    
+    写入过程中程序崩溃或断电时，原文件要么是旧内容，要么是完整的新内容。
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(file_path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            mode = os.stat(file_path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    if hasattr(os, 'O_DIRECTORY'):
+        # 目录项的修改也写入磁盘（Windows不能打开目录，os.replace本身已足够）
+        try:
+            dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass
+
+class SaveWorker(QThread):
+    """在后台线程中保存文件，保存后调用after_save(文件路径, 内容)（如更新搜索索引和标签）"""
+    saved = pyqtSignal(str, str)
+    # 文件路径、错误信息
+    failed = pyqtSignal(str, str)
+    
+    def __init__(self, file_path, text, after_save=None, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.text = text
+        self.after_save = after_save
+        # 保存失败时的错误信息；在线程中直接记录，AutoSaver.wait中排队的failed信号不会送达
+        self.error = None
+    
+    def run(self):
+        try:
+            atomic_write(self.file_path, self.text)
+        except Exception as e:
+            self.error = str(e)
+            self.failed.emit(self.file_path, self.error)
+            return
+        if self.after_save is not None:
+            try:
+                self.after_save(self.file_path, self.text)
+            except Exception as e:
+                print(f"保存后更新时出错: {self.file_path}, 错误: {str(e)}")
+        self.saved.emit(self.file_path, self.text)
+
+class RecoveryJournal:
+    """记录未保存修改的追加式日志，每行一条JSON记录
+    
+    {"path", "hash"}：基准点，此时文件内容（按文本读取）的摘要为hash；
+    {"path", "at", "del", "ins"}：在at处删除del个字符后插入ins（位置与QTextDocument一致）。
+    开始修改和每次保存时写入基准点；所有修改都已保存后删除日志。
+    """
+    
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.file = None
+    
+    def append(self, record):
+        if self.file is None:
+            self.file = open(self.journal_path, 'a', encoding='utf-8')
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        # 只写入系统缓存，程序崩溃时不会丢失
+        self.file.flush()
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    
+    def clear(self):
+        self.close()
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+    
+    def recover(self):
+        """读取上次异常退出时留下的日志并删除，返回 {文件路径: 恢复的内容}
+        
+        对每个文件，从最后一个与磁盘上当前内容一致的基准点开始重放之后的修改；
+        没有一致的基准点（文件在退出后被其他程序修改）时不恢复。
+        """
+        records = {}
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时最后一行可能只写了一半
+                        break
+                    records.setdefault(record['path'], []).append(record)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"读取恢复日志时出错: {str(e)}")
+        recovered = {}
+        for file_path, file_records in records.items():
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    disk = f.read()
+            except (OSError, UnicodeDecodeError):
+                continue
+            disk_hash = content_hash(disk.encode('utf-8'))
+            document = None
+            for record in file_records:
+                if 'hash' in record:
+                    if record['hash'] == disk_hash:
+                        document = QTextDocument()
+                        document.setPlainText(disk)
+                elif document is not None:
+                    cursor = QTextCursor(document)
+                    end = document.characterCount() - 1
+                    cursor.setPosition(min(record['at'], end))
+                    cursor.setPosition(min(record['at'] + record['del'], end), QTextCursor.KeepAnchor)
+                    cursor.insertText(record['ins'])
+            if document is not None and document.toPlainText() != disk:
+                recovered[file_path] = document.toPlainText()
+        self.clear()
+        return recovered
+
+class AutoSaver(QObject):
+    """编辑器文档的自动保存
+    
+    修改后停止输入delay_ms毫秒时保存，连续输入时最迟MAX_DELAY_MS毫秒保存一次。
+    保存在后台线程中进行，同一时间只运行一个保存，期间再次保存的内容排队，
+    同一文件只保留最新的内容。每次修改同时追加到恢复日志，所有修改都保存后删除日志。
+    """
+    MAX_DELAY_MS = 10000
+    
+    saved = pyqtSignal(str, str)
+    failed = pyqtSignal(str, str)
+    # 当前文档是否有未保存的修改（用于显示修改标记）
+    modification_changed = pyqtSignal(bool)
+    
+    def __init__(self, document, journal_path, delay_ms=1000, after_save=None, parent=None):
+        super().__init__(parent)
+        self.document = document
+        self.journal = RecoveryJournal(journal_path)
+        self.after_save = after_save
+        self.file_path = None
+        # 上次保存（或载入）时的内容摘要和文档修订号：修订号不变说明没有编辑过，
+        # 摘要相同说明编辑后又改回了原来的内容，两种情况都不必写入；摘要同时作为日志的基准点
+        self.saved_hash = None
+        self.saved_revision = -1
+        self.base_written = False
+        self.worker = None
+        # 等待保存的 {文件路径: 内容}，按请求顺序保存
+        self.pending = {}
+        # 保存失败的文件，日志中的修改需要保留
+        self.failed_paths = set()
+        document.contentsChange.connect(self.on_contents_change)
+        document.modificationChanged.connect(self.modification_changed)
+        
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(delay_ms)
+        self.idle_timer.timeout.connect(self.save)
+        self.max_timer = QTimer(self)
+        self.max_timer.setSingleShot(True)
+        self.max_timer.setInterval(self.MAX_DELAY_MS)
+        self.max_timer.timeout.connect(self.save)
+        self.last_revision = document.revision()
+    
+    def set_file(self, file_path):
+        """编辑器中已载入file_path的内容（None表示没有文件），此后的修改自动保存"""
+        self.file_path = file_path
+        self.base_written = False
+        self.last_revision = self.document.revision()
+        if file_path and not self.document.isModified():
+            self.saved_hash = content_hash(self.document.toPlainText().encode('utf-8'))
+            self.saved_revision = self.document.revision()
+        else:
+            self.saved_hash = None
+            self.saved_revision = -1
+    
+    def set_document(self, document):
+        """编辑器换上了另一个文档（之前先调用finish_file）"""
+        self.document.contentsChange.disconnect(self.on_contents_change)
+        self.document.modificationChanged.disconnect(self.modification_changed)
+        self.document = document
+        document.contentsChange.connect(self.on_contents_change)
+        document.modificationChanged.connect(self.modification_changed)
+        self.last_revision = document.revision()
+    
+    def finish_file(self):
+        """保存当前文件的修改并停止跟踪（编辑器载入其他内容之前调用）"""
+        self.save()
+        self.file_path = None
+    
+    def rename(self, file_path):
+        """当前文件被移动或重命名，此后保存到新路径"""
+        self.file_path = file_path
+        self.base_written = False
+        self.save()
+    
+    def restore(self, text):
+        """用恢复的内容替换文档，作为一次修改记入日志并自动保存"""
+        cursor = QTextCursor(self.document)
+        cursor.select(QTextCursor.Document)
+        cursor.insertText(text)
+    
+    def on_contents_change(self, position, removed, added):
+        # 语法高亮只改变格式，文档的修订号不变
+        revision = self.document.revision()
+        if revision == self.last_revision:
+            return
+        self.last_revision = revision
+        if self.file_path is None:
+            return
+        if not self.base_written:
+            self.journal.append({"path": self.file_path, "hash": self.saved_hash})
+            self.base_written = True
+        # 修改到达文档末尾时Qt报告的字符数会多算结尾的段落分隔符
+        added = max(0, min(added, self.document.characterCount() - 1 - position))
+        cursor = QTextCursor(self.document)
+        cursor.setPosition(position)
+        cursor.setPosition(position + added, QTextCursor.KeepAnchor)
+        self.journal.append({"path": self.file_path, "at": position, "del": removed,
+                             "ins": cursor.selectedText().replace('\u2029', '\n')})
+        self.idle_timer.start()
+        if not self.max_timer.isActive():
+            self.max_timer.start()
+    
+    def save(self):
+        """保存当前文件的修改（不等待写入完成），内容与上次保存时相同时不写入"""
+        self.idle_timer.stop()
+        self.max_timer.stop()
+        if self.file_path is None or not self.document.isModified():
+            return
+        revision = self.document.revision()
+        if revision == self.saved_revision:
+            self.document.setModified(False)
+            return
+        text = self.document.toPlainText()
+        digest = content_hash(text.encode('utf-8'))
+        self.saved_revision = revision
+        self.document.setModified(False)
+        if self.base_written:
+            self.journal.append({"path": self.file_path, "hash": digest})
+        if digest == self.saved_hash:
+            self.clear_journal_if_saved()
+            return
+        self.saved_hash = digest
+        self.save_text(self.file_path, text)
+    
+    def save_text(self, file_path, text):
+        """把text保存到file_path，正在保存时排队"""
+        self.pending.pop(file_path, None)
+        self.pending[file_path] = text
+        if self.worker is None:
+            self.start_next()
+    
+    def unsaved_text(self, file_path):
+        """file_path等待保存或正在保存的内容，没有时返回None（此时磁盘上的内容可能还是旧的）"""
+        if file_path in self.pending:
+            return self.pending[file_path]
+        if self.worker is not None and self.worker.file_path == file_path:
+            return self.worker.text
+        return None
+    
+    def start_next(self):
+        file_path = next(iter(self.pending))
+        text = self.pending.pop(file_path)
+        self.worker = SaveWorker(file_path, text, self.after_save, self)
+        self.worker.saved.connect(self.on_saved)
+        self.worker.failed.connect(self.on_failed)
+        self.worker.finished.connect(self.on_worker_finished)
+        self.worker.start()
+    
+    def on_worker_finished(self):
+        if self.worker is None or self.worker.isRunning():
+            return
+        worker = self.worker
+        self.worker = None
+        if worker.error is not None:
+            self.failed_paths.add(worker.file_path)
+        else:
+            self.failed_paths.discard(worker.file_path)
+        if self.pending:
+            self.start_next()
+        else:
+            self.clear_journal_if_saved()
+    
+    def clear_journal_if_saved(self):
+        if self.worker is None and not self.pending and not self.failed_paths and not self.document.isModified():
+            # 所有修改都已写入文件
+            self.journal.clear()
+            self.base_written = False
+    
+    def on_saved(self, file_path, text):
+        self.failed_paths.discard(file_path)
+        self.saved.emit(file_path, text)
+    
+    def on_failed(self, file_path, message):
+        # 日志中保留修改，仍可恢复；当前文件在下次修改后重试
+        self.failed_paths.add(file_path)
+        if file_path == self.file_path:
+            self.saved_hash = None
+            self.saved_revision = -1
+            self.document.setModified(True)
+        self.failed.emit(file_path, message)
+    
+    def wait(self):
+        """保存当前修改并等待所有保存完成（退出前调用）"""
+        self.save()
+        while self.worker is not None:
+            self.worker.wait()
+            self.on_worker_finished()
+        self.journal.close()
\ No newline at end of file
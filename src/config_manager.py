@@ -10,7 +10,24 @@ class ConfigManager:
     def load_config(self):
         """加载配置文件"""
         default_config = {
-            "data_dir": os.path.join(self.app_dir, "data")
+            "data_dir": os.path.join(self.app_dir, "data"),
+            # 边输入边搜索时，停止输入多少毫秒后开始搜索
+            "search_debounce_ms": 200,
+            # 数据目录监视方式：auto（系统通知加轮询）、poll（只轮询）、off（关闭）
+            "vault_watcher": "auto",
+            # 最近打开的文件（快速打开的排序依据）
+            "recent_files": [],
+            # 超过多少MB的文件以只读的大文件模式打开（不整体读入内存，不换行、不高亮）
+            "large_file_threshold_mb": 50,
+            # 是否在编辑器右侧显示Markdown预览
+            "show_preview": False,
+            # 停止输入多少毫秒后自动保存
+            "autosave_delay_ms": 1000,
+            # 最近打开的文档保留在内存中，切换回来时不必重新读取和高亮：最多缓存的文档数和总大小（百万字符）
+            "document_cache_size": 20,
+            "document_cache_mb": 32,
+            # 上次退出时打开的标签页：{"tabs": [{"path", "cursor", "scroll"}], "current": 序号}
+            "session": {}
         }
         
         if os.path.exists(self.config_file):
@@ -0,0 +1,88 @@
+import os
+from collections import OrderedDict
+
+class CachedDocument:
+    """缓存的文档：QTextDocument（包括语法高亮和撤销记录）、载入时的文件状态、光标和滚动位置"""
+    
+    def __init__(self, file_path, document):
+        self.file_path = file_path
+        self.document = document
+        self.mtime_ns = None
+        self.size = None
+        self.view_state = None
+        self.update_stat()
+    
+    def update_stat(self):
+        """记录文件当前的修改时间和大小（载入或保存之后调用）"""
+        try:
+            st = os.stat(self.file_path)
+            self.mtime_ns, self.size = st.st_mtime_ns, st.st_size
+        except OSError:
+            self.mtime_ns = self.size = None
+    
+    def is_fresh(self):
+        """文件在载入或保存之后没有被其他程序修改（只比较修改时间和大小）"""
+        try:
+            st = os.stat(self.file_path)
+        except OSError:
+            return False
+        return (st.st_mtime_ns, st.st_size) == (self.mtime_ns, self.size)
+    
+    @property
+    def chars(self):
+        return self.document.characterCount()
+
+class DocumentCache:
+    """最近打开的文档的LRU缓存
+    
+    切换回最近打开过的笔记时直接换上缓存的文档，不必重新读取文件、设置文本和高亮，
+    撤销记录、光标和滚动位置也都保留。按文档数和总字符数限制大小，超出时淘汰最久没有
+    使用的文档（当前显示的文档除外）。
+    """
+    
+    def __init__(self, max_documents=20, max_chars=32 << 20):
+        self.max_documents = max_documents
+        self.max_chars = max_chars
+        self.entries = OrderedDict()
+    
+    def get(self, file_path):
+        """返回file_path的缓存文档并标记为最近使用，不在缓存中或文件已被修改时返回None"""
+        entry = self.entries.get(file_path)
+        if entry is None:
+            return None
+        if not entry.is_fresh():
+            del self.entries[file_path]
+            return None
+        self.entries.move_to_end(file_path)
+        return entry
+    
+    def put(self, entry):
+        """加入（或替换）一个文档并作为最近使用的文档，然后淘汰超出限制的文档"""
+        self.entries.pop(entry.file_path, None)
+        self.entries[entry.file_path] = entry
+        total = sum(cached.chars for cached in self.entries.values())
+        while len(self.entries) > 1 and (len(self.entries) > self.max_documents or total > self.max_chars):
+            _, evicted = self.entries.popitem(last=False)
+            total -= evicted.chars
+    
+    def update_stat(self, file_path):
+        entry = self.entries.get(file_path)
+        if entry is not None:
+            entry.update_stat()
+    
+    def rename(self, old_path, new_path):
+        """文件被移动或重命名，路径是目录时移动其中的所有文档"""
+        prefix = os.path.join(old_path, '')
+        entries = OrderedDict()
+        for file_path, entry in self.entries.items():
+            if file_path == old_path or file_path.startswith(prefix):
+                entry.file_path = new_path + file_path[len(old_path):]
+            entries[entry.file_path] = entry
+        self.entries = entries
+    
+    def remove(self, file_path):
+        """文件或目录被删除"""
+        prefix = os.path.join(file_path, '')
+        for cached_path in list(self.entries):
+            if cached_path == file_path or cached_path.startswith(prefix):
+                del self.entries[cached_path]
\ No newline at end of file
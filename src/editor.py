@@ -1,65 +1,247 @@
+import re
+import time
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPlainTextEdit, QTextEdit, 
-                           QTabWidget, QLabel, QPushButton, QComboBox)
-from PyQt5.QtGui import QFont, QColor, QTextCharFormat, QSyntaxHighlighter, QTextCursor, QTextOption, QTextFormat, QPainter
-from PyQt5.QtCore import Qt, QRect, QSize
+                           QTabWidget, QLabel, QPushButton, QComboBox, QPlainTextDocumentLayout)
+from PyQt5.QtGui import QFont, QColor, QTextCharFormat, QSyntaxHighlighter, QTextCursor, QTextOption, QTextFormat, QPainter, QTextDocument
+from PyQt5.QtCore import Qt, QRect, QSize, QTimer
+from outline import HeadingModel
+
+# 行首的结构：标题、列表、围栏代码块的开始/结束
+_HEADER_RE = re.compile(r'[ \t]*(#{1,6})[ \t]+\S')
+# 标题结尾可选的#
+_CLOSING_HASHES_RE = re.compile(r'[ \t]+#+[ \t]*$')
+_LIST_RE = re.compile(r'[ \t]*(?:[*+-]|\d+\.)[ \t]+')
+_FENCE_RE = re.compile(r'[ \t]{0,3}(`{3,}|~{3,})')
+# 行内格式合并为一个正则，每行只扫描一次；前面的分支优先（行内代码中的*不会被当作强调）
+_INLINE_RE = re.compile(
+    r'(?P<code>`[^`]+`)'
+    r'|(?P<link>\[[^\]]+\]\([^)\s]+\))'
+    r'|(?P<bold>\*\*[^*]+\*\*|__[^_]+__)'
+    r'|(?P<italic>\*[^*\s][^*]*\*|(?<!\w)_[^_\s][^_]*_(?!\w))')
+# 行内格式的标记字符，行中没有这些字符时跳过扫描
+_INLINE_MARKS = ('`', '[', '*', '_')
 
 class MarkdownHighlighter(QSyntaxHighlighter):
+    """Markdown语法高亮
+    
+    正则在模块加载时编译，每行只做一次行首匹配和一次行内扫描。
+    围栏代码块跨多行，用块状态记录：上一行在代码块中时，本行从代码块状态开始。
+    
+    大文档使用延迟高亮（start_lazy）：分界（frontier）之后还没有高亮过的块被跳过，
+    可见的块由编辑器调用highlight_blocks优先高亮，其余的块在空闲时按顺序分批高亮，
+    每批不超过TICK_BUDGET秒。编辑时Qt只重新高亮修改的块，以及块状态因此改变的后续块。
+    
+    每个块高亮时识别出的标题交给headings（文档的大纲），大纲随高亮增量更新。
+    """
+    # 块状态：还没有高亮（Qt的默认值）；普通文本；
+    # 在```或~~~代码块中（状态值加上围栏长度，结束的围栏不能短于开始的围栏）；标题
+    STATE_PENDING = -1
+    STATE_NORMAL = 0
+    STATE_BACKTICK_FENCE = 0x100
+    STATE_TILDE_FENCE = 0x200
+    STATE_HEADING = 0x400
+    
+    # 超过这个字符数的文档使用延迟高亮
+    LAZY_THRESHOLD = 500000
+    # 空闲时每次高亮的最长时间（秒）和每批的块数
+    TICK_BUDGET = 0.01
+    CHUNK_BLOCKS = 200
+    
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.highlighting_rules = []
+        # 延迟高亮时的分界，之前的块已按顺序高亮；QTextCursor的位置随编辑自动调整
+        self.frontier = None
+        # 正在优先高亮的范围（字符位置）
+        self.forced = (0, 0)
+        # 为True时不高亮任何块（设置大文档的内容时，所有的块都在分界之后，不需要逐块判断）
+        self.suspended = False
+        self.pending_timer = QTimer(self)
+        self.pending_timer.setInterval(0)
+        self.pending_timer.timeout.connect(self.highlight_pending)
+        self.headings = HeadingModel(self)
+        if self.document() is not None:
+            # 在高亮器之后收到修改通知
+            self.document().contentsChange.connect(self.on_contents_change)
         
         # 标题格式
         header_format = QTextCharFormat()
         header_format.setFontWeight(QFont.Bold)
         header_format.setForeground(QColor("#0000FF"))
         header_format.setFontPointSize(14)
-        self.highlighting_rules.append((r'^\s*#\s+.+$', header_format))
         
         header2_format = QTextCharFormat()
         header2_format.setFontWeight(QFont.Bold)
         header2_format.setForeground(QColor("#0000FF"))
         header2_format.setFontPointSize(12)
-        self.highlighting_rules.append((r'^\s*##\s+.+$', header2_format))
+        # 三级及以下标题和二级标题相同
+        self.header_formats = [None, header_format] + [header2_format] * 5
         
         # 粗体格式
         bold_format = QTextCharFormat()
         bold_format.setFontWeight(QFont.Bold)
-        self.highlighting_rules.append((r'\*\*(.+?)\*\*', bold_format))
-        self.highlighting_rules.append((r'__(.+?)__', bold_format))
         
         # 斜体格式
         italic_format = QTextCharFormat()
         italic_format.setFontItalic(True)
-        self.highlighting_rules.append((r'\*(.+?)\*', italic_format))
-        self.highlighting_rules.append((r'_(.+?)_', italic_format))
         
         # 代码块格式
         code_format = QTextCharFormat()
         code_format.setFontFamily("Courier New")
         code_format.setBackground(QColor("#F0F0F0"))
-        self.highlighting_rules.append((r'`(.+?)`', code_format))
+        self.code_format = code_format
         
         # 链接格式
         link_format = QTextCharFormat()
         link_format.setForeground(QColor("#0000FF"))
         link_format.setFontUnderline(True)
-        self.highlighting_rules.append((r'\[(.+?)\]\((.+?)\)', link_format))
         
         # 列表格式
         list_format = QTextCharFormat()
         list_format.setForeground(QColor("#AA0000"))
         list_format.setFontWeight(QFont.Bold)
-        self.highlighting_rules.append((r'^\s*[\*\-\+]\s+', list_format))
-        self.highlighting_rules.append((r'^\s*\d+\.\s+', list_format))
+        self.list_format = list_format
+        
+        # _INLINE_RE的分支名 -> 格式
+        self.inline_formats = {
+            'code': code_format,
+            'link': link_format,
+            'bold': bold_format,
+            'italic': italic_format,
+        }
+    
+    def start_lazy(self):
+        """开始延迟高亮，在设置大文档的内容之前调用"""
+        if self.document() is None:
+            return
+        self.frontier = QTextCursor(self.document())
+        # 在分界处插入的文本（包括随后设置的全部内容）留在分界之后
+        self.frontier.setKeepPositionOnInsert(True)
+        self.pending_timer.start()
+    
+    def stop_lazy(self):
+        self.frontier = None
+        self.pending_timer.stop()
+    
+    def is_lazy(self):
+        return self.frontier is not None
+    
+    def highlight_blocks(self, first, last):
+        """优先高亮first到last（包括）之间还没有高亮的块（可见区域）"""
+        if self.frontier is None:
+            return
+        self.forced = (first.position(), last.position() + last.length())
+        try:
+            block = first
+            while block.isValid() and block.position() <= last.position():
+                if block.userState() == self.STATE_PENDING:
+                    # 状态从未高亮变为已高亮，Qt会继续高亮后面的块，直到范围末尾
+                    self.rehighlightBlock(block)
+                block = block.next()
+        finally:
+            self.forced = (0, 0)
+    
+    def highlight_pending(self):
+        """空闲时从分界开始按顺序高亮一批块"""
+        document = self.document()
+        if self.frontier is None or document is None:
+            self.pending_timer.stop()
+            return
+        deadline = time.perf_counter() + self.TICK_BUDGET
+        while self.frontier is not None and time.perf_counter() < deadline:
+            first = document.findBlock(self.frontier.position())
+            last = first
+            for _ in range(self.CHUNK_BLOCKS):
+                if not last.next().isValid():
+                    break
+                last = last.next()
+            # 先把分界移到这一批之后，再从第一块开始高亮，Qt会因为块状态变化一直高亮到分界
+            if last.next().isValid():
+                self.frontier.setPosition(last.next().position())
+            else:
+                self.stop_lazy()
+            self.rehighlightBlock(first)
+            # 与之前优先高亮的块状态一致时Qt会提前停止，补上后面还没有高亮的块
+            block = first.next()
+            while block.isValid() and block.position() <= last.position():
+                if block.userState() == self.STATE_PENDING:
+                    self.rehighlightBlock(block)
+                block = block.next()
     
     def highlightBlock(self, text):
-        import re
-        for pattern, format in self.highlighting_rules:
-            matches = re.finditer(pattern, text, re.MULTILINE)
-            for match in matches:
-                start = match.start()
-                length = match.end() - start
-                self.setFormat(start, length, format)
+        if self.suspended:
+            return
+        if self.frontier is not None and self.currentBlockState() == self.STATE_PENDING:
+            # 延迟高亮：分界之后、不在优先范围内的块暂不高亮，块状态保持不变，Qt不会继续向后高亮
+            position = self.currentBlock().position()
+            if position >= self.frontier.position() and not self.forced[0] <= position < self.forced[1]:
+                return
+        previous = self.currentBlockState()
+        heading = self.highlight_line(text)
+        # 只有标题行和原来是标题的行需要更新大纲
+        if heading is not None or (previous > self.STATE_NORMAL and previous & self.STATE_HEADING):
+            self.headings.update_block(self.currentBlock(), heading)
+    
+    def on_contents_change(self, position, removed, added):
+        """删除或拆分行时标题的光标会移到修改范围中的其他块，其中不是标题的块高亮时不会更新大纲，在这里更新"""
+        document = self.document()
+        end = position + added
+        first = document.findBlock(position)
+        if not removed and first.contains(end):
+            # 在一行中输入文字
+            return
+        # 只检查修改涉及的块中的标题
+        cursors = self.headings.cursors
+        row = self.headings.find(first.position())
+        while row < len(cursors) and cursors[row].position() <= end:
+            block = document.findBlock(cursors[row].position())
+            state = block.userState()
+            if state > self.STATE_NORMAL and state & self.STATE_HEADING:
+                row += 1
+            else:
+                # 删除这个块中的所有标题
+                self.headings.update_block(block, None)
+    
+    def highlight_line(self, text):
+        """高亮一行，是标题时返回 (级别, 标题文字)"""
+        state = self.previousBlockState()
+        if state > self.STATE_NORMAL and state & (self.STATE_BACKTICK_FENCE | self.STATE_TILDE_FENCE):
+            # 在围栏代码块中：整行按代码显示，遇到相同字符、长度不短于开始围栏的行时结束
+            self.setFormat(0, len(text), self.code_format)
+            fence = _FENCE_RE.match(text)
+            fence_char = '`' if state & self.STATE_BACKTICK_FENCE else '~'
+            if (fence and fence.group(1)[0] == fence_char and len(fence.group(1)) >= state & 0xFF
+                    and not text[fence.end():].strip()):
+                self.setCurrentBlockState(self.STATE_NORMAL)
+            else:
+                self.setCurrentBlockState(state)
+            return None
+        self.setCurrentBlockState(self.STATE_NORMAL)
+        
+        first = text.lstrip()[:1]
+        if first in ('`', '~'):
+            fence = _FENCE_RE.match(text)
+            if fence:
+                marker = fence.group(1)
+                kind = self.STATE_BACKTICK_FENCE if marker[0] == '`' else self.STATE_TILDE_FENCE
+                self.setFormat(0, len(text), self.code_format)
+                self.setCurrentBlockState(kind | min(len(marker), 0xFF))
+                return None
+        elif first == '#':
+            header = _HEADER_RE.match(text)
+            if header:
+                self.setFormat(0, len(text), self.header_formats[len(header.group(1))])
+                self.setCurrentBlockState(self.STATE_HEADING)
+                title = _CLOSING_HASHES_RE.sub('', text[header.end() - 1:]).strip()
+                return len(header.group(1)), title
+        elif first in ('*', '+', '-') or first.isdigit():
+            item = _LIST_RE.match(text)
+            if item:
+                self.setFormat(0, item.end(), self.list_format)
+        
+        if any(mark in text for mark in _INLINE_MARKS):
+            for match in _INLINE_RE.finditer(text):
+                self.setFormat(match.start(), match.end() - match.start(), self.inline_formats[match.lastgroup])
+        return None
 
 class MarkdownEditor(QWidget):
     def __init__(self):
@@ -136,6 +318,13 @@ class MarkdownEditor(QWidget):
         
         # 添加语法高亮
         self.highlighter = MarkdownHighlighter(self.editor.document())
+        # 大文档延迟高亮时，滚动、编辑或改变大小后优先高亮可见的块
+        self.visible_timer = QTimer(self)
+        self.visible_timer.setSingleShot(True)
+        self.visible_timer.setInterval(0)
+        self.visible_timer.timeout.connect(self.highlight_visible)
+        self.editor.verticalScrollBar().valueChanged.connect(self.highlight_visible)
+        self.editor.document().contentsChange.connect(lambda *args: self.visible_timer.start())
         
         # 添加到布局
         self.layout.addWidget(self.editor)
@@ -175,6 +364,23 @@ class MarkdownEditor(QWidget):
         super().resizeEvent(event)
         cr = self.editor.contentsRect()
         self.line_number_area.setGeometry(QRect(cr.left(), cr.top(), self.line_number_area_width(), cr.height()))
+        self.visible_timer.start()
+    
+    def highlight_visible(self):
+        """延迟高亮时立即高亮可见区域中的块"""
+        if not self.highlighter.is_lazy():
+            return
+        first = self.editor.firstVisibleBlock()
+        if not first.isValid():
+            return
+        offset = self.editor.contentOffset()
+        height = self.editor.viewport().height()
+        last = first
+        block = first
+        while block.isValid() and self.editor.blockBoundingGeometry(block).translated(offset).top() <= height:
+            last = block
+            block = block.next()
+        self.highlighter.highlight_blocks(first, last)
     
     def line_number_area_paint_event(self, event):
         """绘制行号区域"""
@@ -233,8 +439,19 @@ class MarkdownEditor(QWidget):
         if hasattr(self, 'line_numbers_visible'):
             line_numbers_visible = self.line_numbers_visible
         
-        # 设置内容
-        self.editor.setPlainText(content)
+        # 设置内容；大文档先只高亮可见的部分，其余的在空闲时高亮，大纲随之生成
+        self.highlighter.headings.clear()
+        if len(content) > self.highlighter.LAZY_THRESHOLD:
+            self.highlighter.start_lazy()
+            self.highlighter.suspended = True
+            try:
+                self.editor.setPlainText(content)
+            finally:
+                self.highlighter.suspended = False
+        else:
+            self.highlighter.stop_lazy()
+            self.editor.setPlainText(content)
+        self.highlight_visible()
         
         # 恢复行号显示状态
         self.line_numbers_visible = line_numbers_visible
@@ -245,6 +462,71 @@ class MarkdownEditor(QWidget):
     def get_content(self):
         return self.editor.toPlainText()
     
+    def create_document(self):
+        """创建一个带语法高亮的空文档，切换文档时高亮、撤销记录都随文档保留"""
+        document = QTextDocument()
+        document.setDocumentLayout(QPlainTextDocumentLayout(document))
+        document.setDefaultFont(self.editor.font())
+        MarkdownHighlighter(document)
+        document.contentsChange.connect(lambda *args: self.visible_timer.start())
+        return document
+    
+    def set_document(self, document, view_state=None):
+        """显示另一个文档，view_state为离开该文档时view_state()的返回值"""
+        if document.defaultFont() != self.editor.font():
+            document.setDefaultFont(self.editor.font())
+        self.editor.setDocument(document)
+        # 编辑器不拥有没有父对象的文档，保留引用直到换成其他文档
+        self.document = document
+        self.highlighter = document.findChild(MarkdownHighlighter)
+        if view_state is not None:
+            cursor, scroll = view_state
+            self.editor.setTextCursor(cursor)
+            self.editor.verticalScrollBar().setValue(scroll)
+        if self.line_numbers_visible:
+            self.update_line_number_area_width(0)
+        else:
+            self.editor.setViewportMargins(0, 0, 0, 0)
+        self.highlight_current_line()
+        self.visible_timer.start()
+    
+    def restore_position(self, position, scroll):
+        """恢复上次会话中记下的光标和滚动位置"""
+        cursor = self.editor.textCursor()
+        cursor.setPosition(min(position, self.editor.document().characterCount() - 1))
+        self.editor.setTextCursor(cursor)
+        self.editor.verticalScrollBar().setValue(scroll)
+    
+    def view_state(self):
+        """当前的光标和滚动位置"""
+        return QTextCursor(self.editor.textCursor()), self.editor.verticalScrollBar().value()
+    
+    def reload_content(self, content):
+        """文件被外部修改后重新加载，尽量保留光标和滚动位置"""
+        position = self.editor.textCursor().position()
+        scroll = self.editor.verticalScrollBar().value()
+        self.set_content(content)
+        cursor = self.editor.textCursor()
+        cursor.setPosition(min(position, len(content)))
+        self.editor.setTextCursor(cursor)
+        self.editor.verticalScrollBar().setValue(scroll)
+    
+    def go_to_line(self, line_number):
+        """跳转到指定行（从0开始）并滚动到视图中央"""
+        block = self.editor.document().findBlockByNumber(line_number)
+        if block.isValid():
+            self.editor.setTextCursor(QTextCursor(block))
+            self.editor.centerCursor()
+            self.editor.setFocus()
+    
+    def go_to_position(self, position):
+        """跳转到字符位置（如大纲中的标题）并滚动到视图中央"""
+        cursor = QTextCursor(self.editor.document())
+        cursor.setPosition(min(position, self.editor.document().characterCount() - 1))
+        self.editor.setTextCursor(cursor)
+        self.editor.centerCursor()
+        self.editor.setFocus()
+    
     # 修改工具栏功能方法以适应QPlainTextEdit
     def change_font(self, font_name):
         cursor = self.editor.textCursor()
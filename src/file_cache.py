@@ -0,0 +1,391 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+# 缓存文件保存在数据目录下
+CACHE_FILE_NAME = ".file_cache.json"
+# 程序自身生成的文件，不作为数据跟踪
+INTERNAL_FILE_PREFIXES = (CACHE_FILE_NAME, ".search_index.db", ".tags.db")
+
+def content_hash(data):
+    """计算内容摘要"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def file_hash(file_path):
+    """分块读取文件并计算内容摘要"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class ChangeSet:
+    """一次扫描发现的变化，路径均为相对数据目录的路径"""
+    
+    def __init__(self):
+        self.added = []
+        self.modified = []
+        self.removed = []
+        # 重命名或移动：[(旧路径, 新路径)]，由pair_moves从新增和删除中配对得出
+        self.moved = []
+        self.new_dirs = []
+        self.removed_dirs = []
+        # 被删除文件的内容摘要，用于识别移动
+        self.removed_digests = {}
+    
+    @property
+    def changed(self):
+        """内容有变化（新增或修改）的文件"""
+        return self.added + self.modified
+    
+    def pair_moves(self, digest_of):
+        """把内容摘要相同的一删一增识别为移动，digest_of(相对路径)返回新增文件的摘要"""
+        if not self.added or not self.removed:
+            return
+        removed_by_digest = {}
+        for relative_path in self.removed:
+            digest = self.removed_digests.get(relative_path)
+            if digest:
+                removed_by_digest.setdefault(digest, []).append(relative_path)
+        added = []
+        for relative_path in self.added:
+            candidates = removed_by_digest.get(digest_of(relative_path))
+            if candidates:
+                old_path = candidates.pop()
+                self.removed.remove(old_path)
+                self.moved.append((old_path, relative_path))
+            else:
+                added.append(relative_path)
+        self.added = added
+    
+    def merge(self, other):
+        self.added.extend(other.added)
+        self.modified.extend(other.modified)
+        self.removed.extend(other.removed)
+        self.moved.extend(other.moved)
+        self.new_dirs.extend(other.new_dirs)
+        self.removed_dirs.extend(other.removed_dirs)
+        self.removed_digests.update(other.removed_digests)
+    
+    def __bool__(self):
+        return bool(self.added or self.modified or self.removed or self.moved)
+    
+    def __repr__(self):
+        return (f"ChangeSet(added={len(self.added)}, modified={len(self.modified)}, "
+                f"removed={len(self.removed)}, moved={len(self.moved)})")
+
+class FileStatCache:
+    """数据目录的文件元数据缓存，按路径记录 (mtime_ns, size, 内容摘要)
+    
+    缓存在两次运行之间持久保存。scan只需一次os.scandir遍历即可得出自上次扫描后
+    变化的文件；只有修改时间或大小变化的文件才会被重新读取以计算摘要，
+    摘要不变（例如只是被touch）的文件不算作修改。
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.cache_file = os.path.join(data_dir, CACHE_FILE_NAME)
+        # 相对路径 -> (mtime_ns, size, hash)
+        self.entries = {}
+        # 扫描到的所有子目录（相对路径），用于复制空目录
+        self.dirs = set()
+        # 内存中的条目是否有尚未保存的修改
+        self.dirty = False
+        # 目录 -> 其中的文件，单目录扫描时使用，第一次使用时建立
+        self._dir_index = None
+        # 扫描期间通过record记录的条目
+        self._pending_records = []
+        self._lock = threading.RLock()
+        self.load()
+    
+    def load(self):
+        """加载缓存，缓存损坏时从空缓存开始"""
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") != self.VERSION:
+                return
+            self.entries = {path: tuple(entry) for path, entry in data.get("entries", {}).items()}
+            self.dirs = set(data.get("dirs", []))
+        except Exception as e:
+            print(f"加载文件缓存失败，将重新扫描: {str(e)}")
+            self.entries = {}
+            self.dirs = set()
+    
+    def save(self):
+        """写入临时文件后替换，避免写入中途崩溃损坏缓存"""
+        with self._lock:
+            self._apply_pending_records()
+            data = {
+                "version": self.VERSION,
+                "entries": self.entries,
+                "dirs": sorted(self.dirs)
+            }
+            tmp_file = self.cache_file + ".tmp"
+            try:
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+                os.replace(tmp_file, self.cache_file)
+                self.dirty = False
+            except Exception as e:
+                print(f"保存文件缓存失败: {str(e)}")
+    
+    def relative_path(self, file_path):
+        return os.path.relpath(file_path, self.data_dir).replace(os.sep, '/')
+    
+    def absolute_path(self, relative_path):
+        return os.path.join(self.data_dir, relative_path.replace('/', os.sep))
+    
+    def get(self, relative_path):
+        """返回 (mtime_ns, size, hash)，未缓存时返回None"""
+        return self.entries.get(relative_path)
+    
+    def paths(self, extensions=None):
+        """缓存中的所有文件（相对路径），可按扩展名过滤"""
+        if extensions is None:
+            return list(self.entries)
+        return [path for path in self.entries if path.endswith(extensions)]
+    
+    def _relative_dir(self, directory):
+        relative_dir = self.relative_path(directory)
+        return '' if relative_dir == '.' else relative_dir
+    
+    def _children(self, relative_dir):
+        """目录中已缓存的文件（不含子目录）"""
+        if self._dir_index is None:
+            self._dir_index = {}
+            for relative_path in self.entries:
+                self._dir_index.setdefault(relative_path.rpartition('/')[0], set()).add(relative_path)
+        return self._dir_index.get(relative_dir, set())
+    
+    def _set_entry(self, relative_path, entry):
+        if self._dir_index is not None and relative_path not in self.entries:
+            self._dir_index.setdefault(relative_path.rpartition('/')[0], set()).add(relative_path)
+        self.entries[relative_path] = entry
+        self.dirty = True
+    
+    def _remove_entry(self, relative_path, changes=None):
+        entry = self.entries.pop(relative_path, None)
+        if entry is None:
+            return
+        if self._dir_index is not None:
+            self._dir_index.get(relative_path.rpartition('/')[0], set()).discard(relative_path)
+        self.dirty = True
+        if changes is not None:
+            changes.removed.append(relative_path)
+            changes.removed_digests[relative_path] = entry[2]
+    
+    def _update_entry(self, relative_path, st, file_path, defer_hash_for=()):
+        """根据stat结果更新条目，返回 'added'、'modified' 或 None（内容未变）
+        
+        新文件的扩展名在defer_hash_for中时暂不计算摘要（记为None），由随后读取该文件的
+        调用方通过record补上，避免冷启动时同一个文件被读取两次。
+        """
+        old = self.entries.get(relative_path)
+        if old and old[0] == st.st_mtime_ns and old[1] == st.st_size:
+            return None
+        if (old is None or old[2] is None) and defer_hash_for and relative_path.endswith(defer_hash_for):
+            self._set_entry(relative_path, (st.st_mtime_ns, st.st_size, None))
+            return 'added' if old is None else 'modified'
+        digest = file_hash(file_path)
+        self._set_entry(relative_path, (st.st_mtime_ns, st.st_size, digest))
+        if old is None:
+            return 'added'
+        return 'modified' if old[2] != digest else None
+    
+    def scan(self, progress=None, is_cancelled=None, defer_hash_for=()):
+        """一次遍历数据目录，返回ChangeSet；is_cancelled()返回True时中止并返回None"""
+        changes = ChangeSet()
+        with self._lock:
+            seen = set()
+            dirs = set()
+            expected = len(self.entries)
+            stack = [self.data_dir]
+            while stack:
+                if is_cancelled and is_cancelled():
+                    return None
+                directory = stack.pop()
+                try:
+                    with os.scandir(directory) as it:
+                        entries = list(it)
+                except OSError as e:
+                    print(f"扫描目录时出错: {directory}, 错误: {str(e)}")
+                    continue
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            dirs.add(self.relative_path(entry.path))
+                            continue
+                        if not entry.is_file() or entry.name.startswith(INTERNAL_FILE_PREFIXES):
+                            continue
+                        relative_path = self.relative_path(entry.path)
+                        seen.add(relative_path)
+                        kind = self._update_entry(relative_path, entry.stat(), entry.path, defer_hash_for)
+                    except OSError as e:
+                        print(f"读取文件信息时出错: {entry.path}, 错误: {str(e)}")
+                        continue
+                    if kind == 'added':
+                        changes.added.append(relative_path)
+                    elif kind == 'modified':
+                        changes.modified.append(relative_path)
+                    if progress:
+                        progress(len(seen), max(expected, len(seen)))
+            for relative_path in set(self.entries) - seen:
+                self._remove_entry(relative_path, changes)
+            changes.pair_moves(lambda path: self.entries[path][2])
+            self._apply_pending_records()
+            if dirs != self.dirs:
+                self.dirs = dirs
+                self.dirty = True
+            if self.dirty or not os.path.exists(self.cache_file):
+                self.save()
+        return changes
+    
+    def scan_dir(self, directory, recursive=False, blocking=True):
+        """只扫描一个目录，返回ChangeSet
+        
+        新出现的子目录总是递归扫描；消失的子目录下的条目全部移除。blocking为False且
+        其他线程正在扫描时立即返回None，调用方稍后重试。
+        """
+        if not self._lock.acquire(blocking):
+            return None
+        try:
+            self._apply_pending_records()
+            changes = ChangeSet()
+            stack = [directory]
+            while stack:
+                directory = stack.pop()
+                relative_dir = self._relative_dir(directory)
+                try:
+                    with os.scandir(directory) as it:
+                        entries = list(it)
+                except OSError:
+                    # 目录已被删除
+                    entries = []
+                seen = set()
+                subdirs = set()
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            relative_path = self.relative_path(entry.path)
+                            subdirs.add(relative_path)
+                            if relative_path not in self.dirs:
+                                self.dirs.add(relative_path)
+                                self.dirty = True
+                                changes.new_dirs.append(relative_path)
+                                stack.append(entry.path)
+                            elif recursive:
+                                stack.append(entry.path)
+                            continue
+                        if not entry.is_file() or entry.name.startswith(INTERNAL_FILE_PREFIXES):
+                            continue
+                        relative_path = self.relative_path(entry.path)
+                        seen.add(relative_path)
+                        kind = self._update_entry(relative_path, entry.stat(), entry.path)
+                    except OSError as e:
+                        print(f"读取文件信息时出错: {entry.path}, 错误: {str(e)}")
+                        continue
+                    if kind == 'added':
+                        changes.added.append(relative_path)
+                    elif kind == 'modified':
+                        changes.modified.append(relative_path)
+                for relative_path in self._children(relative_dir) - seen:
+                    self._remove_entry(relative_path, changes)
+                for relative_path in [d for d in self.dirs
+                                      if d.rpartition('/')[0] == relative_dir and d not in subdirs]:
+                    self._remove_dir(relative_path, changes)
+            return changes
+        finally:
+            self._lock.release()
+    
+    def _remove_dir(self, relative_dir, changes):
+        """移除已消失的目录及其下所有条目"""
+        prefix = relative_dir + '/'
+        for d in [d for d in self.dirs if d == relative_dir or d.startswith(prefix)]:
+            self.dirs.discard(d)
+            changes.removed_dirs.append(d)
+            for relative_path in list(self._children(d)):
+                self._remove_entry(relative_path, changes)
+        self.dirty = True
+    
+    def record(self, file_path, st, digest):
+        """记录已经读取过内容的文件，避免下次扫描时重复计算摘要
+        
+        保存文件时在界面线程中调用，不等待后台扫描：扫描进行中时先暂存，扫描结束后再写入。
+        """
+        self.record_entry(self.relative_path(file_path), st.st_mtime_ns, st.st_size, digest)
+    
+    def record_entry(self, relative_path, mtime_ns, size, digest):
+        item = (relative_path, (mtime_ns, size, digest))
+        if self._lock.acquire(blocking=False):
+            try:
+                self._set_entry(*item)
+            finally:
+                self._lock.release()
+        else:
+            self._pending_records.append(item)
+    
+    def _apply_pending_records(self):
+        while self._pending_records:
+            self._set_entry(*self._pending_records.pop(0))
+    
+    def refresh(self, file_path):
+        """更新单个文件的条目，返回内容是否有变化"""
+        relative_path = self.relative_path(file_path)
+        with self._lock:
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                if relative_path not in self.entries:
+                    return False
+                self._remove_entry(relative_path)
+                return True
+            return self._update_entry(relative_path, st, file_path) is not None
+    
+    def same_content(self, src_path, dst_path):
+        """判断外部文件与数据目录中的文件内容是否相同，数据目录一侧使用缓存的摘要"""
+        if not os.path.exists(dst_path) or os.path.getsize(src_path) != os.path.getsize(dst_path):
+            return False
+        if self.relative_path(dst_path).startswith('..'):
+            # 不在数据目录中的文件没有缓存，直接比较摘要
+            return file_hash(src_path) == file_hash(dst_path)
+        self.refresh(dst_path)
+        entry = self.entries.get(self.relative_path(dst_path))
+        return entry is not None and entry[2] == file_hash(src_path)
+    
+    def copy_to(self, target_dir, progress=None):
+        """把数据目录复制到target_dir，只复制目标中不存在或有变化的文件
+        
+        复制完成后为目标目录写入缓存，切换数据目录后不必重新计算摘要。返回复制的文件数。
+        """
+        self.scan()
+        target = FileStatCache(target_dir)
+        copied = 0
+        total = len(self.entries)
+        for relative_path in sorted(self.dirs):
+            os.makedirs(target.absolute_path(relative_path), exist_ok=True)
+        for i, (relative_path, (mtime_ns, size, digest)) in enumerate(sorted(self.entries.items())):
+            dst_path = target.absolute_path(relative_path)
+            try:
+                st = os.stat(dst_path)
+                unchanged = st.st_size == size and st.st_mtime_ns == mtime_ns
+            except OSError:
+                unchanged = False
+            if not unchanged:
+                os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                shutil.copy2(self.absolute_path(relative_path), dst_path)
+                st = os.stat(dst_path)
+                copied += 1
+            target.entries[relative_path] = (st.st_mtime_ns, st.st_size, digest)
+            if progress:
+                progress(i + 1, total)
+        target.dirs |= self.dirs
+        target.save()
+        return copied
\ No newline at end of file
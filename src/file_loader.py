@@ -0,0 +1,46 @@
+import os
+from PyQt5.QtCore import QThread, pyqtSignal
+
+class LoadWorker(QThread):
+    """在后台线程中读取文本文件
+    
+    数据目录可能在网络驱动器或U盘上，读取可能很慢。按CHUNK_BYTES分块读取并报告进度，
+    可以随时取消；换行符和以文本模式读取时一样统一为\\n。
+    """
+    CHUNK_BYTES = 1 << 20
+    
+    # 已读取的字节数、文件大小
+    progress = pyqtSignal(int, int)
+    loaded = pyqtSignal(str, str)
+    # 文件路径、错误信息
+    failed = pyqtSignal(str, str)
+    
+    def __init__(self, file_path, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self._cancelled = False
+    
+    def cancel(self):
+        self._cancelled = True
+    
+    def run(self):
+        try:
+            with open(self.file_path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                chunks = []
+                done = 0
+                while not self._cancelled:
+                    chunk = f.read(self.CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                    done += len(chunk)
+                    self.progress.emit(done, size)
+            if self._cancelled:
+                return
+            content = b''.join(chunks).decode('utf-8')
+        except Exception as e:
+            if not self._cancelled:
+                self.failed.emit(self.file_path, str(e))
+            return
+        self.loaded.emit(self.file_path, content.replace('\r\n', '\n').replace('\r', '\n'))
\ No newline at end of file
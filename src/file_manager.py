@@ -5,6 +5,11 @@ from PyQt5.QtCore import Qt, pyqtSignal, QEvent, QModelIndex
 
 class FileManager(QWidget):
     file_clicked = pyqtSignal(str)
+    # 通过文件管理器新建/复制得到的文件或文件夹，以及删除的文件或文件夹（绝对路径）
+    item_created = pyqtSignal(str)
+    item_deleted = pyqtSignal(str)
+    # 复制的源路径和目标路径
+    item_copied = pyqtSignal(str, str)
     
     def __init__(self, data_dir):
         super().__init__()
@@ -221,6 +226,7 @@ class FileManager(QWidget):
                     
                     # 刷新文件管理器
                     self.refresh()
+                    self.item_created.emit(file_path)
                     
                     # 返回新文件路径，以便主窗口打开它
                     return file_path
@@ -256,6 +262,7 @@ class FileManager(QWidget):
                 
                 # 刷新文件管理器
                 self.refresh()
+                self.item_deleted.emit(file_path)
             except Exception as e:
                 QMessageBox.critical(self, "删除失败", f"删除 '{file_name}' 失败: {str(e)}")
     
@@ -297,6 +304,8 @@ class FileManager(QWidget):
             
             # 刷新文件管理器
             self.refresh()
+            self.item_created.emit(target_path)
+            self.item_copied.emit(source_path, target_path)
             
             QMessageBox.information(self, "复制成功", f"已成功复制到 {target_path}")
         except Exception as e:
@@ -0,0 +1,238 @@
+import os
+import mmap
+import time
+from bisect import bisect_right
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPlainTextEdit, QScrollBar, QLabel
+from PyQt5.QtGui import QFont, QTextOption
+from PyQt5.QtCore import Qt, pyqtSignal, QThread
+
+# 行索引中每隔多少字节记录一个行首位置
+CHECKPOINT_BYTES = 1 << 20
+# 一次读入文档的最大字节数（超长的行被截断）
+MAX_WINDOW_BYTES = 8 << 20
+
+class LargeTextFile:
+    """只读方式打开的大文本文件
+    
+    文件用mmap映射，不整体读入内存。行索引是稀疏的：每CHECKPOINT_BYTES字节记录一个
+    (行号, 行首位置)，读取某一行时从它之前最近的记录位置向后查找换行符。
+    建立索引之前只能读取文件开头的部分（从第0行向后查找）。
+    """
+    
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.file = open(file_path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        # (记录的行号列表, 对应的行首位置列表)，整体替换，读取时不会看到一半更新的索引
+        self.checkpoints = ([0], [0])
+        # 总行数，建立索引之前为None
+        self.line_count = None
+    
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+    
+    def build_index(self, progress=None, is_cancelled=None):
+        """扫描整个文件建立行索引（可在后台线程中运行），被取消时返回False"""
+        lines, offsets = [0], [0]
+        line = 0
+        offset = 0
+        while offset < self.size:
+            if is_cancelled and is_cancelled():
+                return False
+            end = min(offset + CHECKPOINT_BYTES, self.size)
+            chunk = self.data[offset:end]
+            count = chunk.count(b'\n')
+            if count:
+                line += count
+                lines.append(line)
+                offsets.append(offset + chunk.rfind(b'\n') + 1)
+            offset = end
+            if progress:
+                progress(offset, self.size)
+        self.checkpoints = (lines, offsets)
+        # 最后一行没有换行符时也算一行
+        self.line_count = line + (1 if self.size and self.data[self.size - 1:self.size] != b'\n' else 0)
+        return True
+    
+    def offset_of_line(self, line):
+        lines, offsets = self.checkpoints
+        i = bisect_right(lines, line) - 1
+        position = offsets[i]
+        for _ in range(line - lines[i]):
+            position = self.data.find(b'\n', position) + 1
+            if position == 0:
+                return self.size
+        return position
+    
+    def read_lines(self, start, count):
+        """读取从第start行（从0开始）开始的最多count行，返回 (文本, 行数)"""
+        begin = self.offset_of_line(start)
+        limit = min(self.size, begin + MAX_WINDOW_BYTES)
+        end = begin
+        read = 0
+        while read < count and end < limit:
+            position = self.data.find(b'\n', end, limit)
+            end = limit if position < 0 else position + 1
+            read += 1
+        text = self.data[begin:end].decode('utf-8', errors='replace').replace('\r\n', '\n')
+        if text.endswith('\n'):
+            text = text[:-1]
+        return text, read
+
+class LargeFileIndexer(QThread):
+    """在后台线程中建立大文件的行索引"""
+    progress = pyqtSignal(int, int)
+    # 总行数、用时（秒）
+    indexed = pyqtSignal(int, float)
+    
+    def __init__(self, large_file, parent=None):
+        super().__init__(parent)
+        self.large_file = large_file
+        self._cancelled = False
+        self._last_percent = -1
+    
+    def cancel(self):
+        self._cancelled = True
+    
+    def report(self, done, total):
+        # 每变化1%发送一次进度
+        percent = done * 100 // max(total, 1)
+        if percent != self._last_percent:
+            self._last_percent = percent
+            self.progress.emit(percent, 100)
+    
+    def run(self):
+        start_time = time.perf_counter()
+        if self.large_file.build_index(self.report, lambda: self._cancelled):
+            self.indexed.emit(self.large_file.line_count, time.perf_counter() - start_time)
+
+class LargeFileView(QWidget):
+    """大文件的只读查看器
+    
+    文档中只保存当前位置附近的WINDOW_LINES行，滚动到窗口边缘时从文件中读取新的窗口，
+    内存占用与文件大小无关。不换行、不做语法高亮；右侧的滚动条按行定位整个文件。
+    """
+    WINDOW_LINES = 2000
+    # 距离窗口边缘少于这么多行时换窗口
+    EDGE_LINES = 200
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.large_file = None
+        self.window_start = 0
+        self.window_lines = 0
+        
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.info_label = QLabel()
+        layout.addWidget(self.info_label)
+        
+        text_layout = QHBoxLayout()
+        text_layout.setSpacing(0)
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setUndoRedoEnabled(False)
+        self.text.setFont(QFont("Consolas", 12))
+        self.text.setWordWrapMode(QTextOption.NoWrap)
+        self.text.setLineWrapMode(QPlainTextEdit.NoWrap)
+        # 文本框自己的滚动条只在窗口内滚动，隐藏后用整个文件的滚动条代替
+        self.text.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.text.verticalScrollBar().valueChanged.connect(self.on_text_scrolled)
+        self.scroll_bar = QScrollBar(Qt.Vertical)
+        self.scroll_bar.valueChanged.connect(self.scroll_to_line)
+        text_layout.addWidget(self.text)
+        text_layout.addWidget(self.scroll_bar)
+        layout.addLayout(text_layout)
+    
+    def open(self, large_file):
+        self.large_file = large_file
+        self.window_start = 0
+        self.load_window(0)
+        self.update_range()
+    
+    def close_file(self):
+        if self.large_file is not None:
+            self.large_file.close()
+            self.large_file = None
+        self.text.clear()
+    
+    def update_range(self):
+        """行索引建立后，滚动条的范围扩大到整个文件"""
+        known = self.large_file.line_count
+        if known is None:
+            # 还没有建立索引，只能在已经读入的行中滚动
+            known = self.window_start + self.window_lines
+        self.scroll_bar.blockSignals(True)
+        self.scroll_bar.setRange(0, max(0, known - 1))
+        self.scroll_bar.setPageStep(max(1, self.visible_lines()))
+        self.scroll_bar.blockSignals(False)
+        self.update_info()
+    
+    def visible_lines(self):
+        return self.text.viewport().height() // max(1, self.text.fontMetrics().height())
+    
+    def load_window(self, start):
+        text, self.window_lines = self.large_file.read_lines(start, self.WINDOW_LINES)
+        self.window_start = start
+        self.text.verticalScrollBar().blockSignals(True)
+        self.text.setPlainText(text)
+        self.text.verticalScrollBar().blockSignals(False)
+    
+    def scroll_to_line(self, line):
+        """滚动到第line行（从0开始），不在当前窗口中时重新读取窗口"""
+        if self.large_file is None:
+            return
+        offset = line - self.window_start
+        if offset < 0 or (offset + self.visible_lines() > self.window_lines and self.has_more()):
+            self.load_window(max(0, line - self.EDGE_LINES))
+            offset = line - self.window_start
+        # 不换行时文本框的滚动条以行为单位
+        self.text.verticalScrollBar().blockSignals(True)
+        self.text.verticalScrollBar().setValue(offset)
+        self.text.verticalScrollBar().blockSignals(False)
+        self.update_info()
+    
+    def has_more(self):
+        """当前窗口之后是否还有行"""
+        total = self.large_file.line_count
+        return total is None or self.window_start + self.window_lines < total
+    
+    def go_to_line(self, line):
+        self.scroll_bar.setValue(line)
+        self.scroll_to_line(line)
+    
+    def on_text_scrolled(self, value):
+        """在文本框中滚动（滚轮、键盘、拖选）时同步整个文件的滚动条，接近窗口边缘时换窗口"""
+        if self.large_file is None:
+            return
+        line = self.window_start + value
+        near_end = value > self.window_lines - self.visible_lines() - self.EDGE_LINES
+        if (near_end and self.has_more()) or (value < self.EDGE_LINES and self.window_start > 0):
+            self.load_window(max(0, line - self.WINDOW_LINES // 2))
+            self.text.verticalScrollBar().blockSignals(True)
+            self.text.verticalScrollBar().setValue(line - self.window_start)
+            self.text.verticalScrollBar().blockSignals(False)
+            if self.large_file.line_count is None:
+                self.update_range()
+        self.scroll_bar.blockSignals(True)
+        self.scroll_bar.setValue(line)
+        self.scroll_bar.blockSignals(False)
+        self.update_info()
+    
+    def current_line(self):
+        return self.window_start + self.text.verticalScrollBar().value()
+    
+    def update_info(self):
+        if self.large_file is None:
+            return
+        total = self.large_file.line_count
+        lines = f"第 {self.current_line() + 1} 行 / 共 {total} 行" if total is not None else "正在建立行索引..."
+        self.info_label.setText(f"只读（大文件模式，{self.large_file.size / (1 << 20):.0f} MB）  {lines}")
+    
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.large_file is not None:
+            self.update_range()
\ No newline at end of file
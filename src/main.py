@@ -1,8 +1,12 @@
 import sys
 import os
+import time
+import multiprocessing
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtCore import QFile, QTextStream
 from main_window import MainWindow
+from config_manager import ConfigManager
+from search_index import SearchIndex
 
 def get_resource_path(relative_path):
     """获取资源文件的绝对路径，兼容PyInstaller打包后的情况"""
@@ -35,7 +39,34 @@ def ensure_directories():
     if not os.path.exists(resources_dir):
         os.makedirs(resources_dir)
 
+def rebuild_search_index():
+    """命令行重建搜索索引：python src/main.py --reindex"""
+    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    data_dir = ConfigManager(app_dir).get("data_dir")
+    if not data_dir or not os.path.exists(data_dir):
+        print(f"数据目录不存在: {data_dir}")
+        return 1
+    
+    print(f"正在重建搜索索引: {data_dir}")
+    index = SearchIndex(data_dir)
+    start_time = time.perf_counter()
+    updated, _ = index.rebuild()
+    elapsed = time.perf_counter() - start_time
+    # 保存重新索引时计算的内容摘要，否则下次启动时的同步会再次索引全部笔记
+    index.cache.save()
+    index.close()
+    print(f"搜索索引已重建，共索引 {updated} 个文件，用时 {elapsed:.1f} 秒"
+          f"（{updated / max(elapsed, 1e-6):.0f} 个/秒）")
+    return 0
+
 if __name__ == "__main__":
+    # 打包后多进程建立索引需要
+    multiprocessing.freeze_support()
+
+    # 命令行重建索引，不启动界面
+    if "--reindex" in sys.argv:
+        sys.exit(rebuild_search_index())
+    
     # 确保必要的目录存在
     ensure_directories()
     
@@ -11,8 +11,19 @@ from file_manager import FileManager
 from search_widget import SearchWidget
 from tag_manager import TagManager
 from config_manager import ConfigManager
-from PyQt5.QtWidgets import QMainWindow, QWidget, QHBoxLayout, QVBoxLayout, QTabWidget, QAction, QFileDialog, QMessageBox, QInputDialog, QSplitter, QShortcut
-from PyQt5.QtCore import Qt, QTimer
+from file_cache import FileStatCache
+from vault_watcher import VaultWatcher
+from text_analyzer import Analyzer, has_jieba
+from quick_open import PathIndex, QuickOpenDialog
+from large_file import LargeTextFile, LargeFileIndexer, LargeFileView
+from preview import MarkdownPreview
+from outline import OutlinePanel
+from autosave import AutoSaver
+from document_cache import CachedDocument, DocumentCache
+from file_loader import LoadWorker
+from search_index import NOTE_EXTENSIONS
+from PyQt5.QtWidgets import QMainWindow, QWidget, QHBoxLayout, QVBoxLayout, QTabWidget, QAction, QFileDialog, QMessageBox, QInputDialog, QSplitter, QShortcut, QStackedWidget, QProgressBar, QTabBar
+from PyQt5.QtCore import Qt, QTimer, QEvent
 from PyQt5.QtGui import QKeySequence
 
 class MainWindow(QMainWindow):
@@ -34,6 +45,14 @@ class MainWindow(QMainWindow):
                 os.makedirs(self.data_dir)
             self.config_manager.set("data_dir", self.data_dir)
         
+        # 数据目录的文件元数据缓存，搜索索引、导入和数据迁移共用
+        self.file_cache = FileStatCache(self.data_dir)
+        
+        # 快速打开（Ctrl+P）的路径索引，先用缓存中的文件列表，索引同步完成后再刷新
+        self.path_index = PathIndex(NOTE_EXTENSIONS)
+        self.reset_path_index()
+        self.quick_open_dialog = None
+        
         # 移除对init_ui的调用，直接在这里初始化UI
         # self.init_ui()  # 删除这一行
         
@@ -58,29 +77,95 @@ class MainWindow(QMainWindow):
         # 文件管理器标签页
         self.file_manager = FileManager(self.data_dir)
         self.file_manager.file_clicked.connect(self.open_file)  # 确保这行代码存在
+        self.file_manager.item_created.connect(self.on_item_created)
+        self.file_manager.item_deleted.connect(self.on_item_deleted)
+        self.file_manager.item_copied.connect(self.on_item_copied)
         self.left_tabs.addTab(self.file_manager, "文件")
         
         # 搜索标签页
-        self.search_widget = SearchWidget(self.data_dir)
+        self.search_widget = SearchWidget(self.data_dir, self.config_manager.get("search_debounce_ms", 200),
+                                          self.file_cache)
         self.search_widget.file_clicked.connect(self.open_file)
+        self.search_widget.file_line_clicked.connect(self.open_file_at_line)
         self.left_tabs.addTab(self.search_widget, "搜索")
         
-        # 标签管理器标签页
-        #self.tag_manager = TagManager(self.data_dir)
-        # 修改这一行，使用tag_selected而不是tag_clicked
-        #self.tag_manager.tag_selected.connect(self.show_files_by_tag)
-        #self.left_tabs.addTab(self.tag_manager, "标签")
+        # 标签管理器标签页（按标签组合筛选文件）
+        self.tag_manager = self.create_tag_manager(self.data_dir)
+        self.left_tabs.addTab(self.tag_manager, "标签")
+        
+        # 大纲标签页（当前文档的标题列表）
+        self.outline = OutlinePanel()
+        self.left_tabs.addTab(self.outline, "大纲")
         
         left_layout.addWidget(self.left_tabs)
         
         # 创建编辑器
         self.editor = MarkdownEditor()
+        self.outline.set_model(self.editor.highlighter.headings)
+        self.outline.heading_clicked.connect(self.editor.go_to_position)
+        
+        # 超过大小阈值的文件用只读的大文件查看器打开，和编辑器放在同一位置切换显示
+        self.large_file_view = LargeFileView()
+        self.large_file_indexer = None
+        self.editor_stack = QStackedWidget()
+        self.editor_stack.addWidget(self.editor)
+        self.editor_stack.addWidget(self.large_file_view)
+        self.large_file_progress = QProgressBar()
+        self.large_file_progress.setMaximumWidth(200)
+        self.large_file_progress.hide()
+        self.statusBar().addPermanentWidget(self.large_file_progress)
+        
+        # 在后台读取的文件；读取完成后在编辑器中显示时要执行的操作 {文件路径: [回调]}
+        self.loading_file = None
+        self.load_worker = None
+        self.reload_worker = None
+        self.when_shown = {}
+        
+        # 最近打开的文档的缓存
+        self.document_cache = DocumentCache(self.config_manager.get("document_cache_size", 20),
+                                            self.config_manager.get("document_cache_mb", 32) << 20)
+        
+        # 修改后自动保存，未保存的修改记入恢复日志；保存后在保存线程中更新搜索索引和标签
+        self.autosaver = AutoSaver(self.editor.editor.document(),
+                                   os.path.join(self.config_manager.app_dir, "recovery.journal"),
+                                   self.config_manager.get("autosave_delay_ms", 1000),
+                                   self.after_file_saved, self)
+        self.autosaver.saved.connect(self.on_file_saved)
+        self.autosaver.failed.connect(self.on_save_failed)
+        self.autosaver.modification_changed.connect(self.update_dirty_indicator)
+        
+        # 编辑器右侧的Markdown预览，编辑时只更新变化的部分
+        self.preview = MarkdownPreview()
+        self.preview.attach(self.editor.editor.document())
+        
+        # 标签页只保存文件路径（以及离开时的光标和滚动位置），切换到标签页时才打开文件
+        self.tab_bar = QTabBar()
+        self.tab_bar.setTabsClosable(True)
+        self.tab_bar.setMovable(True)
+        self.tab_bar.setExpanding(False)
+        self.tab_bar.setDocumentMode(True)
+        self.tab_bar.setElideMode(Qt.ElideMiddle)
+        self.tab_bar.currentChanged.connect(self.on_tab_changed)
+        self.tab_bar.tabCloseRequested.connect(self.close_tab)
+        # {文件路径: (光标位置, 滚动位置)}，文档不在缓存中时据此恢复
+        self.tab_states = {}
+        editor_area = QWidget()
+        editor_area_layout = QVBoxLayout(editor_area)
+        editor_area_layout.setContentsMargins(0, 0, 0, 0)
+        editor_area_layout.setSpacing(0)
+        editor_area_layout.addWidget(self.tab_bar)
+        editor_area_layout.addWidget(self.editor_stack)
+        
+        self.editor_splitter = QSplitter(Qt.Horizontal)
+        self.editor_splitter.addWidget(editor_area)
+        self.editor_splitter.addWidget(self.preview)
+        self.preview.setVisible(self.config_manager.get("show_preview", False))
         
         # 创建分割器
         self.splitter = QSplitter(Qt.Horizontal)
         self.splitter.setObjectName("main_splitter")
         self.splitter.addWidget(self.left_panel)
-        self.splitter.addWidget(self.editor)
+        self.splitter.addWidget(self.editor_splitter)
         self.splitter.setStretchFactor(1, 1)  # 编辑器区域可以伸展
         
         # 添加到主布局
@@ -96,6 +181,105 @@ class MainWindow(QMainWindow):
         
         # 设置快捷键
         self.setup_shortcuts()
+        
+        # 监视数据目录的外部变化，并在后台同步搜索索引
+        self.start_vault_watcher()
+        self.search_widget.index_ready.connect(lambda: self.vault_watcher.watch_known_dirs())
+        self.search_widget.index_ready.connect(lambda: self.reset_path_index(self.path_index.recent))
+        # 索引同步后文件缓存是最新的，据此重新提取有变化的笔记中的标签
+        self.search_widget.index_ready.connect(lambda: self.tag_manager.sync_content_tags())
+        self.search_widget.index_rebuilt.connect(self.on_index_rebuilt)
+        self.search_widget.start_index_sync()
+    
+        self.restore_session()
+        # 上次异常退出时留下的未保存修改
+        QTimer.singleShot(0, self.recover_unsaved)
+    
+    def start_vault_watcher(self):
+        """为当前数据目录创建监视器"""
+        self.vault_watcher = VaultWatcher(self.file_cache, self.config_manager.get("vault_watcher", "auto"), self)
+        self.vault_watcher.changes_detected.connect(self.on_vault_changed)
+        self.vault_watcher.start()
+    
+    def on_vault_changed(self, changes):
+        """数据目录被外部修改（其他编辑器、git、脚本等）后增量更新索引、标签和编辑器"""
+        self.search_widget.apply_changes(changes)
+        self.path_index.apply_changes(changes)
+        self.tag_manager.apply_changes(changes)
+        for old_path, new_path in changes.moved:
+            self.document_cache.rename(self.file_cache.absolute_path(old_path), self.file_cache.absolute_path(new_path))
+            self.rename_tab(self.file_cache.absolute_path(old_path), self.file_cache.absolute_path(new_path))
+        for path in changes.removed:
+            self.document_cache.remove(self.file_cache.absolute_path(path))
+            self.remove_closed_tab(self.file_cache.absolute_path(path))
+        
+        if self.is_large_file_open():
+            large_path = self.file_cache.relative_path(self.large_file_view.large_file.file_path)
+            if large_path in changes.modified or large_path in changes.removed or \
+                    any(old_path == large_path for old_path, _ in changes.moved):
+                # 文件映射在内存中，被外部修改后必须重新打开
+                file_path = self.large_file_view.large_file.file_path
+                self.close_large_file()
+                if os.path.exists(file_path):
+                    self.open_large_file(file_path)
+                self.statusBar().showMessage("大文件已被外部修改，已重新打开", 3000)
+            return
+        
+        current_file = self.editor.current_file
+        if not current_file:
+            return
+        relative_path = self.file_cache.relative_path(current_file)
+        for old_path, new_path in changes.moved:
+            if old_path == relative_path:
+                # 当前文件被移动或重命名，跟随到新路径
+                self.editor.current_file = self.file_cache.absolute_path(new_path)
+                self.autosaver.rename(self.editor.current_file)
+                self.setWindowTitle(f"积厚文本管理工具 - {os.path.basename(self.editor.current_file)}")
+                self.vault_watcher.watch_file(self.editor.current_file)
+                self.statusBar().showMessage(f"文件已被移动到: {self.editor.current_file}", 3000)
+                return
+        if relative_path in changes.removed:
+            # 不再自动保存，避免重新创建被删除的文件
+            self.stop_editing_file()
+            self.statusBar().showMessage("当前文件已被删除或移走，可以用“另存为”保存编辑器中的内容")
+        elif relative_path in changes.modified:
+            if self.autosaver.unsaved_text(current_file) is not None:
+                # 自动保存自己写入的修改
+                return
+            if self.editor.editor.document().isModified():
+                self.statusBar().showMessage("当前文件已被外部修改，保存将覆盖外部修改")
+            else:
+                self.reload_file(current_file)
+    
+    def reload_file(self, file_path):
+        """在后台重新读取被外部修改的当前文件"""
+        if self.reload_worker is not None:
+            self.reload_worker.cancel()
+        self.reload_worker = LoadWorker(file_path, self)
+        self.reload_worker.loaded.connect(self.on_file_reloaded)
+        self.reload_worker.failed.connect(self.on_reload_failed)
+        self.reload_worker.start()
+    
+    def on_file_reloaded(self, file_path, content):
+        if self.sender() is not self.reload_worker:
+            return
+        self.reload_worker = None
+        # 读取期间切换了文件或者开始了编辑时不再重新加载
+        if file_path != self.editor.current_file or self.editor.editor.document().isModified():
+            return
+        if content == self.editor.get_content():
+            return
+        self.autosaver.set_file(None)
+        self.editor.reload_content(content)
+        self.autosaver.set_file(file_path)
+        self.document_cache.update_stat(file_path)
+        self.statusBar().showMessage("当前文件已被外部修改，已重新加载", 3000)
+    
+    def on_reload_failed(self, file_path, message):
+        if self.sender() is not self.reload_worker:
+            return
+        self.reload_worker = None
+        self.statusBar().showMessage(f"重新加载文件失败: {message}")
     
     # 在create_menus方法中修改视图菜单部分
     def create_menus(self):
@@ -138,10 +322,9 @@ class MainWindow(QMainWindow):
         # 编辑菜单
         edit_menu = menubar.addMenu("编辑")
         
-        # 移除添加标签选项
-        # add_tag_action = QAction("添加标签", self)
-        # add_tag_action.triggered.connect(self.add_tag_to_current_file)
-        # edit_menu.addAction(add_tag_action)
+        add_tag_action = QAction("添加标签", self)
+        add_tag_action.triggered.connect(self.add_tag_to_current_file)
+        edit_menu.addAction(add_tag_action)
         
         # 视图菜单
         view_menu = self.menuBar().addMenu("视图")
@@ -153,6 +336,12 @@ class MainWindow(QMainWindow):
         toggle_line_numbers_action.triggered.connect(self.toggle_line_numbers)
         view_menu.addAction(toggle_line_numbers_action)
         
+        toggle_preview_action = QAction("显示预览", self)
+        toggle_preview_action.setCheckable(True)
+        toggle_preview_action.setChecked(self.preview.isVisibleTo(self.editor_splitter))
+        toggle_preview_action.triggered.connect(self.toggle_preview)
+        view_menu.addAction(toggle_preview_action)
+        
         # 帮助菜单
         help_menu = self.menuBar().addMenu("帮助")
         about_action = QAction("关于", self)
@@ -172,6 +361,27 @@ class MainWindow(QMainWindow):
         data_dir_action = QAction("更改数据目录", self)
         data_dir_action.triggered.connect(self.change_data_dir)
         settings_menu.addAction(data_dir_action)
+        
+        settings_menu.addSeparator()
+        
+        # 重建搜索索引（索引损坏时使用）
+        rebuild_index_action = QAction("重建搜索索引", self)
+        rebuild_index_action.triggered.connect(self.rebuild_search_index)
+        settings_menu.addAction(rebuild_index_action)
+        
+        # 搜索分词方式，每个数据目录单独保存
+        analyzer_menu = settings_menu.addMenu("搜索分词方式")
+        self.jieba_action = QAction("中文使用jieba词典分词", self)
+        self.jieba_action.setCheckable(True)
+        self.jieba_action.setEnabled(has_jieba())
+        self.stemming_action = QAction("英文按词干匹配", self)
+        self.stemming_action.setCheckable(True)
+        self.strip_markdown_action = QAction("忽略Markdown语法（链接地址、HTML标签）", self)
+        self.strip_markdown_action.setCheckable(True)
+        for action in (self.jieba_action, self.stemming_action, self.strip_markdown_action):
+            action.triggered.connect(self.change_search_analyzer)
+            analyzer_menu.addAction(action)
+        analyzer_menu.aboutToShow.connect(self.update_analyzer_actions)
     
     def new_file(self):
         """新建文件"""
@@ -181,9 +391,10 @@ class MainWindow(QMainWindow):
             if not name.endswith(('.txt', '.md')):
                 name += '.md'  # 默认使用Markdown格式
             file_path = os.path.join(self.data_dir, name)
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write('')
+            # 在保存线程中创建，写入之前打开时使用排队的内容
+            self.autosaver.save_text(file_path, '')
             self.file_manager.refresh()
+            self.on_item_created(file_path)
             self.open_file(file_path)
     
     def open_file_dialog(self):
@@ -195,140 +406,390 @@ class MainWindow(QMainWindow):
             self.open_file(file_path)
     
     def open_file(self, file_path):
+        """在标签页中打开文件，已经打开时切换到该标签页"""
+        previous = self.tab_bar.currentIndex()
+        index = self.find_tab(file_path)
+        added = index < 0
+        if added:
+            index = self.add_tab(file_path, previous + 1)
+        self.tab_bar.blockSignals(True)
+        self.tab_bar.setCurrentIndex(index)
+        self.tab_bar.blockSignals(False)
+        if not self.show_file(file_path) and added:
+            self.tab_bar.blockSignals(True)
+            self.tab_bar.removeTab(index)
+            self.tab_bar.setCurrentIndex(self.find_tab(self.editor.current_file) if self.editor.current_file else previous)
+            self.tab_bar.blockSignals(False)
+    
+    def show_file(self, file_path):
+        """在编辑器中显示文件（需要读取时在后台读取），出错时返回False"""
+        if file_path == self.loading_file:
+            return True
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            self.editor.set_content(content)
-            self.editor.current_file = file_path
-            self.setWindowTitle(f"积厚文本管理工具 - {os.path.basename(file_path)}")
-            
-            # 在状态栏显示完整路径
-            self.statusBar().showMessage(f"文件: {file_path}")
-            
-            # 移除更新当前文件的标签
-            # self.tag_manager.update_current_file_tags(file_path)
-            
-            # 根据当前行号显示状态更新编辑器
-            if hasattr(self.editor, 'line_numbers_visible') and not self.editor.line_numbers_visible:
-                # 如果行号当前是隐藏状态，确保在新文件中也隐藏行号
-                self.editor.line_number_area.hide()
-                self.editor.editor.setViewportMargins(0, 0, 0, 0)
-                self.editor.editor.update()
+            if self.is_large_file_open():
+                if file_path == self.large_file_view.large_file.file_path:
+                    # 已经以大文件模式打开，不重新建立行索引
+                    return True
+            elif file_path == self.editor.current_file:
+                # 已经打开，编辑器中的文档是最新的
+                return True
+            # 最近打开过且文件没有变化时直接换上缓存的文档
+            entry = self.document_cache.get(file_path)
+            content = None
+            if entry is None:
+                # 还没有写入磁盘的内容比磁盘上的新
+                content = self.autosaver.unsaved_text(file_path)
+                if content is None:
+                    if os.path.getsize(file_path) > self.config_manager.get("large_file_threshold_mb", 50) * (1 << 20):
+                        self.open_large_file(file_path)
+                    else:
+                        self.load_file(file_path)
+                    return True
+            self.display_file(file_path, entry, content)
+            return True
         except Exception as e:
             QMessageBox.critical(self, "错误", f"无法打开文件: {str(e)}")
+            return False
+    
+    def load_file(self, file_path):
+        """在后台读取文件，读取期间编辑器显示只读的占位文档"""
+        self.cancel_loading()
+        self.close_large_file()
+        self.autosaver.finish_file()
+        self.remember_view_state()
+        self.editor.current_file = None
+        placeholder = self.editor.create_document()
+        placeholder.setPlainText(f"正在打开 {file_path} ...")
+        self.show_document(placeholder)
+        self.editor.editor.setReadOnly(True)
+        self.setWindowTitle(f"积厚文本管理工具 - {os.path.basename(file_path)}")
+        self.statusBar().showMessage(f"正在打开: {file_path}")
+        
+        self.loading_file = file_path
+        self.load_worker = LoadWorker(file_path, self)
+        self.load_worker.progress.connect(self.on_load_progress)
+        self.load_worker.loaded.connect(self.on_file_loaded)
+        self.load_worker.failed.connect(self.on_load_failed)
+        self.load_worker.start()
+    
+    def cancel_loading(self):
+        """放弃正在进行的读取（已切换到其他文件）"""
+        if self.load_worker is not None:
+            self.load_worker.cancel()
+            self.load_worker = None
+            self.large_file_progress.hide()
+        if self.loading_file is not None:
+            self.when_shown.pop(self.loading_file, None)
+            self.loading_file = None
+        self.editor.editor.setReadOnly(False)
+    
+    def on_load_progress(self, done, total):
+        if self.sender() is not self.load_worker or total <= LoadWorker.CHUNK_BYTES:
+            return
+        self.large_file_progress.setValue(done * 100 // total)
+        self.large_file_progress.show()
+    
+    def on_file_loaded(self, file_path, content):
+        if self.sender() is not self.load_worker:
+            return
+        self.load_worker = None
+        self.loading_file = None
+        self.large_file_progress.hide()
+        self.editor.editor.setReadOnly(False)
+        self.display_file(file_path, None, content)
+    
+    def on_load_failed(self, file_path, message):
+        if self.sender() is not self.load_worker:
+            return
+        self.cancel_loading()
+        self.when_shown.pop(file_path, None)
+        QMessageBox.critical(self, "错误", f"无法打开文件: {message}")
+        index = self.find_tab(file_path)
+        if index >= 0:
+            self.close_tab(index)
+    
+    def run_when_shown(self, file_path, callback):
+        """文件显示在编辑器中之后执行callback（文件正在后台读取时等读取完成）"""
+        if file_path == self.editor.current_file and self.loading_file is None:
+            callback()
+        else:
+            self.when_shown.setdefault(file_path, []).append(callback)
+    
+    def display_file(self, file_path, entry=None, content=None):
+        """在编辑器中显示缓存的文档entry，或者用content创建新文档"""
+        self.cancel_loading()
+        self.close_large_file()
+        self.autosaver.finish_file()
+        self.remember_view_state()
+        if entry is None:
+            entry = CachedDocument(file_path, self.editor.create_document())
+            self.show_document(entry.document)
+            self.editor.set_content(content)
+            if file_path in self.tab_states:
+                self.editor.restore_position(*self.tab_states[file_path])
+        else:
+            self.show_document(entry.document, entry.view_state)
+        self.document_cache.put(entry)
+        self.editor.current_file = file_path
+        self.autosaver.set_file(file_path)
+        self.preview.reset(os.path.dirname(file_path))
+        self.vault_watcher.watch_file(file_path)
+        self.path_index.touch(self.file_cache.relative_path(file_path))
+        self.update_dirty_indicator()
+        
+        # 在状态栏显示完整路径
+        self.statusBar().showMessage(f"文件: {file_path}")
+        
+        # 更新当前文件的标签
+        self.tag_manager.update_current_file_tags(file_path)
+        
+        # 根据当前行号显示状态更新编辑器
+        if hasattr(self.editor, 'line_numbers_visible') and not self.editor.line_numbers_visible:
+            # 如果行号当前是隐藏状态，确保在新文件中也隐藏行号
+            self.editor.line_number_area.hide()
+            self.editor.editor.setViewportMargins(0, 0, 0, 0)
+            self.editor.editor.update()
+        for callback in self.when_shown.pop(file_path, []):
+            callback()
+    
+    def find_tab(self, file_path):
+        for index in range(self.tab_bar.count()):
+            if self.tab_bar.tabData(index) == file_path:
+                return index
+        return -1
+    
+    def add_tab(self, file_path, index=-1):
+        """添加标签页（不切换到该标签页，不读取文件）"""
+        self.tab_bar.blockSignals(True)
+        index = self.tab_bar.insertTab(index, os.path.basename(file_path))
+        self.tab_bar.setTabData(index, file_path)
+        self.tab_bar.setTabToolTip(index, file_path)
+        self.tab_bar.blockSignals(False)
+        return index
+    
+    def on_tab_changed(self, index):
+        if index < 0:
+            self.show_blank()
+            return
+        file_path = self.tab_bar.tabData(index)
+        if not os.path.isfile(file_path):
+            # 文件已被删除（例如上次会话之后）
+            self.statusBar().showMessage(f"文件不存在: {file_path}", 3000)
+            self.tab_bar.removeTab(index)
+            return
+        self.show_file(file_path)
+    
+    def close_tab(self, index):
+        """关闭标签页，关闭的是当前标签页时切换到相邻的标签页（修改在切换时保存）"""
+        self.tab_states.pop(self.tab_bar.tabData(index), None)
+        self.tab_bar.removeTab(index)
+    
+    def rename_tab(self, old_path, new_path):
+        """文件或目录被移动，标签页跟随到新路径"""
+        prefix = os.path.join(old_path, '')
+        for index in range(self.tab_bar.count()):
+            file_path = self.tab_bar.tabData(index)
+            if file_path == old_path or file_path.startswith(prefix):
+                file_path = new_path + file_path[len(old_path):]
+                self.tab_bar.setTabData(index, file_path)
+                self.tab_bar.setTabText(index, os.path.basename(file_path))
+                self.tab_bar.setTabToolTip(index, file_path)
+        self.update_dirty_indicator()
+        for file_path in list(self.tab_states):
+            if file_path == old_path or file_path.startswith(prefix):
+                self.tab_states[new_path + file_path[len(old_path):]] = self.tab_states.pop(file_path)
+    
+    def update_dirty_indicator(self, modified=None):
+        """有未保存的修改时在当前标签页和窗口标题的文件名后显示 *"""
+        file_path = self.editor.current_file
+        if not file_path:
+            return
+        if modified is None:
+            modified = self.editor.editor.document().isModified()
+        name = os.path.basename(file_path) + (" *" if modified else "")
+        index = self.find_tab(file_path)
+        if index >= 0:
+            self.tab_bar.setTabText(index, name)
+        self.setWindowTitle(f"积厚文本管理工具 - {name}")
+    
+    def remove_closed_tab(self, path):
+        """文件或目录已被删除：关闭其中文件的标签页（当前标签页除外，编辑器中的内容还可以另存）"""
+        prefix = os.path.join(path, '')
+        for index in reversed(range(self.tab_bar.count())):
+            file_path = self.tab_bar.tabData(index)
+            if (file_path == path or file_path.startswith(prefix)) and index != self.tab_bar.currentIndex():
+                self.close_tab(index)
+    
+    def show_blank(self):
+        """所有标签页都已关闭"""
+        self.cancel_loading()
+        self.close_large_file()
+        self.autosaver.finish_file()
+        self.remember_view_state()
+        self.editor.current_file = None
+        self.show_document(self.editor.create_document())
+        self.tag_manager.update_current_file_tags(None)
+        self.setWindowTitle("JiHouNote")
+    
+    def save_session(self):
+        """保存打开的标签页，下次启动时恢复"""
+        self.remember_view_state()
+        tabs = []
+        for index in range(self.tab_bar.count()):
+            file_path = self.tab_bar.tabData(index)
+            cursor, scroll = self.tab_states.get(file_path, (0, 0))
+            tabs.append({"path": file_path, "cursor": cursor, "scroll": scroll})
+        self.config_manager.set("session", {"tabs": tabs, "current": self.tab_bar.currentIndex()})
+    
+    def restore_session(self):
+        """恢复上次打开的标签页：只创建标签，切换到某个标签页时才读取文件"""
+        session = self.config_manager.get("session", {})
+        for tab in session.get("tabs", []):
+            self.add_tab(tab["path"])
+            self.tab_states[tab["path"]] = (tab.get("cursor", 0), tab.get("scroll", 0))
+        current = session.get("current", -1)
+        if 0 <= current < self.tab_bar.count():
+            self.tab_bar.blockSignals(True)
+            self.tab_bar.setCurrentIndex(current)
+            self.tab_bar.blockSignals(False)
+            self.on_tab_changed(current)
+    
+    def open_file_at_line(self, file_path, line_number):
+        """打开文件并跳转到指定行"""
+        self.open_file(file_path)
+        if self.is_large_file_open():
+            self.large_file_view.go_to_line(line_number)
+        else:
+            self.run_when_shown(file_path, lambda: self.editor.go_to_line(line_number))
+    
+    def is_large_file_open(self):
+        return self.editor_stack.currentWidget() is self.large_file_view
+    
+    def open_large_file(self, file_path):
+        """用只读的大文件模式打开文件：立即显示开头部分，在后台建立行索引"""
+        large_file = LargeTextFile(file_path)
+        self.cancel_loading()
+        self.close_large_file()
+        # 编辑器中不再有打开的文件，避免保存时覆盖大文件
+        self.autosaver.finish_file()
+        self.remember_view_state()
+        self.editor.current_file = None
+        self.show_document(self.editor.create_document())
+        self.large_file_view.open(large_file)
+        self.editor_stack.setCurrentWidget(self.large_file_view)
+        self.vault_watcher.watch_file(file_path)
+        self.path_index.touch(self.file_cache.relative_path(file_path))
+        self.tag_manager.update_current_file_tags(file_path)
+        self.setWindowTitle(f"积厚文本管理工具 - {os.path.basename(file_path)}（只读）")
+        self.statusBar().showMessage(f"文件: {file_path}（大文件，只读）")
+        
+        self.large_file_progress.setValue(0)
+        self.large_file_progress.show()
+        self.large_file_indexer = LargeFileIndexer(large_file, self)
+        self.large_file_indexer.progress.connect(
+            lambda done, total: self.large_file_progress.setValue(done * 100 // max(total, 1)))
+        self.large_file_indexer.indexed.connect(self.on_large_file_indexed)
+        self.large_file_indexer.finished.connect(self.large_file_progress.hide)
+        self.large_file_indexer.start()
+    
+    def show_document(self, document, view_state=None):
+        """在编辑器中显示另一个文档，自动保存和预览跟随"""
+        # 编辑器换掉自己创建的第一个文档时会删除它，先断开与旧文档的连接
+        self.autosaver.set_document(document)
+        self.preview.attach(document)
+        self.editor.set_document(document, view_state)
+        self.outline.set_model(self.editor.highlighter.headings)
+    
+    def remember_view_state(self):
+        """离开当前文档前记下光标和滚动位置，切换回来时恢复"""
+        if self.editor.current_file is None:
+            return
+        entry = self.document_cache.entries.get(self.editor.current_file)
+        if entry is not None and entry.document is self.editor.editor.document():
+            entry.view_state = self.editor.view_state()
+        cursor, scroll = self.editor.view_state()
+        self.tab_states[self.editor.current_file] = (cursor.position(), scroll)
+    
+    def on_large_file_indexed(self, line_count, elapsed):
+        self.large_file_view.update_range()
+        self.statusBar().showMessage(f"已建立行索引：共 {line_count} 行，用时 {elapsed:.1f} 秒", 3000)
+    
+    def close_large_file(self):
+        """停止建立索引并关闭大文件，切换回编辑器"""
+        if self.large_file_indexer is not None:
+            self.large_file_indexer.cancel()
+            self.large_file_indexer.wait()
+            self.large_file_indexer = None
+        self.large_file_view.close_file()
+        self.editor_stack.setCurrentWidget(self.editor)
     
     def save_file(self):
-        if hasattr(self.editor, 'current_file') and self.editor.current_file:
-            try:
-                with open(self.editor.current_file, 'w', encoding='utf-8') as f:
-                    f.write(self.editor.get_content())
-                
-                # 优化保存成功提示，减小宽度
-                msg_box = QMessageBox(self)
-                msg_box.setWindowTitle("保存成功")
-                msg_box.setText("文件已保存")  # 简化文本
-                msg_box.setIcon(QMessageBox.Information)
-                
-                # 设置按钮样式
-                ok_button = msg_box.addButton("确定", QMessageBox.AcceptRole)
-                ok_button.setStyleSheet("""
-                    QPushButton {
-                        background-color: #3366cc;
-                        color: white;
-                        border: none;
-                        padding: 5px 15px;
-                        border-radius: 3px;
-                        min-width: 60px;  /* 减小按钮宽度 */
-                    }
-                    QPushButton:hover {
-                        background-color: #4477dd;
-                    }
-                    QPushButton:pressed {
-                        background-color: #2255bb;
-                    }
-                """)
-                
-                # 设置整体样式，减小宽度
-                msg_box.setStyleSheet("""
-                    QMessageBox {
-                        background-color: #f8f8f8;
-                    }
-                    QLabel {
-                        font-size: 11pt;
-                        padding: 8px;
-                        min-width: 120px;  /* 减小标签宽度 */
-                        max-width: 150px;  /* 限制最大宽度 */
-                    }
-                """)
-                
-                # 显示1.5秒后自动关闭
-                QTimer.singleShot(1500, msg_box.accept)
-                
-                msg_box.exec_()
-                
-                # 更新状态栏
-                self.statusBar().showMessage(f"文件已保存", 2000)
-            except Exception as e:
-                QMessageBox.critical(self, "错误", f"保存文件失败: {str(e)}")
+        """立即保存（不等待写入完成，结果显示在状态栏）"""
+        if self.is_large_file_open():
+            self.statusBar().showMessage("大文件以只读方式打开，不能保存", 3000)
+            return
+        if self.autosaver.file_path:
+            self.autosaver.save()
         else:
             self.save_file_as()
     
     def save_file_as(self):
+        if self.is_large_file_open():
+            self.statusBar().showMessage("大文件以只读方式打开，不能保存", 3000)
+            return
         file_path, _ = QFileDialog.getSaveFileName(
             self, "保存文件", self.data_dir, "文本文件 (*.txt);;Markdown文件 (*.md);;所有文件 (*.*)")
         if file_path:
-            try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(self.editor.get_content())
-                self.editor.current_file = file_path
-                self.setWindowTitle(f"积厚文本管理工具 - {os.path.basename(file_path)}")
-                
-                # 优化保存成功提示，减小宽度
-                msg_box = QMessageBox(self)
-                msg_box.setWindowTitle("保存成功")
-                msg_box.setText("文件已保存")  # 简化文本
-                msg_box.setIcon(QMessageBox.Information)
-                
-                # 设置按钮样式
-                ok_button = msg_box.addButton("确定", QMessageBox.AcceptRole)
-                ok_button.setStyleSheet("""
-                    QPushButton {
-                        background-color: #3366cc;
-                        color: white;
-                        border: none;
-                        padding: 5px 15px;
-                        border-radius: 3px;
-                        min-width: 80px;
-                    }
-                    QPushButton:hover {
-                        background-color: #4477dd;
-                    }
-                    QPushButton:pressed {
-                        background-color: #2255bb;
-                    }
-                """)
+            # 停止跟踪原文件但不保存：未保存的修改只写入新文件，原文件保持上次保存的内容
+            self.autosaver.set_file(None)
+            # 文档此后属于新文件，原文件再次打开时重新读取
+            if self.editor.current_file:
+                self.document_cache.remove(self.editor.current_file)
+            index = self.tab_bar.currentIndex()
+            if index < 0 or self.tab_bar.tabData(index) != self.editor.current_file:
+                index = self.add_tab(file_path, index + 1)
+            self.tab_bar.setTabData(index, file_path)
+            self.tab_bar.setTabText(index, os.path.basename(file_path))
+            self.tab_bar.setTabToolTip(index, file_path)
+            self.tab_bar.blockSignals(True)
+            self.tab_bar.setCurrentIndex(index)
+            self.tab_bar.blockSignals(False)
+            self.document_cache.put(CachedDocument(file_path, self.editor.editor.document()))
+            self.editor.current_file = file_path
+            self.autosaver.set_file(file_path)
+            self.autosaver.save_text(file_path, self.editor.get_content())
+            self.editor.editor.document().setModified(False)
+            self.setWindowTitle(f"积厚文本管理工具 - {os.path.basename(file_path)}")
                 
-                # 设置整体样式
-                msg_box.setStyleSheet("""
-                    QMessageBox {
-                        background-color: #f8f8f8;
-                    }
-                    QLabel {
-                        font-size: 12pt;
-                        padding: 10px;
-                        min-width: 200px;
-                    }
-                """)
+    def after_file_saved(self, file_path, content):
+        """在保存线程中调用：更新搜索索引和内容标签，不访问界面"""
+        self.search_widget.index_saved_file(file_path)
+        self.tag_manager.update_file_content(file_path, content)
+    
+    def on_file_saved(self, file_path, content):
+        """后台保存完成（搜索索引和标签已在保存线程中更新）"""
+        self.document_cache.update_stat(file_path)
+        if file_path == self.editor.current_file:
+            # os.replace换掉了原文件，需要重新监视
+            self.vault_watcher.watch_file(file_path)
+        self.statusBar().showMessage(f"文件已保存: {file_path}", 2000)
                 
-                # 显示2秒后自动关闭
-                QTimer.singleShot(2000, msg_box.accept)
+    def on_save_failed(self, file_path, message):
+        self.statusBar().showMessage(f"保存文件失败: {file_path}，{message}（修改已记入恢复日志）")
                 
-                msg_box.exec_()
+    def stop_editing_file(self):
+        """当前文件已被删除：编辑器中的内容不再自动保存"""
+        self.autosaver.set_file(None)
+        self.editor.current_file = None
                 
-                # 更新状态栏
-                self.statusBar().showMessage(f"文件已保存: {file_path}", 3000)
-            except Exception as e:
-                QMessageBox.critical(self, "错误", f"保存文件失败: {str(e)}")
+    def recover_unsaved(self):
+        """上次异常退出时有未保存的修改：打开这些文件并恢复修改，由自动保存写入文件"""
+        recovered = self.autosaver.journal.recover()
+        for file_path, content in recovered.items():
+            self.open_file(file_path)
+            self.run_when_shown(file_path, lambda content=content: self.autosaver.restore(content))
+        if recovered:
+            self.statusBar().showMessage(f"已恢复上次未保存的修改（{len(recovered)} 个文件）", 5000)
     
     def import_file(self):
         """导入外部文件到知识库"""
@@ -353,6 +814,10 @@ class MainWindow(QMainWindow):
                 
                 # 检查目标文件是否已存在
                 if os.path.exists(target_path):
+                    # 内容完全相同的文件无需再次导入
+                    if self.file_cache.same_content(file_path, target_path):
+                        continue
+                    
                     reply = QMessageBox.question(
                         self, "文件已存在", 
                         f"文件 {file_name} 已存在，是否覆盖？",
@@ -367,6 +832,7 @@ class MainWindow(QMainWindow):
                 
                 with open(target_path, 'w', encoding='utf-8') as dst_file:
                     dst_file.write(content)
+                self.search_widget.update_file(target_path)
                 
                 imported_count += 1
             
@@ -456,32 +922,20 @@ class MainWindow(QMainWindow):
             except Exception as e:
                 QMessageBox.critical(self, "导出错误", f"导出文件失败: {str(e)}")
     
-    # 移除这些方法
-    # def add_tag_to_current_file(self):
-    #     if not hasattr(self.editor, 'current_file') or not self.editor.current_file:
-    #         QMessageBox.warning(self, "警告", "没有打开的文件可添加标签")
-    #         return
-    #     
-    #     tag, ok = QInputDialog.getText(self, "添加标签", "请输入标签名:")
-    #     if ok and tag:
-    #         self.tag_manager.add_tag_to_file(self.editor.current_file, tag)
-    
-    # def show_files_by_tag(self, tag):
-    #     files = self.tag_manager.get_files_by_tag(tag)
-    #     if not files:
-    #         QMessageBox.information(self, "标签搜索", f"没有找到带有标签 '{tag}' 的文件")
-    #         return
-    #     
-    #     # 在搜索结果中显示
-    #     self.search_widget.results_list.clear()
-    #     for file_path in files:
-    #         relative_path = os.path.relpath(file_path, self.data_dir)
-    #         item = QListWidgetItem(f"{relative_path} [标签: {tag}]")
-    #         item.setData(Qt.UserRole, file_path)
-    #         self.search_widget.results_list.addItem(item)
-    #     
-    #     # 切换到搜索标签页
-    #     self.left_tabs.setCurrentWidget(self.search_widget)
+    def add_tag_to_current_file(self):
+        if not hasattr(self.editor, 'current_file') or not self.editor.current_file:
+            QMessageBox.warning(self, "警告", "没有打开的文件可添加标签")
+            return
+    
+        tag, ok = QInputDialog.getText(self, "添加标签", "请输入标签名:")
+        if ok and tag.strip():
+            self.tag_manager.add_tag_to_file(self.editor.current_file, tag.strip())
+    
+    def create_tag_manager(self, data_dir):
+        tag_manager = TagManager(data_dir, self.file_cache)
+        tag_manager.file_selected.connect(self.open_file)
+        return tag_manager
+    
     def show_about(self):
         about_box = QMessageBox(self)
         about_box.setWindowTitle("关于")
@@ -547,8 +1001,57 @@ class MainWindow(QMainWindow):
         save_shortcut = QShortcut(QKeySequence("Ctrl+S"), self)
         save_shortcut.activated.connect(self.save_file)
         
+        # 快速打开快捷键
+        quick_open_shortcut = QShortcut(QKeySequence("Ctrl+P"), self)
+        quick_open_shortcut.activated.connect(self.show_quick_open)
+        
         # 如果需要添加更多快捷键，可以在这里添加
         pass
+    
+    def show_quick_open(self):
+        """显示快速打开对话框"""
+        if self.quick_open_dialog is None:
+            self.quick_open_dialog = QuickOpenDialog(self.path_index, self.data_dir, self)
+            self.quick_open_dialog.file_selected.connect(self.open_file)
+        self.quick_open_dialog.set_index(self.path_index, self.data_dir)
+        self.quick_open_dialog.popup()
+    
+    def reset_path_index(self, recent=None):
+        """用文件缓存中的文件列表重建快速打开的路径索引"""
+        if recent is None:
+            # 配置中保存的是绝对路径，只保留当前数据目录中的文件
+            recent = [self.file_cache.relative_path(path) for path in self.config_manager.get("recent_files", [])
+                      if os.path.abspath(path).startswith(os.path.abspath(self.data_dir) + os.sep)]
+        self.path_index.reset(self.file_cache.paths(NOTE_EXTENSIONS))
+        self.path_index.recent = recent
+    
+    def save_recent_files(self):
+        self.config_manager.set("recent_files", [self.file_cache.absolute_path(path) for path in self.path_index.recent])
+    
+    def on_item_created(self, path):
+        """文件管理器中新建或复制了文件/文件夹"""
+        if self.file_cache.relative_path(path).startswith('..'):
+            # 复制到了数据目录之外
+            return
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in files:
+                    self.path_index.add(self.file_cache.relative_path(os.path.join(root, name)))
+        else:
+            self.path_index.add(self.file_cache.relative_path(path))
+    
+    def on_item_deleted(self, path):
+        """文件管理器中删除了文件/文件夹"""
+        self.path_index.remove(self.file_cache.relative_path(path))
+        self.tag_manager.remove_path(path)
+        self.document_cache.remove(path)
+        self.remove_closed_tab(path)
+        current_file = self.editor.current_file
+        if current_file and (current_file == path or current_file.startswith(os.path.join(path, ''))):
+            self.stop_editing_file()
+    
+    def on_item_copied(self, source, target):
+        self.tag_manager.copy_path(source, target)
 
     def new_folder(self):
         """新建文件夹"""
@@ -603,22 +1106,14 @@ class MainWindow(QMainWindow):
                 
                 if reply == QMessageBox.Yes:
                     try:
-                        import shutil
                         # 如果新目录不存在，创建它
                         if not os.path.exists(new_dir):
                             os.makedirs(new_dir)
                         
-                        # 复制所有文件
-                        for item in os.listdir(self.data_dir):
-                            src_path = os.path.join(self.data_dir, item)
-                            dst_path = os.path.join(new_dir, item)
-                            
-                            if os.path.isdir(src_path):
-                                if os.path.exists(dst_path):
-                                    shutil.rmtree(dst_path)
-                                shutil.copytree(src_path, dst_path)
-                            else:
-                                shutil.copy2(src_path, dst_path)
+                        # 只复制新目录中不存在或有变化的文件
+                        self.file_cache.copy_to(new_dir)
+                        if self.tag_manager.store is not None:
+                            self.tag_manager.store.copy_to(new_dir)
                     
                     except Exception as e:
                         QMessageBox.critical(self, "错误", f"移动数据失败: {str(e)}")
@@ -634,13 +1129,78 @@ class MainWindow(QMainWindow):
             # 更新文件管理器
             self.file_manager.set_root_path(new_dir)
             
+            # 更新文件缓存、目录监视、搜索索引和快速打开
+            self.vault_watcher.stop()
+            self.file_cache.save()
+            self.save_recent_files()
+            self.file_cache = FileStatCache(new_dir)
+            self.reset_path_index()
+            self.start_vault_watcher()
+            self.search_widget.set_data_dir(new_dir, self.file_cache)
+            self.search_widget.start_index_sync()
+            
             # 更新标签管理器
-            self.tag_manager = TagManager(new_dir)
+            self.tag_manager.close_store()
+            self.tag_manager = self.create_tag_manager(new_dir)
             self.left_tabs.removeTab(2)  # 移除旧的标签页
             self.left_tabs.insertTab(2, self.tag_manager, "标签")
             
             QMessageBox.information(self, "成功", f"数据目录已更改为:\n{new_dir}")
+    
+    def closeEvent(self, event):
+        """退出前保存修改和打开的标签页，停止目录监视并保存文件缓存"""
+        self.save_session()
+        workers = [worker for worker in (self.load_worker, self.reload_worker) if worker is not None]
+        self.cancel_loading()
+        for worker in workers:
+            worker.cancel()
+            worker.wait()
+        self.autosaver.wait()
+        self.vault_watcher.stop()
+        self.search_widget.wait_for_changes()
+        self.file_cache.save()
+        self.save_recent_files()
+        self.tag_manager.close_store()
+        self.close_large_file()
+        self.preview.stop()
+        super().closeEvent(event)
+    
+    def changeEvent(self, event):
+        # 切换到其他程序时立即保存
+        if event.type() == QEvent.ActivationChange and not self.isActiveWindow():
+            self.autosaver.save()
+        super().changeEvent(event)
 
+    def rebuild_search_index(self):
+        """在后台重建搜索索引"""
+        self.statusBar().showMessage("正在重建搜索索引...")
+        self.search_widget.rebuild_index()
+    
+    def update_analyzer_actions(self):
+        """菜单显示当前数据目录的分词设置"""
+        analyzer = self.search_widget.index.analyzer
+        self.jieba_action.setChecked(analyzer.cjk == "jieba")
+        self.stemming_action.setChecked(analyzer.stemming)
+        self.strip_markdown_action.setChecked(analyzer.strip_markdown)
+    
+    def change_search_analyzer(self):
+        """更改分词方式并在后台重建索引"""
+        analyzer = Analyzer(cjk="jieba" if self.jieba_action.isChecked() else "bigram",
+                            stemming=self.stemming_action.isChecked(),
+                            strip_markdown=self.strip_markdown_action.isChecked())
+        self.statusBar().showMessage("分词方式已更改，正在重建搜索索引...", 3000)
+        self.search_widget.set_analyzer(analyzer)
+    
+    def on_index_rebuilt(self, updated, elapsed):
+        self.statusBar().showMessage(
+            f"搜索索引已重建，共索引 {updated} 个文件，用时 {elapsed:.1f} 秒"
+            f"（{updated / max(elapsed, 1e-6):.0f} 个/秒）", 5000)
+
+    def toggle_preview(self, checked):
+        """显示或隐藏预览，隐藏时不转换"""
+        self.preview.setVisible(checked)
+        self.config_manager.set("show_preview", checked)
+    
     def toggle_line_numbers(self):
         """切换行号显示状态"""
         # 确保editor属性存在并且是MarkdownEditor类的实例
@@ -0,0 +1,127 @@
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QListView, QAbstractItemView
+from PyQt5.QtGui import QTextCursor
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, pyqtSignal
+
+class HeadingModel(QAbstractListModel):
+    """一个文档的标题列表（大纲），由语法高亮器逐块更新
+    
+    每个标题用一个停在行首的QTextCursor记录位置，编辑时Qt自动调整，列表始终按位置有序。
+    高亮器高亮标题行（或原来是标题的行）后调用update_block，只改动这个块范围内的标题，
+    不重新解析整个文档；被删除的标题行上的光标会移到修改处，由高亮器检查修改涉及的块。
+    按顺序高亮（载入文档、延迟高亮）时上次查找的位置就是下一个标题的位置，不必二分查找。
+    """
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.cursors = []
+        self.levels = []
+        self.titles = []
+        # 上次update_block之后的行号
+        self.hint = 0
+    
+    def clear(self):
+        self.beginResetModel()
+        self.cursors = []
+        self.levels = []
+        self.titles = []
+        self.hint = 0
+        self.endResetModel()
+    
+    def find(self, position):
+        """第一个位置不小于position的标题的行号"""
+        cursors = self.cursors
+        hint = self.hint
+        if hint <= len(cursors) and (hint == 0 or cursors[hint - 1].position() < position) and \
+                (hint == len(cursors) or cursors[hint].position() >= position):
+            return hint
+        low, high = 0, len(cursors)
+        while low < high:
+            middle = (low + high) // 2
+            if cursors[middle].position() < position:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+    
+    def update_block(self, block, heading):
+        """block高亮后的结果：heading为 (级别, 标题文字)，不是标题时为None"""
+        start = block.position()
+        end = start + block.length()
+        first = self.find(start)
+        last = first
+        while last < len(self.cursors) and self.cursors[last].position() < end:
+            last += 1
+        if heading is None:
+            if last > first:
+                self.remove_rows(first, last)
+            self.hint = first
+            return
+        level, title = heading
+        self.hint = first + 1
+        if last == first:
+            self.beginInsertRows(QModelIndex(), first, first)
+            self.cursors.insert(first, QTextCursor(block))
+            self.levels.insert(first, level)
+            self.titles.insert(first, title)
+            self.endInsertRows()
+            return
+        if last > first + 1:
+            self.remove_rows(first + 1, last)
+        # 在行首输入时光标会移到插入的文字之后
+        if self.cursors[first].position() != start:
+            self.cursors[first].setPosition(start)
+        if self.levels[first] != level or self.titles[first] != title:
+            self.levels[first] = level
+            self.titles[first] = title
+            index = self.index(first)
+            self.dataChanged.emit(index, index)
+    
+    def remove_rows(self, first, last):
+        self.beginRemoveRows(QModelIndex(), first, last - 1)
+        del self.cursors[first:last]
+        del self.levels[first:last]
+        del self.titles[first:last]
+        self.endRemoveRows()
+    
+    def position(self, row):
+        return self.cursors[row].position()
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.cursors)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.cursors):
+            return None
+        row = index.row()
+        if role == Qt.DisplayRole:
+            # 按级别缩进
+            return '    ' * (self.levels[row] - 1) + self.titles[row]
+        if role == Qt.UserRole:
+            return self.cursors[row].position()
+        return None
+
+class OutlinePanel(QWidget):
+    """当前文档的大纲，点击标题跳转到标题所在的位置"""
+    # 标题在文档中的位置
+    heading_clicked = pyqtSignal(int)
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.list_view = QListView()
+        # 所有行等高，视图不必逐行计算大小，上万个标题也不会卡顿
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setLayoutMode(QListView.Batched)
+        self.list_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.list_view.clicked.connect(self.on_clicked)
+        self.list_view.activated.connect(self.on_clicked)
+        layout.addWidget(self.list_view)
+    
+    def set_model(self, model):
+        """显示另一个文档的标题列表"""
+        self.list_view.setModel(model)
+    
+    def on_clicked(self, index):
+        if index.isValid():
+            self.heading_clicked.emit(index.data(Qt.UserRole))
\ No newline at end of file
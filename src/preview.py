@@ -0,0 +1,244 @@
+import re
+import html
+from collections import OrderedDict
+from PyQt5.QtWidgets import QTextBrowser
+from PyQt5.QtGui import QTextCursor
+from PyQt5.QtCore import QThread, QTimer, QUrl, pyqtSignal
+from file_cache import content_hash
+
+try:
+    import markdown
+except ImportError:
+    markdown = None
+
+# 围栏代码块的开始/结束行，代码块中的空行不分隔顶层块
+_FENCE_RE = re.compile(r'[ \t]{0,3}(`{3,}|~{3,})')
+# 每个片段前插入的标记段落，使片段的第一个块保留自己的块格式（标题、引用等），插入后删除
+_FRAGMENT_MARK = "<p>\u200b</p>"
+# 列表项的开始行，空行分隔的列表项属于同一个列表
+_LIST_ITEM_RE = re.compile(r'[ \t]{0,3}(?:[*+-]|\d{1,9}[.)])(?:[ \t]|$)')
+# 引用式链接和脚注的定义
+_DEFINITION_RE = re.compile(r'(?m)^[ ]{0,3}\[\^?[^\]\n]+\]:')
+
+def split_blocks(text):
+    """把Markdown按顶层块切分：空行分隔，围栏代码块、缩进的续行和连续的列表项属于同一个块"""
+    blocks = []
+    current = []
+    fence = None
+    # current之后的空行数，块继续时保留这些空行（松散列表、列表项中的段落）
+    blanks = 0
+    in_list = False
+    for line in text.split('\n'):
+        match = _FENCE_RE.match(line)
+        if fence is not None:
+            current.append(line)
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence):
+                fence = None
+            continue
+        if not line.strip():
+            if current:
+                blanks += 1
+            continue
+        if blanks:
+            if line[:1].isspace() or (in_list and _LIST_ITEM_RE.match(line)):
+                current.extend([''] * blanks)
+            else:
+                blocks.append('\n'.join(current))
+                current = []
+            blanks = 0
+        if not current:
+            in_list = bool(_LIST_ITEM_RE.match(line))
+        current.append(line)
+        if match:
+            fence = match.group(1)
+    if current:
+        blocks.append('\n'.join(current))
+    return blocks
+
+class BlockRenderer:
+    """把顶层块转换为HTML片段，按内容摘要缓存（只在预览的后台线程中使用，同一时间只有一个线程）"""
+    CACHE_SIZE = 4096
+    
+    def __init__(self):
+        self.cache = OrderedDict()
+        self.converter = markdown.Markdown(extensions=['fenced_code', 'tables', 'footnotes']) if markdown else None
+    
+    def render_block(self, block):
+        if self.converter is None:
+            # 没有安装markdown时显示原文
+            return f"<pre>{html.escape(block)}</pre>"
+        self.converter.reset()
+        return self.converter.convert(block)
+    
+    def render(self, text):
+        """返回 [(摘要, HTML)]"""
+        if _DEFINITION_RE.search(text):
+            # 引用式链接和脚注的定义可以在笔记的任何位置，分块转换时其他块找不到它们，
+            # 整篇一起转换；整篇的HTML不放入缓存
+            return [(content_hash(text.encode('utf-8')), self.render_block(text))]
+        fragments = []
+        for block in split_blocks(text):
+            key = content_hash(block.encode('utf-8'))
+            fragment = self.cache.get(key)
+            if fragment is None:
+                fragment = self.render_block(block)
+                self.cache[key] = fragment
+                if len(self.cache) > self.CACHE_SIZE:
+                    self.cache.popitem(last=False)
+            else:
+                self.cache.move_to_end(key)
+            fragments.append((key, fragment))
+        return fragments
+
+class PreviewWorker(QThread):
+    """在后台线程中切分笔记并转换有变化的块"""
+    # 版本号、[(摘要, HTML)]
+    rendered = pyqtSignal(int, object)
+    
+    def __init__(self, renderer, text, version, parent=None):
+        super().__init__(parent)
+        self.renderer = renderer
+        self.text = text
+        self.version = version
+    
+    def run(self):
+        try:
+            fragments = self.renderer.render(self.text)
+        except Exception as e:
+            print(f"预览转换时出错: {str(e)}")
+            return
+        self.rendered.emit(self.version, fragments)
+
+class MarkdownPreview(QTextBrowser):
+    """与编辑器并排的Markdown预览
+    
+    编辑停止DEBOUNCE_MS毫秒后在后台线程中转换，每个顶层块的HTML按内容摘要缓存，
+    只有内容变化的块需要重新转换。显示时与上次的块列表比较，只替换中间变化的片段：
+    每个片段在文档中占若干个连续的块，记录每个片段的块数就能找到要替换的范围。
+    文档开头保留一个空块，所有片段都插入在前一个块的末尾之后。
+    """
+    DEBOUNCE_MS = 300
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setOpenExternalLinks(True)
+        self.renderer = BlockRenderer()
+        self.worker = None
+        self.pending = False
+        self.source = None
+        self.version = 0
+        # 当前显示的片段摘要和每个片段占用的块数
+        self.keys = []
+        self.block_counts = []
+        
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.DEBOUNCE_MS)
+        self.timer.timeout.connect(self.start_render)
+    
+    def attach(self, document):
+        """预览document（编辑器的文档）的内容，文档修改后自动更新"""
+        if self.source is not None:
+            self.source.contentsChanged.disconnect(self.schedule)
+        self.source = document
+        document.contentsChanged.connect(self.schedule)
+        self.reset()
+    
+    def reset(self, base_dir=None):
+        """打开了另一个文件：清空预览，相对路径的图片和链接以base_dir为基准"""
+        self.clear()
+        self.keys = []
+        self.block_counts = []
+        if base_dir:
+            self.document().setBaseUrl(QUrl.fromLocalFile(base_dir.rstrip('/\\') + '/'))
+        self.schedule()
+    
+    def stop(self):
+        """停止等待中的转换，等待正在运行的转换结束（退出前调用）"""
+        self.timer.stop()
+        self.pending = False
+        if self.worker is not None:
+            self.worker.wait()
+    
+    def schedule(self):
+        if self.isVisible():
+            self.timer.start()
+    
+    def showEvent(self, event):
+        # 隐藏时不转换，显示时更新
+        super().showEvent(event)
+        self.timer.start(0)
+    
+    def start_render(self):
+        if self.source is None or not self.isVisible():
+            return
+        if self.worker is not None and self.worker.isRunning():
+            # 当前转换结束后再转换一次
+            self.pending = True
+            return
+        self.version += 1
+        self.worker = PreviewWorker(self.renderer, self.source.toPlainText(), self.version, self)
+        self.worker.rendered.connect(self.apply_fragments)
+        self.worker.finished.connect(self.on_render_finished)
+        self.worker.start()
+    
+    def on_render_finished(self):
+        if self.pending:
+            self.pending = False
+            self.start_render()
+    
+    def apply_fragments(self, version, fragments):
+        if version != self.version:
+            return
+        keys = [key for key, _ in fragments]
+        old = self.keys
+        # 相同的开头和结尾不变，只替换中间的片段
+        prefix = 0
+        limit = min(len(old), len(keys))
+        while prefix < limit and old[prefix] == keys[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and old[-1 - suffix] == keys[-1 - suffix]:
+            suffix += 1
+        if prefix == len(old) == len(keys):
+            return
+        self.patch(prefix, len(old) - suffix, fragments[prefix:len(keys) - suffix])
+        self.keys = keys
+    
+    def patch(self, start, end, fragments):
+        """把第start到end（不包括）个片段替换为fragments"""
+        document = self.document()
+        cursor = QTextCursor(document)
+        cursor.beginEditBlock()
+        # 第0块是保留的空块
+        first = 1 + sum(self.block_counts[:start])
+        removed = sum(self.block_counts[start:end])
+        previous = document.findBlockByNumber(first - 1)
+        cursor.setPosition(previous.position() + previous.length() - 1)
+        if removed:
+            last = document.findBlockByNumber(first + removed - 1)
+            previous_format = previous.blockFormat()
+            previous_list = previous.textList()
+            cursor.setPosition(last.position() + last.length() - 1, QTextCursor.KeepAnchor)
+            cursor.removeSelectedText()
+            # 前一个块为空时Qt会让它继承被删除的块的格式（如列表项），恢复原来的格式
+            block = cursor.block()
+            if block.blockFormat() != previous_format or block.textList() is not previous_list:
+                cursor.setBlockFormat(previous_format)
+                block = cursor.block()
+                if block.textList() is not None and block.textList() is not previous_list:
+                    block.textList().remove(block)
+                if previous_list is not None and block.textList() is None:
+                    previous_list.add(block)
+        counts = []
+        for _, fragment in fragments:
+            # 标记段落并入前一个块，片段从新的块开始；插入后删除标记字符
+            position = cursor.position()
+            block_count = document.blockCount()
+            cursor.insertHtml(_FRAGMENT_MARK + fragment)
+            counts.append(document.blockCount() - block_count)
+            mark = QTextCursor(document)
+            mark.setPosition(position)
+            mark.deleteChar()
+        cursor.endEditBlock()
+        self.block_counts[start:end] = counts
\ No newline at end of file
@@ -0,0 +1,369 @@
+import os
+import re
+import heapq
+from bisect import bisect_right
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLineEdit, QListWidget, QListWidgetItem, QLabel
+from PyQt5.QtCore import Qt, pyqtSignal, QEvent
+
+class PathIndex:
+    """快速打开使用的内存路径索引
+    
+    所有相对路径（小写）和文件名分别按长度排序后用换行连接成一个长字符串，查询时用
+    正则表达式在长字符串上扫描，短的路径先被扫描到，取到足够的候选后就停止，
+    逐个路径的循环只发生在少量候选上。
+    匹配按层次排序：文件名以查询开头 > 文件名包含查询 > 路径包含查询 >
+    文件名按顺序包含查询的各个字符 > 路径按顺序包含查询的各个字符；
+    得到足够的结果后不再扫描更低的层次。最近打开的文件另外加分。
+    新增的文件先放在待合并列表中逐个匹配，积累较多时再重新生成长字符串。
+    扫描前先用按字符缓存的路径位图排除不包含查询全部字符的路径，只扫描可能匹配的几段。
+    """
+    
+    # 返回的结果数量
+    RESULT_LIMIT = 50
+    # 扫描子串时最多取出的候选数量（相对于结果数量的倍数），按顺序包含字符的扫描较慢，只取结果数量个
+    CANDIDATE_FACTOR = 4
+    # 记录的最近打开文件数量
+    RECENT_LIMIT = 50
+    # 待合并的新文件超过这个数量时重新生成长字符串
+    PENDING_LIMIT = 500
+    # 各层次的基础分，层内得分不超过TIER_SPAN，高层次的结果总是排在低层次之前
+    TIER_SPAN = 500
+    # 最近打开的文件最多加分（可以超过两个层次）
+    RECENT_BONUS = 1200
+    # 可能匹配的路径之间相隔不超过这么多行时合并成一段扫描，减少逐段调用的次数
+    RUN_GAP = 32
+    
+    def __init__(self, extensions=None, recent=None):
+        self.extensions = extensions
+        # 相对路径（以/分隔），已删除的位置为None，定期压缩
+        self.paths = []
+        self.slots = {}
+        self.removed_count = 0
+        # 最近打开的文件，最近的在最后
+        self.recent = list(recent or [])[-self.RECENT_LIMIT:]
+        # 生成长字符串之后新增的位置
+        self.pending = []
+        self._dirty = True
+        self._names_text = self._paths_text = ""
+        self._name_starts = self._path_starts = []
+        self._name_slots = self._path_slots = []
+        self._lowered = []
+        self._paths_bytes = b""
+        # (字符, 次数) -> 至少包含这么多个该字符的路径位图，长字符串重新生成时清空
+        self._char_lines = {}
+    
+    def __len__(self):
+        return len(self.slots)
+    
+    def reset(self, relative_paths):
+        """用完整的路径列表重建索引"""
+        self.paths = []
+        self.slots = {}
+        self.removed_count = 0
+        for relative_path in relative_paths:
+            self.add(relative_path)
+        self.pending = []
+        self._dirty = True
+    
+    def add(self, relative_path):
+        if relative_path in self.slots:
+            return
+        if self.extensions and not relative_path.lower().endswith(self.extensions):
+            return
+        self.slots[relative_path] = len(self.paths)
+        self.pending.append(len(self.paths))
+        self.paths.append(relative_path)
+    
+    def remove(self, relative_path):
+        """移除文件；relative_path是目录时移除其下所有文件"""
+        prefix = relative_path.rstrip('/') + '/'
+        targets = [relative_path] if relative_path in self.slots else \
+            [p for p in self.slots if p.startswith(prefix)]
+        # 长字符串中的位置只做标记，匹配时跳过
+        for path in targets:
+            self.paths[self.slots.pop(path)] = None
+            self.removed_count += 1
+        # 已删除的位置过多时压缩
+        if self.removed_count > 1000 and self.removed_count > len(self.paths) // 2:
+            self.reset([p for p in self.paths if p is not None])
+    
+    def move(self, old_path, new_path):
+        self.remove(old_path)
+        self.add(new_path)
+        if old_path in self.recent:
+            self.recent[self.recent.index(old_path)] = new_path
+    
+    def apply_changes(self, changes):
+        """按文件监视得到的ChangeSet增量更新"""
+        for relative_path in changes.removed:
+            self.remove(relative_path)
+        for old_path, new_path in changes.moved:
+            self.move(old_path, new_path)
+        for relative_path in changes.added:
+            self.add(relative_path)
+    
+    def touch(self, relative_path):
+        """记录最近打开的文件"""
+        if relative_path in self.recent:
+            self.recent.remove(relative_path)
+        self.recent.append(relative_path)
+        del self.recent[:-self.RECENT_LIMIT]
+    
+    def _build(self):
+        """重新生成用于扫描的长字符串（路径和文件名各一个，按长度排序）"""
+        self._lowered = [path.lower() if path is not None else None for path in self.paths]
+        live = [slot for slot, path in enumerate(self._lowered) if path is not None]
+        names = {slot: self._lowered[slot][self._lowered[slot].rfind('/') + 1:] for slot in live}
+        self._path_slots = sorted(live, key=lambda slot: len(self._lowered[slot]))
+        self._paths_text, self._path_starts = self._join([self._lowered[slot] for slot in self._path_slots])
+        self._name_slots = sorted(live, key=lambda slot: (len(names[slot]), len(self._lowered[slot])))
+        self._names_text, self._name_starts = self._join([names[slot] for slot in self._name_slots])
+        self._paths_bytes = self._paths_text.encode('utf-8')
+        self._char_lines = {}
+        self.pending = []
+        self._dirty = False
+    
+    @staticmethod
+    def _join(lines):
+        """每行之前都有一个换行符，返回 (长字符串, 每行的起始位置)"""
+        starts = []
+        offset = 1
+        for line in lines:
+            starts.append(offset)
+            offset += len(line) + 1
+        return "\n" + "\n".join(lines), starts
+    
+    def _lines_with(self, char, count):
+        """至少包含count个char的路径位图，第i位对应路径长字符串的第i行；非ASCII字符返回None（不参与筛选）
+        
+        在编码后的长字符串上只保留换行符和char（换成1），每行剩下换行符加若干个1，
+        把换行符加count个1标记出来后每行变成一位数字，整体转换成整数，不需要逐行循环；结果按字符和次数缓存。
+        """
+        key = (char, count)
+        if key in self._char_lines:
+            return self._char_lines[key]
+        lines = None
+        if ord(char) < 0x80:
+            code = ord(char)
+            kept = self._paths_bytes.translate(bytes.maketrans(bytes([code]), b"1"),
+                                               bytes(b for b in range(256) if b not in (10, code)))
+            digits = kept.replace(b"\n" + b"1" * count, b"\0").translate(bytes.maketrans(b"\n\0", b"01"), b"1")
+            lines = int(digits[::-1] or b"0", 2)
+        self._char_lines[key] = lines
+        return lines
+    
+    def _candidate_ranges(self, text):
+        """返回路径长字符串中需要扫描的 (起点, 终点) 列表，只覆盖包含查询全部字符（含重复次数）的路径；
+        查询中没有可用于筛选的字符时返回None（扫描整个字符串）
+        """
+        lines = None
+        for char in set(text):
+            char_lines = self._lines_with(char, text.count(char))
+            if char_lines is not None:
+                lines = char_lines if lines is None else lines & char_lines
+        if lines is None:
+            return None
+        starts = self._path_starts
+        flags = format(lines, 'b')[::-1]
+        gap = "0" * (self.RUN_GAP + 1)
+        ranges = []
+        first = flags.find("1")
+        while first >= 0:
+            # 连续的候选行（中间的间隔不超过RUN_GAP）合并成一段，从行前的换行符开始，到下一行前的换行符结束
+            gap_start = flags.find(gap, first)
+            last = flags.rfind("1", first, gap_start if gap_start >= 0 else len(flags))
+            ranges.append((starts[first] - 1,
+                           starts[last + 1] - 1 if last + 1 < len(starts) else len(self._paths_text)))
+            first = flags.find("1", last + 1)
+        return ranges
+    
+    @staticmethod
+    def _fuzzy(text):
+        """按顺序包含查询各个字符的正则表达式，每个字符取最早出现的位置（不会回溯）"""
+        parts = [re.escape(text[0])]
+        for c in text[1:]:
+            parts.append("[^\n" + re.escape(c) + "]*" + re.escape(c))
+        return re.compile("".join(parts))
+    
+    def _tier_score(self, tier, slot, start, end, text):
+        """层次基础分加层内得分：匹配越紧凑、越靠近路径末尾（文件名）、路径越短得分越高"""
+        line_length = len(self.paths[slot])
+        span = end - start - len(text)
+        tail = line_length - start
+        return (5 - tier) * self.TIER_SPAN + max(0, self.TIER_SPAN - 1 - span * 8 - tail - line_length // 4)
+    
+    def _classify(self, text, slot, fuzzy, start=None, end=None):
+        """确定路径所在的层次，返回得分，不匹配时返回None
+        
+        start/end为在完整路径中已经找到的匹配位置（扫描长字符串得到），文件名中有更好的匹配时使用文件名中的匹配。
+        """
+        path = self.paths[slot].lower()
+        name_start = path.rfind('/') + 1
+        name = path[name_start:]
+        if name.startswith(text):
+            return self._tier_score(0, slot, name_start, name_start + len(text), text)
+        position = name.find(text)
+        if position >= 0:
+            return self._tier_score(1, slot, name_start + position, name_start + position + len(text), text)
+        if start is None or end - start > len(text):
+            position = path.find(text)
+            if position >= 0:
+                return self._tier_score(2, slot, position, position + len(text), text)
+        elif start is not None:
+            return self._tier_score(2, slot, start, end, text)
+        match = fuzzy.search(name)
+        if match:
+            return self._tier_score(3, slot, name_start + match.start(), name_start + match.end(), text)
+        if start is None:
+            match = fuzzy.search(path)
+            if match is None:
+                return None
+            start, end = match.span()
+        return self._tier_score(4, slot, start, end, text)
+    
+    def _scan(self, haystack, starts, slots, needle, scores, text, fuzzy, limit, ranges=None):
+        """在长字符串中扫描needle（字符串或正则表达式），为新的候选计分，最多取limit个
+        
+        ranges为需要扫描的 (起点, 终点) 列表，None时扫描整个字符串。
+        """
+        found = 0
+        for start, end in self._matches(haystack, needle, ranges or ((0, len(haystack)),)):
+            # 匹配不会跨行，用最后一个字符确定所在的行（needle可能以换行符开头）
+            line = bisect_right(starts, end - 1) - 1
+            slot = slots[line]
+            if slot in scores or self.paths[slot] is None:
+                continue
+            line_start = starts[line]
+            scores[slot] = self._classify(text, slot, fuzzy, start - line_start, end - line_start) \
+                if haystack is self._paths_text else self._classify(text, slot, fuzzy)
+            found += 1
+            # 扫描顺序是按长度从短到长，前面的候选已经足够好
+            if found >= limit:
+                break
+    
+    @staticmethod
+    def _matches(haystack, needle, ranges):
+        for range_start, range_end in ranges:
+            if isinstance(needle, str):
+                position = haystack.find(needle, range_start, range_end)
+                while position >= 0:
+                    yield position, position + len(needle)
+                    position = haystack.find(needle, position + 1, range_end)
+            else:
+                for match in needle.finditer(haystack, range_start, range_end):
+                    yield match.span()
+    
+    def query(self, text, limit=None):
+        """返回按得分排序的相对路径列表，查询为空时返回最近打开的文件"""
+        limit = limit or self.RESULT_LIMIT
+        text = "".join(text.lower().split())
+        if not text:
+            return [p for p in reversed(self.recent) if p in self.slots][:limit]
+        if self._dirty or len(self.pending) > self.PENDING_LIMIT:
+            self._build()
+        
+        fuzzy = self._fuzzy(text)
+        candidate_limit = limit * self.CANDIDATE_FACTOR
+        scores = {}
+        # 依次扫描：文件名开头、路径中的子串、路径中按顺序出现的字符；
+        # 后两次扫描得到的候选再检查文件名，得到足够的结果后不再扫描
+        # 路径长字符串只扫描可能匹配的几段，没有路径包含查询的全部字符时不再扫描
+        ranges = self._candidate_ranges(text)
+        scans = (
+            (self._names_text, self._name_starts, self._name_slots, "\n" + text, None),
+            (self._paths_text, self._path_starts, self._path_slots, text, ranges),
+            (self._paths_text, self._path_starts, self._path_slots, fuzzy, ranges),
+        )
+        for haystack, starts, slots, needle, needle_ranges in scans:
+            if ranges == []:
+                break
+            self._scan(haystack, starts, slots, needle, scores, text, fuzzy,
+                       candidate_limit if isinstance(needle, str) else limit, needle_ranges)
+            if len(scores) >= limit:
+                break
+        
+        # 新增的文件和最近打开的文件逐个匹配；最近打开的文件即使所在的层次没有被扫描也能排在前面
+        for slot in self.pending:
+            if slot not in scores and self.paths[slot] is not None:
+                scores[slot] = self._classify(text, slot, fuzzy)
+        recent_count = len(self.recent)
+        for rank, relative_path in enumerate(self.recent):
+            slot = self.slots.get(relative_path)
+            if slot is None:
+                continue
+            if slot not in scores:
+                scores[slot] = self._classify(text, slot, fuzzy)
+            if scores[slot] is not None:
+                scores[slot] += self.RECENT_BONUS * (rank + 1) // recent_count
+        
+        ranked = heapq.nsmallest(limit, ((slot, score) for slot, score in scores.items() if score is not None),
+                                 key=lambda item: (-item[1], len(self.paths[item[0]])))
+        return [self.paths[slot] for slot, _ in ranked]
+
+class QuickOpenDialog(QDialog):
+    """Ctrl+P快速打开：输入文件名或路径的部分字符，回车打开选中的文件"""
+    file_selected = pyqtSignal(str)
+    
+    def __init__(self, path_index, data_dir, parent=None):
+        super().__init__(parent)
+        self.path_index = path_index
+        self.data_dir = data_dir
+        self.setWindowTitle("快速打开")
+        self.resize(560, 420)
+        
+        layout = QVBoxLayout(self)
+        self.input = QLineEdit()
+        self.input.setPlaceholderText("输入文件名或路径（支持不连续的字符）...")
+        self.input.textChanged.connect(self.update_results)
+        self.input.installEventFilter(self)
+        self.results = QListWidget()
+        self.results.itemActivated.connect(self.open_item)
+        self.hint_label = QLabel("")
+        layout.addWidget(self.input)
+        layout.addWidget(self.results)
+        layout.addWidget(self.hint_label)
+    
+    def set_index(self, path_index, data_dir):
+        self.path_index = path_index
+        self.data_dir = data_dir
+    
+    def popup(self):
+        """显示对话框并列出最近打开的文件"""
+        self.input.clear()
+        self.update_results("")
+        self.show()
+        self.raise_()
+        self.activateWindow()
+        self.input.setFocus()
+    
+    def update_results(self, text):
+        self.results.clear()
+        for relative_path in self.path_index.query(text):
+            directory, _, name = relative_path.rpartition('/')
+            item = QListWidgetItem(f"{name}    {directory}" if directory else name)
+            item.setData(Qt.UserRole, relative_path)
+            item.setToolTip(relative_path)
+            self.results.addItem(item)
+        if self.results.count():
+            self.results.setCurrentRow(0)
+        self.hint_label.setText("最近打开的文件" if not text.strip() else f"共 {len(self.path_index)} 个文件")
+    
+    def eventFilter(self, obj, event):
+        # 在输入框中用上下键选择结果，回车打开
+        if obj is self.input and event.type() == QEvent.KeyPress:
+            key = event.key()
+            if key in (Qt.Key_Down, Qt.Key_Up):
+                row = self.results.currentRow() + (1 if key == Qt.Key_Down else -1)
+                if 0 <= row < self.results.count():
+                    self.results.setCurrentRow(row)
+                return True
+            if key in (Qt.Key_Return, Qt.Key_Enter):
+                self.open_item(self.results.currentItem())
+                return True
+        return super().eventFilter(obj, event)
+    
+    def open_item(self, item):
+        if item is None:
+            return
+        self.hide()
+        self.file_selected.emit(os.path.join(self.data_dir, item.data(Qt.UserRole).replace('/', os.sep)))
\ No newline at end of file
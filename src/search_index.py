@@ -0,0 +1,916 @@
+import os
+import re
+import html
+import heapq
+import math
+import sqlite3
+import time
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from file_cache import FileStatCache, content_hash
+from text_analyzer import Analyzer, CJK_RANGES, SUBSTRING
+from search_query import parse_query, required_literals
+
+# 索引文件保存在数据目录下
+INDEX_FILE_NAME = ".search_index.db"
+# 需要建立索引的笔记类型
+NOTE_EXTENSIONS = ('.txt', '.md')
+# 需要重新索引的文件超过该数量时使用多进程
+PARALLEL_THRESHOLD = 200
+# 每个子进程任务处理的文件数
+SHARD_SIZE = 128
+
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 出现在标题（文件名）和Markdown标题行中的词项额外加权
+HEADING_BOOST = 3.0
+
+# 词典中的英文词项按三字母组建立索引，用于子串和正则表达式查询
+_CJK_CHAR_RE = re.compile(f'[{CJK_RANGES}]')
+_FRAGMENT_RE = re.compile(rf'([{CJK_RANGES}]+)|([^\W{CJK_RANGES}]+)')
+
+def encode_positions(positions):
+    """词项在文中的位置列表编码为BLOB"""
+    return array('I', positions).tobytes()
+
+def decode_positions(blob):
+    positions = array('I')
+    if blob:
+        positions.frombytes(blob)
+    return positions
+
+def trigrams(term):
+    """英文词项的三字母组，中文词项本身就是二元组，不需要"""
+    if len(term) < 3 or _CJK_CHAR_RE.search(term):
+        return set()
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+def analyze_note(file_path, content, analyzer):
+    """统计笔记的词项，文件名作为标题，返回 ({词项: (词频, 标题词频)}, 文档长度)"""
+    return analyzer.analyze(os.path.splitext(os.path.basename(file_path))[0], content)
+
+def index_shard(data_dir, relative_paths, analyzer_spec):
+    """在子进程中读取并分析一组笔记，返回 (文件列表, 局部倒排表)
+    
+    文件列表为 [(相对路径, mtime_ns, size, 摘要, 文档长度)]，
+    局部倒排表为 {词项: [(文件在列表中的序号, 词频, 标题词频, 位置BLOB)]}，由主进程合并。
+    """
+    analyzer = Analyzer.from_spec(analyzer_spec)
+    docs = []
+    postings = {}
+    for relative_path in relative_paths:
+        file_path = os.path.join(data_dir, relative_path.replace('/', os.sep))
+        try:
+            st = os.stat(file_path)
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            content = data.decode('utf-8')
+        except Exception as e:
+            print(f"索引文件时出错: {file_path}, 错误: {str(e)}")
+            continue
+        term_counts, length = analyze_note(file_path, content, analyzer)
+        position = len(docs)
+        docs.append((relative_path, st.st_mtime_ns, st.st_size, content_hash(data), length))
+        for term, (tf, htf, positions) in term_counts.items():
+            postings.setdefault(term, []).append((position, tf, htf, encode_positions(positions)))
+    return docs, postings
+
+def make_snippet(file_path, pattern, context=30):
+    """在笔记中查找pattern的第一处匹配，返回 (行号, 带高亮的HTML片段)，没有匹配时行号为None"""
+    if pattern is None:
+        return None, ""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f):
+                match = pattern.search(line)
+                if not match:
+                    continue
+                line = line.rstrip("\n")
+                start = max(0, match.start() - context)
+                end = min(len(line), match.end() + context * 2)
+                text = line[start:end]
+                parts = []
+                pos = 0
+                for m in pattern.finditer(text):
+                    parts.append(html.escape(text[pos:m.start()]))
+                    parts.append(f"<b style='color:#cc3300'>{html.escape(m.group())}</b>")
+                    pos = m.end()
+                parts.append(html.escape(text[pos:]))
+                snippet = "".join(parts).strip()
+                if start > 0:
+                    snippet = "…" + snippet
+                if end < len(line):
+                    snippet += "…"
+                return line_number, snippet
+    except Exception as e:
+        print(f"读取摘要时出错: {file_path}, 错误: {str(e)}")
+    return None, ""
+
+class RankedResults:
+    """按得分从高到低逐批取出的查询结果
+    
+    对全部匹配的文件建堆（线性时间），每次只弹出接下来要显示的一批，不对全部结果排序。
+    """
+    
+    def __init__(self, file_ids, scored):
+        # 全部匹配的文件编号集合
+        self.file_ids = file_ids
+        self._heap = [(-value, file_id) for value, file_id in scored]
+        heapq.heapify(self._heap)
+    
+    def __len__(self):
+        return len(self.file_ids)
+    
+    def remaining(self):
+        """尚未取出的结果数"""
+        return len(self._heap)
+    
+    def take(self, count):
+        """取出接下来得分最高的count个 [(文件编号, 得分)]"""
+        heap = self._heap
+        taken = []
+        for _ in range(min(count, len(heap))):
+            value, file_id = heapq.heappop(heap)
+            taken.append((file_id, -value))
+        return taken
+
+class SearchIndex:
+    """保存在数据目录下的持久化倒排索引
+    
+    词项 -> 文件的倒排表存放在SQLite中，查询时只读取相关词项的倒排表，
+    不再读取笔记内容。笔记变化后通过update_file逐个文件更新。
+    同步时借助共享的FileStatCache判断哪些笔记有变化，只重新索引内容摘要变化的笔记。
+    索引和查询使用同一个Analyzer切分词项，其设置保存在索引中，因此每个数据目录可以不同；
+    给出与已保存的设置不同的analyzer时清空索引，等待重新同步。
+    """
+    
+    SCHEMA_VERSION = 5
+    
+    def __init__(self, data_dir, cache=None, analyzer=None):
+        self.data_dir = data_dir
+        self.cache = cache if cache is not None else FileStatCache(data_dir)
+        self.index_file = os.path.join(data_dir, INDEX_FILE_NAME)
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._open()
+        stored = self._get_meta("analyzer")
+        if analyzer is None:
+            self.analyzer = Analyzer.from_spec(stored)
+        else:
+            self.analyzer = analyzer
+            if stored is not None and stored != analyzer.spec:
+                self._reset()
+        self._set_meta("analyzer", self.analyzer.spec)
+    
+    # ---------- 连接与表结构 ----------
+    
+    def _connect(self):
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_file)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def _open(self):
+        """打开索引，索引损坏或版本不符时重新创建"""
+        try:
+            self._create_schema()
+            version = self._get_meta("schema_version")
+            if version != str(self.SCHEMA_VERSION):
+                self._recreate()
+        except sqlite3.DatabaseError as e:
+            print(f"搜索索引已损坏，将重新创建: {str(e)}")
+            self._recreate()
+    
+    def _create_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    hash TEXT,
+                    length INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS terms (
+                    id INTEGER PRIMARY KEY,
+                    term TEXT UNIQUE NOT NULL,
+                    df INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS postings (
+                    term_id INTEGER NOT NULL,
+                    file_id INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    heading_tf INTEGER NOT NULL DEFAULT 0,
+                    positions BLOB,
+                    PRIMARY KEY (term_id, file_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_file ON postings(file_id);
+                CREATE TABLE IF NOT EXISTS term_grams (
+                    gram TEXT NOT NULL,
+                    term_id INTEGER NOT NULL,
+                    PRIMARY KEY (gram, term_id)
+                ) WITHOUT ROWID;
+            """)
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('schema_version', ?)",
+                         (str(self.SCHEMA_VERSION),))
+    
+    def _recreate(self):
+        """删除索引文件并创建空索引（只在打开损坏或旧版本的索引时使用，此时其他线程还没有连接）"""
+        self.close()
+        for suffix in ("", "-wal", "-shm"):
+            path = self.index_file + suffix
+            if os.path.exists(path):
+                os.remove(path)
+        self._create_schema()
+    
+    def _reset(self):
+        """在一个事务中清空索引并写入当前的设置
+        
+        不删除索引文件：其他线程（保存线程、界面线程）的连接仍然打开着，删除后它们会继续
+        读写已删除的文件（Windows上则无法删除）。清空在一个事务中完成，其他连接看到的
+        要么是清空前、要么是清空后的索引。
+        """
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for table in ("postings", "term_grams", "terms", "files", "meta"):
+                    conn.execute(f"DELETE FROM {table}")
+                conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                 [("schema_version", str(self.SCHEMA_VERSION)), ("analyzer", self.analyzer.spec)])
+    
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+    
+    def _get_meta(self, key):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def _set_meta(self, key, value):
+        conn = self._connect()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+    
+    # ---------- 路径转换 ----------
+    
+    def relative_path(self, file_path):
+        return os.path.relpath(file_path, self.data_dir).replace(os.sep, '/')
+    
+    def absolute_path(self, relative_path):
+        return os.path.join(self.data_dir, relative_path.replace('/', os.sep))
+    
+    # ---------- 索引更新 ----------
+    
+    def update_file(self, file_path):
+        """重新索引单个文件，文件不存在时从索引中移除"""
+        if not os.path.isfile(file_path):
+            self.remove_file(file_path)
+            return
+        try:
+            st = os.stat(file_path)
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            content = data.decode('utf-8')
+        except Exception as e:
+            print(f"索引文件时出错: {file_path}, 错误: {str(e)}")
+            return
+        digest = content_hash(data)
+        self.cache.record(file_path, st, digest)
+        analyzer = self.analyzer
+        term_counts, length = analyze_note(file_path, content, analyzer)
+        self._write_file(self.relative_path(file_path), st.st_mtime_ns, st.st_size, digest, length, term_counts,
+                         analyzer)
+    
+    def _write_file(self, relative_path, mtime_ns, size, digest, length, term_counts, analyzer=None):
+        """写入单个文件的倒排记录，term_counts为 {词项: (词频, 标题词频, [位置])}"""
+        with self._lock:
+            if analyzer is not None and analyzer is not self.analyzer:
+                # 分析期间更换了分词方式并清空了索引，由重建时的同步重新索引这个文件
+                return
+            conn = self._connect()
+            with conn:
+                file_id = self._upsert_file(conn, relative_path, mtime_ns, size, digest, length)
+                term_ids = self._term_ids(conn, term_counts.keys())
+                conn.executemany("INSERT INTO postings (term_id, file_id, tf, heading_tf, positions) "
+                                 "VALUES (?, ?, ?, ?, ?)",
+                                 [(term_ids[term], file_id, tf, htf, encode_positions(positions))
+                                  for term, (tf, htf, positions) in term_counts.items()])
+                conn.executemany("UPDATE terms SET df = df + 1 WHERE id = ?",
+                                 [(term_id,) for term_id in term_ids.values()])
+    
+    def _upsert_file(self, conn, relative_path, mtime_ns, size, digest, length):
+        """写入文件记录并清除其旧的倒排记录，返回文件编号"""
+        row = conn.execute("SELECT id FROM files WHERE path = ?", (relative_path,)).fetchone()
+        if row:
+            file_id = row[0]
+            conn.execute("UPDATE files SET mtime_ns = ?, size = ?, hash = ?, length = ? WHERE id = ?",
+                         (mtime_ns, size, digest, length, file_id))
+            self._delete_postings(conn, file_id)
+            return file_id
+        return conn.execute(
+            "INSERT INTO files (path, mtime_ns, size, hash, length) VALUES (?, ?, ?, ?, ?)",
+            (relative_path, mtime_ns, size, digest, length)).lastrowid
+    
+    def bulk_index(self, relative_paths, progress=None, is_cancelled=None, workers=None):
+        """多进程索引大量笔记
+        
+        文件按分片分发给进程池，子进程完成读取、解码和分词，主进程合并各分片的
+        倒排表并批量写入，每个分片一个事务（取消时已合并的分片保留，由下次同步继续）。
+        无法创建子进程或子进程异常退出时，其余分片在本进程中索引。
+        返回已处理的文件数，取消时返回None。
+        """
+        total = len(relative_paths)
+        shards = [relative_paths[i:i + SHARD_SIZE] for i in range(0, total, SHARD_SIZE)]
+        spec = self.analyzer.spec
+        start_time = time.perf_counter()
+        done = 0
+        # 尚未合并的分片序号
+        remaining = set(range(len(shards)))
+        try:
+            executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+        except (OSError, NotImplementedError) as e:
+            print(f"无法启动多进程索引，改为单进程: {str(e)}")
+            executor = None
+        if executor is not None:
+            try:
+                futures = {executor.submit(index_shard, self.data_dir, shard, spec): i for i, shard in enumerate(shards)}
+                for future in as_completed(futures):
+                    if is_cancelled and is_cancelled():
+                        for pending in futures:
+                            pending.cancel()
+                        return None
+                    docs, postings = future.result()
+                    self._merge_shard(docs, postings)
+                    i = futures[future]
+                    remaining.discard(i)
+                    done += len(shards[i])
+                    if progress:
+                        progress(done, total)
+            except BrokenProcessPool as e:
+                # 子进程被杀死或内存不足时整个进程池不可用
+                print(f"索引子进程异常退出，其余文件改为单进程: {str(e)}")
+            finally:
+                executor.shutdown(wait=True)
+        for i in sorted(remaining):
+            if is_cancelled and is_cancelled():
+                return None
+            self._merge_shard(*index_shard(self.data_dir, shards[i], spec))
+            done += len(shards[i])
+            if progress:
+                progress(done, total)
+        # 扫描时推迟计算的摘要只由合并记录在内存中，保存后下次同步不必重新索引这些笔记
+        self.cache.save()
+        elapsed = time.perf_counter() - start_time
+        print(f"已索引 {total} 个文件，用时 {elapsed:.1f} 秒（{total / max(elapsed, 1e-6):.0f} 个/秒）")
+        return total
+    
+    def _merge_shard(self, docs, postings):
+        """把一个分片的局部倒排表在一个事务中合并到索引中"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                file_ids = []
+                for relative_path, mtime_ns, size, digest, length in docs:
+                    file_ids.append(self._upsert_file(conn, relative_path, mtime_ns, size, digest, length))
+                    self.cache.record_entry(relative_path, mtime_ns, size, digest)
+                term_ids = self._term_ids(conn, postings.keys())
+                conn.executemany("INSERT INTO postings (term_id, file_id, tf, heading_tf, positions) "
+                                 "VALUES (?, ?, ?, ?, ?)",
+                                 [(term_ids[term], file_ids[position], tf, htf, blob)
+                                  for term, entries in postings.items() for position, tf, htf, blob in entries])
+                conn.executemany("UPDATE terms SET df = df + ? WHERE id = ?",
+                                 [(len(entries), term_ids[term]) for term, entries in postings.items()])
+    
+    def _delete_postings(self, conn, file_id):
+        """删除文件的倒排记录，同时更新词项的文档频率"""
+        conn.execute("UPDATE terms SET df = df - 1 WHERE id IN "
+                     "(SELECT term_id FROM postings WHERE file_id = ?)", (file_id,))
+        conn.execute("DELETE FROM postings WHERE file_id = ?", (file_id,))
+    
+    def _term_ids(self, conn, terms):
+        """获取词项编号，不存在的词项会被加入词典，同时记录其三字母组"""
+        terms = list(terms)
+        ids = self._lookup_terms(conn, terms)
+        missing = [t for t in terms if t not in ids]
+        if missing:
+            conn.executemany("INSERT INTO terms (term) VALUES (?)", [(t,) for t in missing])
+            new_ids = self._lookup_terms(conn, missing)
+            conn.executemany("INSERT OR IGNORE INTO term_grams (gram, term_id) VALUES (?, ?)",
+                             [(gram, term_id) for term, term_id in new_ids.items() for gram in trigrams(term)])
+            ids.update(new_ids)
+        return ids
+    
+    def _lookup_terms(self, conn, terms):
+        ids = {}
+        # 分批查询，避免超过SQLite的参数个数限制
+        for i in range(0, len(terms), 500):
+            batch = terms[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            for term_id, term in conn.execute(
+                    f"SELECT id, term FROM terms WHERE term IN ({placeholders})", batch):
+                ids[term] = term_id
+        return ids
+    
+    def remove_file(self, file_path):
+        """从索引中移除文件"""
+        relative_path = self.relative_path(file_path)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                row = conn.execute("SELECT id FROM files WHERE path = ?", (relative_path,)).fetchone()
+                if row:
+                    self._delete_postings(conn, row[0])
+                    conn.execute("DELETE FROM files WHERE id = ?", (row[0],))
+    
+    def move_file(self, old_path, new_path):
+        """文件移动或重命名后更新索引中的路径，不重新读取内容
+        
+        文件名参与标题加权，文件名改变时重新索引该文件。
+        """
+        if os.path.basename(old_path) != os.path.basename(new_path):
+            self.remove_file(old_path)
+            self.update_file(new_path)
+            return
+        old_relative, new_relative = self.relative_path(old_path), self.relative_path(new_path)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                row = conn.execute("SELECT id FROM files WHERE path = ?", (new_relative,)).fetchone()
+                if row:
+                    # 移动覆盖了已有文件
+                    self._delete_postings(conn, row[0])
+                    conn.execute("DELETE FROM files WHERE id = ?", (row[0],))
+                moved = conn.execute("UPDATE files SET path = ? WHERE path = ?",
+                                     (new_relative, old_relative)).rowcount
+        if not moved:
+            self.update_file(new_path)
+    
+    def apply_changes(self, changes):
+        """按文件监视得到的ChangeSet增量更新索引"""
+        for relative_path in changes.removed:
+            if relative_path.endswith(NOTE_EXTENSIONS):
+                self.remove_file(self.absolute_path(relative_path))
+        for old_path, new_path in changes.moved:
+            if old_path.endswith(NOTE_EXTENSIONS):
+                if new_path.endswith(NOTE_EXTENSIONS):
+                    self.move_file(self.absolute_path(old_path), self.absolute_path(new_path))
+                else:
+                    self.remove_file(self.absolute_path(old_path))
+            elif new_path.endswith(NOTE_EXTENSIONS):
+                self.update_file(self.absolute_path(new_path))
+        for relative_path in changes.changed:
+            if relative_path.endswith(NOTE_EXTENSIONS):
+                self.update_file(self.absolute_path(relative_path))
+    
+    def sync(self, progress=None, is_cancelled=None):
+        """增量更新索引，只重新读取内容有变化的笔记
+        
+        先由FileStatCache扫描数据目录，再把缓存中的内容摘要与索引中记录的摘要比较。
+        progress(已扫描数, 总数)用于报告进度；is_cancelled()返回True时中止并返回None。
+        """
+        # 新笔记的摘要在建立索引读取文件时计算，不必在扫描时单独读取一次
+        if self.cache.scan(progress, is_cancelled, defer_hash_for=NOTE_EXTENSIONS) is None:
+            return None
+        indexed = dict(self._connect().execute("SELECT path, hash FROM files"))
+        to_update = []
+        for relative_path in self.cache.paths(NOTE_EXTENSIONS):
+            entry = self.cache.get(relative_path)
+            if indexed.pop(relative_path, None) != entry[2] or entry[2] is None:
+                to_update.append(relative_path)
+        # 剩下的是已经被删除的文件
+        for relative_path in indexed:
+            self.remove_file(self.absolute_path(relative_path))
+        
+        if len(to_update) >= PARALLEL_THRESHOLD:
+            if self.bulk_index(to_update, progress, is_cancelled) is None:
+                return None
+        else:
+            for i, relative_path in enumerate(to_update):
+                if is_cancelled and is_cancelled():
+                    return None
+                self.update_file(self.absolute_path(relative_path))
+                if progress:
+                    progress(i + 1, len(to_update))
+        return len(to_update), len(indexed)
+    
+    def rebuild(self, progress=None, is_cancelled=None, analyzer=None):
+        """清空现有索引并重新建立，给出analyzer时同时更换分词方式"""
+        with self._lock:
+            if analyzer is not None:
+                self.analyzer = analyzer
+            self._reset()
+        return self.sync(progress, is_cancelled)
+    
+    # ---------- 查询 ----------
+    
+    def postings(self, term, candidates=None):
+        """读取词项的倒排表，返回 {文件编号: (词频, 标题词频)}"""
+        return self._read_postings("t.term = ?", (term,), candidates)
+    
+    def prefix_postings(self, prefix, candidates=None):
+        """读取所有以prefix开头的词项的倒排表，同一文件的词频累加
+        
+        词典按词项排序保存，前缀查询是一次范围扫描。给出候选集合且较小时，只在候选文件中查找。
+        """
+        return self._read_postings(*self._term_condition(prefix, True), candidates)
+    
+    def _term_condition(self, term, mode):
+        """按匹配方式查找词项的SQL条件（词典的别名为t）和参数
+        
+        词典按词项排序保存，前缀匹配是一次范围扫描；子串匹配先取包含词项最少的一个三字母组，
+        再在这些词项中核对子串，两个字母的子串只能扫描整个词典。
+        """
+        if mode == SUBSTRING:
+            grams = trigrams(term)
+            if not grams:
+                return "instr(t.term, ?) > 0", [term]
+            conn = self._connect()
+            gram = min(grams, key=lambda g: conn.execute(
+                "SELECT COUNT(*) FROM term_grams WHERE gram = ?", (g,)).fetchone()[0])
+            return "t.id IN (SELECT term_id FROM term_grams WHERE gram = ?) AND instr(t.term, ?) > 0", [gram, term]
+        if mode:
+            return "t.term >= ? AND t.term < ?", [term, term[:-1] + chr(ord(term[-1]) + 1)]
+        return "t.term = ?", [term]
+    
+    def _read_postings(self, condition, params, candidates):
+        # CROSS JOIN固定先查词典再按主键查倒排表，避免SQLite按候选文件扫描其全部倒排记录
+        sql = ("SELECT p.file_id, p.tf, p.heading_tf FROM terms t CROSS JOIN postings p ON p.term_id = t.id "
+               f"WHERE {condition}")
+        params = list(params)
+        if candidates is not None and len(candidates) <= 500:
+            sql += f" AND p.file_id IN ({','.join('?' * len(candidates))})"
+            params.extend(candidates)
+        result = {}
+        for file_id, tf, htf in self._connect().execute(sql, params):
+            if candidates is not None and file_id not in candidates:
+                continue
+            old = result.get(file_id)
+            result[file_id] = (tf, htf) if old is None else (old[0] + tf, old[1] + htf)
+        return result
+    
+    def document_frequency(self, term, prefix=False):
+        """词项的文档频率，前缀或子串匹配时为各词项文档频率之和（近似值）；prefix为匹配方式"""
+        condition, params = self._term_condition(term, prefix)
+        row = self._connect().execute(f"SELECT SUM(t.df) FROM terms t WHERE {condition}", params).fetchone()
+        return (row[0] or 0) if row else 0
+    
+    def match_ids(self, keyword, prefix=False, candidates=None):
+        """返回匹配查询的文件编号集合
+        
+        prefix为True时关键词按前缀匹配（中文二元组总是精确匹配）；candidates为上一次
+        （更短的）查询结果，查询只会在其中缩小范围。
+        """
+        return self.rank(keyword, prefix, candidates, top_k=0)[0]
+    
+    def rank(self, keyword, prefix=False, candidates=None, top_k=100, is_cancelled=None):
+        """执行查询并按BM25对匹配的文件排序，返回 (全部匹配的文件编号集合, 前top_k个 [(文件编号, 得分)])
+        
+        top_k为None时返回全部匹配的文件（按得分排序）。查询语法见parse_query。
+        """
+        results = self.ranked(keyword, prefix, candidates, is_cancelled)
+        return results.file_ids, results.take(len(results) if top_k is None else top_k)
+        
+    def ranked(self, keyword, prefix=False, candidates=None, is_cancelled=None):
+        """执行查询并为匹配的文件计算BM25得分，返回可以按得分逐批取出的RankedResults
+        
+        只有不在NOT之下的关键词和短语参与计分，没有计分的词项时按文件编号排列。
+        """
+        query = parse_query(keyword)
+        # 查询过程中读取的倒排表，计分时复用
+        postings_cache = {}
+        file_ids = self._evaluate(query, prefix, candidates, postings_cache, is_cancelled)
+        if not file_ids:
+            return RankedResults(file_ids or set(), ())
+        
+        scoring_terms = set()
+        for node in query.positive(("word", "phrase")):
+            if node.kind == "word":
+                scoring_terms.update(self.analyzer.query_terms(node.value, prefix))
+            else:
+                scoring_terms.update((term, term_prefix)
+                                     for term, _, term_prefix in self.analyzer.phrase_terms(node.value, prefix))
+        if not scoring_terms:
+            return RankedResults(file_ids, ((0.0, file_id) for file_id in file_ids))
+        
+        conn = self._connect()
+        total, total_length = conn.execute("SELECT COUNT(*), SUM(length) FROM files").fetchone()
+        avg_length = (total_length or 0) / total if total else 1
+        lengths = self._lengths(file_ids)
+        term_postings = []
+        for term, term_prefix in scoring_terms:
+            postings = postings_cache.get((term, term_prefix))
+            if postings is None:
+                postings = self._term_postings(term, term_prefix, file_ids)
+            df = min(self.document_frequency(term, term_prefix), total)
+            term_postings.append((math.log(1 + (total - df + 0.5) / (df + 0.5)), postings))
+        
+        def score(file_id):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths.get(file_id, 0) / (avg_length or 1))
+            value = 0.0
+            for idf, postings in term_postings:
+                tf, htf = postings.get(file_id, (0, 0))
+                weighted = tf + HEADING_BOOST * htf
+                value += idf * weighted * (BM25_K1 + 1) / (weighted + norm)
+            return value
+        
+        return RankedResults(file_ids, ((score(file_id), file_id) for file_id in file_ids))
+    
+    def highlight_pattern(self, keyword, prefix=False):
+        """生成高亮查询结果的正则表达式，没有可高亮的内容时返回None"""
+        query = parse_query(keyword)
+        parts = set()
+        for node in query.positive(("word", "phrase")):
+            parts.update(self.analyzer.highlight_parts(node.value, prefix))
+        regex_nodes = query.positive(("re",))
+        for candidate in (parts | {f"(?:{node.value})" for node in regex_nodes}, parts):
+            if not candidate:
+                continue
+            try:
+                return re.compile("|".join(sorted(candidate, key=len, reverse=True)), re.IGNORECASE)
+            except re.error:
+                # 正则表达式带有全局标志等无法组合的写法时只高亮关键词
+                continue
+        return regex_nodes[0].regex if regex_nodes else None
+    
+    # ---------- 查询求值 ----------
+    
+    def _evaluate(self, node, prefix, candidates, cache, is_cancelled=None):
+        """返回匹配node的文件编号集合；给出candidates时结果是它的子集"""
+        kind = node.kind
+        if kind == "word":
+            return self._match_terms(self.analyzer.query_terms(node.value, prefix), candidates, cache)
+        if kind == "phrase":
+            return self._match_phrase(node.value, prefix, candidates, cache)
+        if kind in ("path", "ext"):
+            return self._match_path(kind, node.value, candidates)
+        if kind == "re":
+            return self._match_regex(node, candidates, cache, is_cancelled)
+        if kind == "all":
+            return self._all_ids() if candidates is None else set(candidates)
+        if kind == "not":
+            base = self._all_ids() if candidates is None else set(candidates)
+            return base - self._evaluate(node.children[0], prefix, base, cache, is_cancelled)
+        if kind == "or":
+            result = set()
+            for child in node.children:
+                result |= self._evaluate(child, prefix, candidates, cache, is_cancelled)
+            return result
+        # AND：先求代价低、结果少的子查询，后面的子查询只在已有结果中筛选，正则表达式和NOT放在最后
+        result = candidates
+        for child in sorted(node.children, key=lambda c: self._estimate(c, prefix)):
+            if result is not None and not result:
+                break
+            if is_cancelled and is_cancelled():
+                return set()
+            result = self._evaluate(child, prefix, result, cache, is_cancelled)
+        return result if result is not None else set()
+    
+    def _estimate(self, node, prefix):
+        """估计子查询的代价，用于决定AND中子查询的求值顺序"""
+        if node.kind == "word":
+            terms = self.analyzer.query_terms(node.value, prefix)
+            return min((self.document_frequency(t, p) for t, p in terms), default=0)
+        if node.kind == "phrase":
+            terms = self.analyzer.phrase_terms(node.value, prefix)
+            return min((self.document_frequency(t, p) for t, _, p in terms), default=0)
+        if node.kind in ("path", "ext"):
+            return 1 << 40
+        if node.kind in ("and", "or"):
+            return (1 << 41) + len(node.children)
+        # 正则表达式需要读取文件，NOT需要全部文件编号
+        return 1 << 50
+    
+    def _all_ids(self):
+        return {row[0] for row in self._connect().execute("SELECT id FROM files")}
+    
+    def _term_postings(self, term, term_prefix, candidates):
+        return self._read_postings(*self._term_condition(term, term_prefix), candidates)
+    
+    def _match_terms(self, terms, candidates, cache):
+        """所有词项都出现的文件，从文档频率最小的词项开始求交集"""
+        if not terms:
+            return set() if candidates is None else set(candidates)
+        file_ids = candidates
+        for term, term_prefix in sorted(terms, key=lambda t: self.document_frequency(*t)):
+            if file_ids is not None and not file_ids:
+                return set()
+            postings = self._term_postings(term, term_prefix, file_ids)
+            cache[(term, term_prefix)] = postings
+            file_ids = set(postings) if file_ids is None else file_ids & postings.keys()
+        return file_ids
+    
+    def _match_phrase(self, phrase, prefix, candidates, cache):
+        """按位置倒排表匹配短语：各词项在文中的位置之差与短语中一致"""
+        terms = self.analyzer.phrase_terms(phrase, prefix)
+        file_ids = self._match_terms([(t, p) for t, _, p in terms], candidates, cache)
+        if len(terms) < 2 or not file_ids:
+            return file_ids
+        positions = {}
+        for term, _, term_prefix in terms:
+            if (term, term_prefix) not in positions:
+                positions[(term, term_prefix)] = self._positions(term, term_prefix, file_ids)
+        first_term, first_offset, first_prefix = min(
+            terms, key=lambda t: sum(len(p) for p in positions[(t[0], t[2])].values()))
+        result = set()
+        for file_id in file_ids:
+            for start in positions[(first_term, first_prefix)].get(file_id, ()):
+                start -= first_offset
+                if all(start + offset in positions[(term, term_prefix)].get(file_id, ())
+                       for term, offset, term_prefix in terms):
+                    result.add(file_id)
+                    break
+        return result
+    
+    def _positions(self, term, term_prefix, file_ids):
+        """读取词项在各文件中的位置，返回 {文件编号: 位置集合}"""
+        condition, params = self._term_condition(term, term_prefix)
+        sql = ("SELECT p.file_id, p.positions FROM terms t CROSS JOIN postings p ON p.term_id = t.id "
+               f"WHERE {condition}")
+        if len(file_ids) <= 500:
+            sql += f" AND p.file_id IN ({','.join('?' * len(file_ids))})"
+            params.extend(file_ids)
+        result = {}
+        for file_id, blob in self._connect().execute(sql, params):
+            if file_id in file_ids:
+                result.setdefault(file_id, set()).update(decode_positions(blob))
+        return result
+    
+    def _match_path(self, kind, value, candidates):
+        """path:按相对路径中的片段（可以使用*和?通配符）筛选，ext:按扩展名筛选"""
+        conn = self._connect()
+        if kind == "ext":
+            rows = conn.execute("SELECT id FROM files WHERE lower(path) LIKE ?", (f"%.{value}",))
+        elif '*' in value or '?' in value:
+            pattern = value.lower().replace('\\', '/')
+            if not pattern.startswith('*'):
+                pattern = '*' + pattern
+            if not pattern.endswith('*'):
+                pattern += '*'
+            rows = conn.execute("SELECT id FROM files WHERE lower(path) GLOB ?", (pattern,))
+        else:
+            rows = conn.execute("SELECT id FROM files WHERE instr(lower(path), ?) > 0",
+                                (value.lower().replace('\\', '/'),))
+        file_ids = {row[0] for row in rows}
+        return file_ids if candidates is None else file_ids & candidates
+    
+    def _match_regex(self, node, candidates, cache, is_cancelled=None):
+        """正则表达式查询：先用其中必然出现的字面串在索引中筛选候选文件，再读取候选文件匹配
+        
+        正则表达式按原文匹配，筛选出的候选文件必须包含所有匹配的文件，见_literal_candidates。
+        """
+        file_ids = candidates
+        for literal in sorted(required_literals(node.value), key=len, reverse=True):
+            if file_ids is not None and not file_ids:
+                return set()
+            literal_ids = self._literal_candidates(literal, file_ids, cache)
+            if literal_ids is not None:
+                file_ids = literal_ids
+        if file_ids is None:
+            file_ids = self._all_ids()
+        result = set()
+        for file_id, relative_path in self._path_items(file_ids):
+            if is_cancelled and is_cancelled():
+                return set()
+            try:
+                with open(self.absolute_path(relative_path), 'r', encoding='utf-8') as f:
+                    content = f.read()
+            except Exception:
+                continue
+            if node.regex.search(content):
+                result.add(file_id)
+        return result
+    
+    def _literal_candidates(self, literal, candidates, cache):
+        """包含字面串的候选文件，无法用索引筛选时返回None
+        
+        字面串中的每段中文或英文都一定是文中某个词项的子串：中文按二元组查找，
+        英文先用三字母组在词典中找到包含它的词项。索引前去掉了Markdown语法时，
+        只出现在链接地址、HTML标签和围栏行中的字面串不在索引中，不能筛选；
+        使用jieba分词时一段中文可能跨越几个词项，中文部分也不能用于筛选。
+        """
+        if self.analyzer.strip_markdown:
+            return None
+        file_ids = candidates
+        filtered = False
+        for cjk_run, fragment in _FRAGMENT_RE.findall(literal.lower()):
+            if file_ids is not None and not file_ids:
+                return set()
+            if cjk_run and self.analyzer.cjk == "jieba":
+                continue
+            if cjk_run:
+                if len(cjk_run) == 1:
+                    terms = [(cjk_run, True)]
+                else:
+                    terms = [(cjk_run[i:i + 2], False) for i in range(len(cjk_run) - 1)]
+                file_ids = self._match_terms(terms, file_ids, cache)
+            else:
+                term_ids = self._terms_containing(fragment)
+                if term_ids is None:
+                    continue
+                file_ids = self._files_with_terms(term_ids, file_ids)
+            filtered = True
+        return file_ids if filtered else None
+    
+    def _terms_containing(self, fragment):
+        """词典中包含fragment的词项编号；fragment过短无法筛选时返回None"""
+        conn = self._connect()
+        grams = trigrams(fragment)
+        if not grams:
+            if len(fragment) < 2:
+                return None
+            return {row[0] for row in conn.execute(
+                "SELECT id FROM terms WHERE df > 0 AND instr(term, ?) > 0", (fragment,))}
+        # 三字母组的词项列表从短到长求交集
+        counts = sorted((conn.execute("SELECT COUNT(*) FROM term_grams WHERE gram = ?", (g,)).fetchone()[0], g)
+                        for g in grams)
+        term_ids = None
+        for _, gram in counts:
+            ids = {row[0] for row in conn.execute("SELECT term_id FROM term_grams WHERE gram = ?", (gram,))}
+            term_ids = ids if term_ids is None else term_ids & ids
+            if not term_ids:
+                return set()
+        # 三字母组都出现并不代表连续出现，再核对一次
+        result = set()
+        ids = list(term_ids)
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            for term_id, term in conn.execute(
+                    f"SELECT id, term FROM terms WHERE id IN ({','.join('?' * len(batch))})", batch):
+                if fragment in term:
+                    result.add(term_id)
+        return result
+    
+    def _files_with_terms(self, term_ids, candidates):
+        """包含任一词项的文件编号"""
+        conn = self._connect()
+        term_ids = list(term_ids)
+        file_ids = set()
+        for i in range(0, len(term_ids), 500):
+            batch = term_ids[i:i + 500]
+            file_ids.update(row[0] for row in conn.execute(
+                f"SELECT file_id FROM postings WHERE term_id IN ({','.join('?' * len(batch))})", batch))
+        return file_ids if candidates is None else file_ids & candidates
+    
+    def _path_items(self, file_ids):
+        conn = self._connect()
+        file_ids = list(file_ids)
+        for i in range(0, len(file_ids), 500):
+            batch = file_ids[i:i + 500]
+            yield from conn.execute(
+                f"SELECT id, path FROM files WHERE id IN ({','.join('?' * len(batch))})", batch)
+    
+    
+    def _lengths(self, file_ids):
+        conn = self._connect()
+        file_ids = list(file_ids)
+        lengths = {}
+        for i in range(0, len(file_ids), 500):
+            batch = file_ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            lengths.update(conn.execute(
+                f"SELECT id, length FROM files WHERE id IN ({placeholders})", batch))
+        return lengths
+    
+    def search(self, keyword, prefix=False):
+        """返回包含所有关键词的文件绝对路径列表"""
+        return self.paths(self.match_ids(keyword, prefix))
+    
+    def path(self, file_id):
+        """文件编号对应的绝对路径"""
+        row = self._connect().execute("SELECT path FROM files WHERE id = ?", (file_id,)).fetchone()
+        return self.absolute_path(row[0]) if row else None
+    
+    def path_map(self, file_ids):
+        """文件编号转换为 {文件编号: 绝对路径}，已不在索引中的文件不出现在结果中"""
+        return {file_id: self.absolute_path(path) for file_id, path in self._path_items(file_ids)}
+    
+    def paths(self, file_ids):
+        """文件编号转换为排序后的绝对路径列表"""
+        return sorted(self.absolute_path(path) for path in self._paths(file_ids))
+    
+    def _paths(self, file_ids):
+        conn = self._connect()
+        file_ids = list(file_ids)
+        paths = []
+        for i in range(0, len(file_ids), 500):
+            batch = file_ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            paths.extend(row[0] for row in conn.execute(
+                f"SELECT path FROM files WHERE id IN ({placeholders})", batch))
+        return paths
\ No newline at end of file
@@ -0,0 +1,247 @@
+import re
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from text_analyzer import EXACT, PREFIX, SUBSTRING
+
+# 运算符必须大写，小写的and/or/not按普通词搜索
+OPERATORS = ('AND', 'OR', 'NOT')
+# 带前缀的字段查询
+FIELDS = ('path', 'ext', 're')
+_FIELD_RE = re.compile(r'(' + '|'.join(FIELDS) + r'):')
+
+class QueryError(ValueError):
+    """查询语法错误"""
+
+class Query:
+    """解析后的查询语法树
+    
+    kind为 "word"（普通关键词，多个词之间为AND）、"phrase"（引号中的短语）、
+    "path"、"ext"、"re"、"and"、"or"、"not"、"all"（空查询）。
+    """
+    
+    def __init__(self, kind, value=None, children=None):
+        self.kind = kind
+        self.value = value
+        self.children = children or []
+        if kind == "re":
+            try:
+                self.regex = re.compile(value, re.IGNORECASE | re.MULTILINE)
+            except re.error as e:
+                raise QueryError(f"正则表达式有误: {value}（{str(e)}）")
+    
+    def __repr__(self):
+        if self.children:
+            return f"{self.kind}({', '.join(repr(c) for c in self.children)})"
+        return f"{self.kind}:{self.value!r}"
+    
+    @property
+    def simple(self):
+        """只由普通关键词组成的查询（可以复用上一次更短查询的结果）"""
+        if self.kind == "and":
+            return all(child.kind == "word" for child in self.children)
+        return self.kind == "word"
+    
+    def positive(self, kinds):
+        """不在NOT之下的指定类型节点，用于计算相关度和高亮"""
+        if self.kind == "not":
+            return []
+        if self.kind in kinds:
+            return [self]
+        nodes = []
+        for child in self.children:
+            nodes.extend(child.positive(kinds))
+        return nodes
+
+def _lex(text):
+    """切分查询，返回 [(类型, 值)]，类型为 "(" ")" "op" "-" "phrase" "field" "word" """
+    tokens = []
+    i = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c.isspace():
+            i += 1
+        elif c in '()':
+            tokens.append((c, c))
+            i += 1
+        elif c == '"':
+            end = text.find('"', i + 1)
+            # 未闭合的引号到查询末尾为止（边输入边搜索时很常见）
+            end = n if end < 0 else end
+            tokens.append(("phrase", text[i + 1:end]))
+            i = end + 1
+        elif c == '-' and i + 1 < n and not text[i + 1].isspace():
+            tokens.append(("-", c))
+            i += 1
+        else:
+            match = _FIELD_RE.match(text, i)
+            if match:
+                i = match.end()
+                if i < n and text[i] == '"':
+                    end = text.find('"', i + 1)
+                    end = n if end < 0 else end
+                    value = text[i + 1:end]
+                    i = end + 1
+                else:
+                    # 正则表达式可以包含括号，直到空白为止；其他字段遇到括号结束
+                    stop = r'\s' if match.group(1) == "re" else r'[\s()]'
+                    end = re.search(stop, text[i:])
+                    end = n if end is None else i + end.start()
+                    value = text[i:end]
+                    i = end
+                tokens.append(("field", (match.group(1), value)))
+                continue
+            end = re.search(r'[\s()"]', text[i:])
+            end = n if end is None else i + end.start()
+            word = text[i:end]
+            tokens.append(("op" if word in OPERATORS else "word", word))
+            i = end
+    return tokens
+
+class _Parser:
+    """递归下降解析：OR的优先级最低，相邻的项之间默认为AND"""
+    
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+    
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+    
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+    
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == ("op", "OR"):
+            self.next()
+            children.append(self.parse_and())
+        children = [c for c in children if c is not None]
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else Query("or", children=children)
+    
+    def parse_and(self):
+        children = []
+        while True:
+            kind, value = self.peek()
+            if kind is None or kind == ")" or (kind, value) == ("op", "OR"):
+                break
+            if (kind, value) == ("op", "AND"):
+                self.next()
+                continue
+            node = self.parse_unary()
+            if node is not None:
+                children.append(node)
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else Query("and", children=children)
+    
+    def parse_unary(self):
+        kind, value = self.next()
+        if kind == "-" or (kind, value) == ("op", "NOT"):
+            child = self.parse_unary()
+            return Query("not", children=[child]) if child is not None else None
+        if kind == "(":
+            node = self.parse_or()
+            if self.peek()[0] == ")":
+                self.next()
+            return node
+        if kind == ")":
+            return None
+        if kind == "phrase":
+            return Query("phrase", value) if value.strip() else None
+        if kind == "field":
+            field, text = value
+            if not text:
+                return None
+            if field == "ext":
+                text = text.lower().lstrip('.')
+            return Query(field, text)
+        return Query("word", value)
+
+def parse_query(text):
+    """解析查询文本
+    
+    支持 AND / OR / NOT（或在词前加-）、括号、"引号中的短语"、path:路径片段、
+    ext:扩展名 和 re:正则表达式；相邻的项之间默认为AND。
+    """
+    parser = _Parser(_lex(text))
+    node = parser.parse_or()
+    # 多余的右括号之后的内容继续按AND解析
+    while parser.pos < len(parser.tokens):
+        parser.next()
+        rest = parser.parse_or()
+        if rest is not None:
+            node = rest if node is None else Query("and", children=[node, rest])
+    return node if node is not None else Query("all")
+
+def refines(analyzer, old_keyword, new_keyword, prefix=False):
+    """new_keyword的结果是否一定是old_keyword结果的子集
+    
+    两者都只包含普通关键词，并且旧查询的每个词项都被新查询的某个词项蕴含时成立
+    （子串词项被包含它的词项蕴含，前缀词项被以它开头的前缀或精确词项蕴含，精确词项只被相同的词项蕴含）。
+    """
+    try:
+        if not old_keyword or not parse_query(old_keyword).simple or not parse_query(new_keyword).simple:
+            return False
+    except QueryError:
+        return False
+    new_terms = analyzer.query_terms(new_keyword, prefix)
+    for old_term, old_mode in analyzer.query_terms(old_keyword, prefix):
+        if not any(_implies(term, mode, old_term, old_mode) for term, mode in new_terms):
+            return False
+    return True
+
+def _implies(term, mode, old_term, old_mode):
+    """按mode匹配term的词项是否一定也按old_mode匹配old_term"""
+    if old_mode == SUBSTRING:
+        return old_term in term
+    if old_mode == PREFIX:
+        return mode != SUBSTRING and term.startswith(old_term)
+    return mode == EXACT and term == old_term
+
+def required_literals(pattern):
+    """提取正则表达式匹配时一定会出现的字面字符串，用于按索引预先筛选文件
+    
+    只处理顺序连接的部分，分支、可选项和字符集合都会截断字面串。
+    """
+    try:
+        parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    except re.error:
+        return []
+    literals = []
+    current = []
+    
+    def flush():
+        if current:
+            literals.append("".join(current))
+            current.clear()
+    
+    def walk(items):
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                current.append(chr(av))
+            elif op is sre_parse.SUBPATTERN:
+                walk(av[-1])
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                low, _, sub = av
+                flush()
+                if low >= 1:
+                    walk(sub)
+                    flush()
+            elif op is sre_parse.AT:
+                # ^ $ \b 等位置断言不占用字符
+                continue
+            else:
+                flush()
+    
+    walk(parsed)
+    flush()
+    return literals
\ No newline at end of file
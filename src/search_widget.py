@@ -1,15 +1,348 @@
 from PyQt5.QtCore import pyqtSignal
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QListWidget, QLabel, QListWidgetItem
-from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QListView,
+                             QLabel, QProgressBar, QShortcut, QStyledItemDelegate,
+                             QStyle, QApplication)
+from PyQt5.QtCore import Qt, QThread, QTimer, QSize, QAbstractListModel, QModelIndex
+from PyQt5.QtGui import QKeySequence, QTextDocument
 import os
+import html
+import time
+from collections import OrderedDict
+
+from search_index import SearchIndex, RankedResults, make_snippet
+from search_query import QueryError, refines
+
+# 结果项中保存匹配行号和HTML摘要的数据角色
+LINE_ROLE = Qt.UserRole + 1
+SNIPPET_ROLE = Qt.UserRole + 2
+
+class SnippetDelegate(QStyledItemDelegate):
+    """以HTML绘制搜索结果：第一行为路径和行号，第二行为高亮的上下文摘要"""
+    
+    def _document(self, option, index):
+        doc = QTextDocument()
+        doc.setDefaultFont(option.font)
+        doc.setDocumentMargin(2)
+        doc.setHtml(index.data(SNIPPET_ROLE) or html.escape(index.data(Qt.DisplayRole) or ""))
+        return doc
+    
+    def paint(self, painter, option, index):
+        self.initStyleOption(option, index)
+        doc = self._document(option, index)
+        # 先按默认样式绘制背景和选中状态，再绘制HTML内容
+        option.text = ""
+        style = option.widget.style() if option.widget else QApplication.style()
+        style.drawControl(QStyle.CE_ItemViewItem, option, painter, option.widget)
+        painter.save()
+        painter.translate(option.rect.topLeft())
+        painter.setClipRect(option.rect.translated(-option.rect.topLeft()))
+        doc.drawContents(painter)
+        painter.restore()
+    
+    def sizeHint(self, option, index):
+        doc = self._document(option, index)
+        return QSize(int(doc.idealWidth()), int(doc.size().height()))
+
+def format_snippet(file_path, data_dir, pattern):
+    """读取笔记生成搜索结果的 (匹配行号, HTML)，第一行为路径和行号，第二行为高亮的上下文摘要"""
+    line_number, snippet = make_snippet(file_path, pattern)
+    title = html.escape(os.path.relpath(file_path, data_dir))
+    if line_number is not None:
+        title += f" <span style='color:#888888'>:{line_number + 1}</span>"
+    return line_number, f"<b>{title}</b><br/><span style='color:#555555'>{snippet}</span>"
+
+class SnippetWorker(QThread):
+    """在后台线程中读取笔记，逐个生成搜索结果的摘要"""
+    # 结果的行号、(匹配行号, HTML)
+    snippet_ready = pyqtSignal(int, object)
+    
+    def __init__(self, rows, data_dir, pattern, parent=None):
+        super().__init__(parent)
+        # [(行号, 绝对路径)]
+        self.rows = rows
+        self.data_dir = data_dir
+        self.pattern = pattern
+        self._cancelled = False
+    
+    def cancel(self):
+        self._cancelled = True
+    
+    def run(self):
+        for row, file_path in self.rows:
+            if self._cancelled:
+                return
+            self.snippet_ready.emit(row, format_snippet(file_path, self.data_dir, self.pattern))
+
+class SearchResultModel(QAbstractListModel):
+    """搜索结果模型
+    
+    只保存查询结果的RankedResults（按得分建的堆）；视图滚动到末尾时通过fetchMore
+    取出得分最高的下一批并读取路径，不对全部命中排序。摘要在第一次绘制时请求，由SnippetWorker在后台线程中读取文件生成，
+    生成前只显示路径，生成后通过dataChanged刷新；只缓存最近使用的一部分。
+    命中数很大时也不会一次创建大量对象，绘制时也不读取文件。
+    """
+    
+    # 每次fetchMore加载的行数
+    FETCH_BATCH = 200
+    # 缓存的摘要数量
+    SNIPPET_CACHE_SIZE = 1000
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.search_index = None
+        self.data_dir = ""
+        self.pattern = None
+        self.results = RankedResults(set(), ())
+        # 已加载的行的绝对路径，文件已不在索引中时为None
+        self.paths = []
+        self.snippets = OrderedDict()
+        # 已请求摘要的行，以及其中尚未交给后台线程的行
+        self.requested = set()
+        self.queued = []
+        self.snippet_worker = None
+        # 同一次绘制中请求的摘要合并后交给一个线程
+        self.snippet_timer = QTimer(self)
+        self.snippet_timer.setSingleShot(True)
+        self.snippet_timer.setInterval(0)
+        self.snippet_timer.timeout.connect(self.start_snippet_worker)
+    
+    def set_results(self, index, data_dir, results, pattern):
+        """替换全部结果，results为查询得到的RankedResults"""
+        self.beginResetModel()
+        self.cancel_snippets()
+        self.search_index = index
+        self.data_dir = data_dir
+        self.results = results
+        self.pattern = pattern
+        self.paths = []
+        self.snippets.clear()
+        self.endResetModel()
+        # 先加载第一批，之后由视图滚动到末尾时请求
+        if self.canFetchMore(QModelIndex()):
+            self.fetchMore(QModelIndex())
+    
+    def clear(self):
+        self.set_results(None, "", RankedResults(set(), ()), None)
+    
+    def total(self):
+        """全部命中数（包括尚未加载的行）"""
+        return len(self.results)
+    
+    def matched(self):
+        """全部匹配的文件编号（包括尚未加载的行）"""
+        return self.results.file_ids
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+    
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.results.remaining() > 0
+    
+    def fetchMore(self, parent):
+        if parent.isValid() or self.search_index is None:
+            return
+        start = len(self.paths)
+        batch = [file_id for file_id, _ in self.results.take(self.FETCH_BATCH)]
+        if not batch:
+            return
+        path_map = self.search_index.path_map(batch)
+        self.beginInsertRows(QModelIndex(), start, start + len(batch) - 1)
+        self.paths.extend(path_map.get(file_id) for file_id in batch)
+        self.endInsertRows()
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.paths):
+            return None
+        row = index.row()
+        file_path = self.paths[row]
+        if role == Qt.UserRole:
+            return file_path
+        if role == Qt.DisplayRole:
+            return os.path.relpath(file_path, self.data_dir) if file_path else "（文件已删除）"
+        if role in (LINE_ROLE, SNIPPET_ROLE):
+            if file_path is None:
+                return None
+            cached = self.snippets.get(row)
+            if cached is None:
+                self.request_snippet(row)
+                if role == LINE_ROLE:
+                    return None
+                # 摘要生成前占住第二行，行高不随摘要到达而变化
+                return f"<b>{html.escape(os.path.relpath(file_path, self.data_dir))}</b><br/>&nbsp;"
+            self.snippets.move_to_end(row)
+            return cached[0] if role == LINE_ROLE else cached[1]
+        return None
+    
+    def line_number(self, row):
+        """第row行的匹配行号，摘要尚未生成时在当前线程中读取文件（用于打开结果）"""
+        file_path = self.paths[row]
+        if file_path is None:
+            return None
+        if row not in self.snippets:
+            self.store_snippet(row, format_snippet(file_path, self.data_dir, self.pattern))
+        return self.snippets[row][0]
+    
+    def request_snippet(self, row):
+        if row in self.requested:
+            return
+        self.requested.add(row)
+        self.queued.append(row)
+        if self.snippet_worker is None and not self.snippet_timer.isActive():
+            self.snippet_timer.start()
+    
+    def start_snippet_worker(self):
+        if self.snippet_worker is not None or not self.queued:
+            return
+        rows = [(row, self.paths[row]) for row in self.queued]
+        self.queued = []
+        worker = SnippetWorker(rows, self.data_dir, self.pattern, self)
+        worker.snippet_ready.connect(self.on_snippet_ready)
+        worker.finished.connect(lambda: self.on_snippet_worker_finished(worker))
+        self.snippet_worker = worker
+        worker.start()
+    
+    def cancel_snippets(self):
+        """放弃尚未生成的摘要，已取消的线程退出后自行释放"""
+        self.snippet_timer.stop()
+        self.requested.clear()
+        self.queued = []
+        worker = self.snippet_worker
+        if worker is None:
+            return
+        self.snippet_worker = None
+        worker.cancel()
+        worker.snippet_ready.disconnect(self.on_snippet_ready)
+    
+    def on_snippet_ready(self, row, snippet):
+        self.requested.discard(row)
+        self.store_snippet(row, snippet)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [LINE_ROLE, SNIPPET_ROLE])
+    
+    def on_snippet_worker_finished(self, worker):
+        if worker is self.snippet_worker:
+            self.snippet_worker = None
+            # 线程运行期间新请求的行
+            self.start_snippet_worker()
+        worker.deleteLater()
+    
+    def store_snippet(self, row, snippet):
+        self.snippets[row] = snippet
+        if len(self.snippets) > self.SNIPPET_CACHE_SIZE:
+            self.snippets.popitem(last=False)
+
+class IndexChangesWorker(QThread):
+    """在后台线程中按顺序把数据目录的外部变化（一组ChangeSet）写入索引"""
+    
+    def __init__(self, index, change_sets, parent=None):
+        super().__init__(parent)
+        self.index = index
+        self.change_sets = change_sets
+    
+    def run(self):
+        try:
+            for changes in self.change_sets:
+                self.index.apply_changes(changes)
+        except Exception as e:
+            print(f"更新索引时出错: {str(e)}")
+        finally:
+            # 关闭本线程的索引连接
+            self.index.close()
+
+class SearchWorker(QThread):
+    """在后台线程中执行搜索，发出为全部匹配文件计分后的结果"""
+    # 查询和可按得分逐批取出的RankedResults
+    results_ready = pyqtSignal(str, object)
+    progress = pyqtSignal(int, int)
+    # 同步完成，参数为重新索引的文件数和用时（秒）
+    index_synced = pyqtSignal(int, float)
+    # 查询语法错误
+    query_error = pyqtSignal(str)
+    
+    # 扫描进度的发送间隔（文件数）
+    PROGRESS_INTERVAL = 100
+    
+    def __init__(self, index, keyword, sync_index, candidates=None, rebuild=False, analyzer=None, parent=None):
+        super().__init__(parent)
+        self.index = index
+        self.keyword = keyword
+        self.sync_index = sync_index
+        self.candidates = candidates
+        # 清空索引后重新建立，analyzer不为None时同时更换分词方式
+        self.rebuild = rebuild
+        self.analyzer = analyzer
+        self._cancelled = False
+    
+    def cancel(self):
+        """请求取消，线程会在下一个检查点退出"""
+        self._cancelled = True
+    
+    def is_cancelled(self):
+        return self._cancelled
+    
+    def report_progress(self, scanned, total):
+        if scanned == total or scanned % self.PROGRESS_INTERVAL == 0:
+            self.progress.emit(scanned, total)
+    
+    def run(self):
+        try:
+            if self.sync_index:
+                start_time = time.perf_counter()
+                if self.rebuild:
+                    result = self.index.rebuild(self.report_progress, self.is_cancelled, self.analyzer)
+                else:
+                    result = self.index.sync(self.report_progress, self.is_cancelled)
+                if result is None:
+                    return
+                self.index_synced.emit(result[0], time.perf_counter() - start_time)
+            
+            # 没有关键词时只同步索引
+            if self._cancelled or self.keyword is None:
+                return
+            results = self.index.ranked(self.keyword, prefix=True, candidates=self.candidates,
+                                        is_cancelled=self.is_cancelled)
+            if self._cancelled:
+                return
+            self.results_ready.emit(self.keyword, results)
+        except QueryError as e:
+            self.query_error.emit(str(e))
+        except Exception as e:
+            print(f"搜索时出错: {str(e)}")
+        finally:
+            # 关闭本线程的索引连接
+            self.index.close()
 
 class SearchWidget(QWidget):
     # 添加file_clicked信号
     file_clicked = pyqtSignal(str)
+    # 打开文件并跳转到匹配行
+    file_line_clicked = pyqtSignal(str, int)
+    # 索引已与磁盘同步
+    index_ready = pyqtSignal()
+    # 重建索引完成，参数为索引的文件数和用时（秒）
+    index_rebuilt = pyqtSignal(int, float)
+    # 保存线程更新了索引，排队到界面线程中处理
+    saved_file_indexed = pyqtSignal()
     
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, debounce_ms=200, file_cache=None):
         super().__init__()
         self.data_dir = data_dir
+        self.debounce_ms = debounce_ms
+        self.index = SearchIndex(data_dir, file_cache)
+        # 索引在第一次搜索前与磁盘同步一次，之后按文件增量更新
+        self.index_synced = False
+        # 当前正在执行的搜索，以及已取消但尚未退出的搜索线程
+        self.worker = None
+        self.stale_workers = set()
+        # 等待已取消的线程退出后开始的重建，为 (新的分词方式或None,)
+        self.pending_rebuild = None
+        # 正在写入索引的外部变化，以及之后到达、等待写入的ChangeSet
+        self.changes_worker = None
+        self.pending_changes = []
+        # 上一次完成的查询（其结果在result_model中），新查询只是进一步限定它时在其结果中继续筛选
+        self.last_query = None
+        self.error_message = None
+        self.saved_file_indexed.connect(self.on_saved_file_indexed, Qt.QueuedConnection)
         self.init_ui()
     
     def init_ui(self):
@@ -18,45 +351,239 @@ class SearchWidget(QWidget):
         # 搜索框和按钮
         search_layout = QHBoxLayout()
         self.search_input = QLineEdit()
-        self.search_input.setPlaceholderText("输入搜索关键词...")
+        self.search_input.setPlaceholderText("输入搜索关键词，支持 AND OR NOT \"短语\" path: ext: re:")
+        self.search_input.returnPressed.connect(self.search_files)
+        self.search_input.textChanged.connect(self.on_text_changed)
         self.search_button = QPushButton("搜索")
         self.search_button.clicked.connect(self.search_files)
         search_layout.addWidget(self.search_input)
         search_layout.addWidget(self.search_button)
         
-        # 结果列表
-        self.results_list = QListWidget()
-        self.results_list.itemDoubleClicked.connect(self.on_item_double_clicked)
+        # 输入停顿后自动搜索
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(self.debounce_ms)
+        self.debounce_timer.timeout.connect(self.search_files)
+        
+        # Esc取消正在进行的搜索
+        cancel_shortcut = QShortcut(QKeySequence(Qt.Key_Escape), self)
+        cancel_shortcut.setContext(Qt.WidgetWithChildrenShortcut)
+        cancel_shortcut.activated.connect(self.cancel_search)
+        
+        # 搜索进度
+        self.status_label = QLabel("搜索结果:")
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(True)
+        self.progress_bar.setFormat("%v / %m")
+        self.progress_bar.hide()
+        
+        # 结果列表，数据按需从模型中读取
+        self.result_model = SearchResultModel(self)
+        self.results_list = QListView()
+        self.results_list.setModel(self.result_model)
+        self.results_list.setItemDelegate(SnippetDelegate(self.results_list))
+        self.results_list.setUniformItemSizes(True)
+        self.results_list.doubleClicked.connect(self.on_item_double_clicked)
         
         layout.addLayout(search_layout)
-        layout.addWidget(QLabel("搜索结果:"))
+        layout.addWidget(self.status_label)
+        layout.addWidget(self.progress_bar)
         layout.addWidget(self.results_list)
     
+    def set_data_dir(self, data_dir, file_cache=None):
+        """切换数据目录，同时切换到新目录下的索引"""
+        self.cancel_search()
+        self.index.close()
+        self.data_dir = data_dir
+        self.index = SearchIndex(data_dir, file_cache)
+        self.index_synced = False
+        self.pending_rebuild = None
+        self.pending_changes = []
+        self.last_query = None
+        self.result_model.clear()
+    
+    def set_analyzer(self, analyzer):
+        """更换当前数据目录的分词方式，索引会在后台重建"""
+        current = self.index.analyzer
+        if self.pending_rebuild is not None and self.pending_rebuild[0] is not None:
+            # 上一次更换还在等待已取消的线程退出
+            current = self.pending_rebuild[0]
+        if analyzer == current:
+            return
+        self.rebuild_index(analyzer)
+    
+    def update_file(self, file_path):
+        """文件保存或删除后更新索引"""
+        if file_path and os.path.abspath(file_path).startswith(os.path.abspath(self.data_dir)):
+            self.index.update_file(file_path)
+            # 索引已变化，上一次的结果不能再复用
+            self.last_query = None
+    
+    def index_saved_file(self, file_path):
+        """自动保存后在保存线程中更新索引（索引的写入有锁保护）"""
+        if file_path and os.path.abspath(file_path).startswith(os.path.abspath(self.data_dir)):
+            self.index.update_file(file_path)
+            # last_query只在界面线程中读写
+            self.saved_file_indexed.emit()
+    
+    def on_saved_file_indexed(self):
+        self.last_query = None
+    
+    def apply_changes(self, changes):
+        """数据目录发生外部变化时在后台线程中增量更新索引（git切换分支时可能有上千个文件）"""
+        if not changes.changed and not changes.removed and not changes.moved:
+            return
+        self.pending_changes.append(changes)
+        self.last_query = None
+        self.start_changes_worker()
+    
+    def start_changes_worker(self):
+        if self.changes_worker is not None or not self.pending_changes:
+            return
+        self.changes_worker = IndexChangesWorker(self.index, self.pending_changes, self)
+        self.pending_changes = []
+        self.changes_worker.finished.connect(self.on_changes_applied)
+        self.changes_worker.start()
+    
+    def on_changes_applied(self):
+        self.changes_worker.deleteLater()
+        self.changes_worker = None
+        # 写入期间完成的搜索可能还没有包含这些变化
+        self.last_query = None
+        self.start_changes_worker()
+    
+    def wait_for_changes(self):
+        """等待外部变化写入索引（退出前调用）"""
+        if self.changes_worker is not None:
+            self.changes_worker.wait()
+    
+    def start_index_sync(self):
+        """在后台同步索引，使第一次搜索不必等待"""
+        if self.index_synced or self.worker is not None or self.pending_rebuild is not None:
+            return
+        self.status_label.setText("正在更新索引...")
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.show()
+        self.start_worker(SearchWorker(self.index, None, True))
+    
+    def rebuild_index(self, analyzer=None):
+        """在后台重建搜索索引（给出analyzer时同时更换分词方式），完成后发出index_rebuilt
+        
+        先取消正在进行的同步或搜索，等这些线程都退出后才清空索引，重建不会与它们同时写入。
+        """
+        self.cancel_search()
+        self.index_synced = False
+        self.last_query = None
+        self.result_model.clear()
+        self.pending_rebuild = (analyzer,)
+        self.status_label.setText("正在重建索引...")
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.show()
+        self.start_pending_rebuild()
+    
+    def start_pending_rebuild(self):
+        if self.pending_rebuild is None or self.worker is not None or self.stale_workers:
+            return
+        analyzer, = self.pending_rebuild
+        self.pending_rebuild = None
+        # 重建完成后执行搜索框中的查询
+        keyword = self.search_input.text().strip() or None
+        self.start_worker(SearchWorker(self.index, keyword, True, rebuild=True, analyzer=analyzer))
+    
+    def on_text_changed(self, text):
+        """输入变化时重新开始计时，停顿debounce_ms后搜索"""
+        if not text.strip():
+            self.debounce_timer.stop()
+            self.cancel_search()
+            self.result_model.clear()
+            self.status_label.setText("搜索结果:")
+            return
+        self.debounce_timer.start()
+    
     def search_files(self):
+        self.debounce_timer.stop()
         keyword = self.search_input.text().strip()
-        if not keyword:
-            return
-        
-        self.results_list.clear()
-        
-        # 搜索文件内容
-        for root, _, files in os.walk(self.data_dir):
-            for file in files:
-                if file.endswith(('.txt', '.md')):
-                    file_path = os.path.join(root, file)
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            if keyword.lower() in content.lower():
-                                relative_path = os.path.relpath(file_path, self.data_dir)
-                                item = QListWidgetItem(relative_path)
-                                item.setData(Qt.UserRole, file_path)
-                                self.results_list.addItem(item)
-                    except Exception as e:
-                        print(f"搜索文件时出错: {file_path}, 错误: {str(e)}")
-    
-    def on_item_double_clicked(self, item):
-        file_path = item.data(Qt.UserRole)
+        if not keyword or self.pending_rebuild is not None:
+            # 等待重建的线程开始时会执行搜索框中的查询
+            return
+        
+        # 新查询只是进一步限定了上一次的查询时，结果一定是上一次结果的子集
+        candidates = None
+        if self.last_query is not None and refines(self.index.analyzer, self.last_query, keyword, prefix=True):
+            candidates = set(self.result_model.matched())
+        
+        # 开始新的搜索前取消上一次搜索
+        self.cancel_search()
+        self.result_model.clear()
+        self.last_query = None
+        self.error_message = None
+        self.status_label.setText("正在搜索...")
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.show()
+        
+        self.start_worker(SearchWorker(self.index, keyword, not self.index_synced, candidates))
+    
+    def start_worker(self, worker):
+        worker.results_ready.connect(self.on_results_ready)
+        worker.query_error.connect(self.on_query_error)
+        worker.progress.connect(self.on_search_progress)
+        worker.index_synced.connect(self.on_index_synced)
+        worker.finished.connect(lambda: self.on_worker_finished(worker))
+        self.worker = worker
+        worker.start()
+        
+    def cancel_search(self):
+        """取消正在进行的搜索"""
+        worker = self.worker
+        if worker is None:
+            return
+        self.worker = None
+        worker.cancel()
+        # 断开信号，已取消的搜索不再更新结果列表
+        worker.results_ready.disconnect(self.on_results_ready)
+        worker.query_error.disconnect(self.on_query_error)
+        worker.progress.disconnect(self.on_search_progress)
+        if worker.isRunning():
+            self.stale_workers.add(worker)
+        self.progress_bar.hide()
+        self.status_label.setText(f"搜索结果: {self.result_model.total()}（已取消）")
+    
+    def on_results_ready(self, keyword, results):
+        self.last_query = keyword
+        self.result_model.set_results(self.index, self.data_dir, results,
+                                      self.index.highlight_pattern(keyword, prefix=True))
+    
+    def on_search_progress(self, scanned, total):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(scanned)
+    
+    def on_query_error(self, message):
+        self.error_message = message
+    
+    def on_index_synced(self, updated, elapsed):
+        self.index_synced = True
+        self.index_ready.emit()
+        if self.sender() is not None and self.sender().rebuild:
+            self.index_rebuilt.emit(updated, elapsed)
+    
+    def on_worker_finished(self, worker):
+        self.stale_workers.discard(worker)
+        self.start_pending_rebuild()
+        if worker is self.worker:
+            self.worker = None
+            self.progress_bar.hide()
+            if self.error_message:
+                self.status_label.setText(f"查询有误: {self.error_message}")
+            else:
+                self.status_label.setText(f"搜索结果: {self.result_model.total()}")
+        worker.deleteLater()
+    
+    def on_item_double_clicked(self, index):
+        file_path = index.data(Qt.UserRole)
         if file_path:
-            # 发射信号通知主窗口打开文件
-            self.file_clicked.emit(file_path)
\ No newline at end of file
+            # 发射信号通知主窗口打开文件，有匹配行时跳转到该行
+            line_number = self.result_model.line_number(index.row())
+            if line_number is None:
+                self.file_clicked.emit(file_path)
+            else:
+                self.file_line_clicked.emit(file_path, line_number)
\ No newline at end of file
@@ -0,0 +1,88 @@
+import os
+import re
+from file_cache import content_hash
+
+# 笔记数量超过这个值时用多进程提取标签
+PARALLEL_THRESHOLD = 200
+# 每个子进程任务处理的笔记数量
+SHARD_SIZE = 256
+
+# 文件开头的YAML front matter（--- 到 --- 或 ...）
+_FRONT_MATTER_RE = re.compile(r'\A\ufeff?---[ \t]*\r?\n(.*?)(?:\r?\n)(?:---|\.\.\.)[ \t]*(?:\r?\n|\Z)', re.DOTALL)
+# front matter中的标签字段：tags: [a, b] / tags: a, b / tags: 后面跟 - a 形式的列表
+_FRONT_MATTER_KEY_RE = re.compile(r'^(tags?)[ \t]*:[ \t]*(.*)$', re.IGNORECASE)
+_FRONT_MATTER_ITEM_RE = re.compile(r'^[ \t]*-[ \t]+(.*)$')
+# 代码块和行内代码中的 # 不是标签
+_CODE_RE = re.compile(r'^[ \t]*(```|~~~).*?^[ \t]*\1[^\n]*$|`[^`\n]+`', re.MULTILINE | re.DOTALL)
+# 行内标签：#后面紧跟文字，前面不能是文字、#、&（HTML实体）或/（链接中的锚点）；
+# "# 标题"的#后面是空格，不会被当作标签
+_INLINE_TAG_RE = re.compile(r'(?<![\w#&/\\])#([\w][\w/-]*)')
+
+def _clean(tag):
+    tag = tag.strip().strip('\'"').lstrip('#').rstrip('/-')
+    # 纯数字（如 #123 表示编号）不作为标签
+    if not tag or not any(not c.isdigit() for c in tag):
+        return None
+    return tag
+
+def _front_matter_tags(front_matter):
+    tags = []
+    lines = front_matter.splitlines()
+    for i, line in enumerate(lines):
+        match = _FRONT_MATTER_KEY_RE.match(line)
+        if not match:
+            continue
+        value = match.group(2).strip()
+        if value:
+            # 行内写法：[a, b] 或 a, b 或 a b
+            value = value.strip('[]')
+            tags.extend(re.split(r'[,\s]+', value) if ',' not in value else value.split(','))
+            continue
+        # 块写法：后续以 - 开头的行
+        for item_line in lines[i + 1:]:
+            item = _FRONT_MATTER_ITEM_RE.match(item_line)
+            if not item:
+                break
+            tags.append(item.group(1))
+    return tags
+
+def extract_tags(content):
+    """从笔记内容中提取标签（front matter的tags字段和正文中的#标签），返回去重后的列表"""
+    tags = []
+    match = _FRONT_MATTER_RE.match(content)
+    if match:
+        tags.extend(_front_matter_tags(match.group(1)))
+        content = content[match.end():]
+    if '#' in content:
+        content = _CODE_RE.sub(' ', content)
+        tags.extend(_INLINE_TAG_RE.findall(content))
+    result = []
+    for tag in tags:
+        tag = _clean(tag)
+        if tag and tag not in result:
+            result.append(tag)
+    return result
+
+def file_key(st):
+    """文件系统中的文件编号（设备号:inode），文件移动或重命名后不变"""
+    return f"{st.st_dev}:{st.st_ino}" if st.st_ino else None
+
+def extract_shard(data_dir, relative_paths):
+    """读取一组笔记并提取标签，可在子进程中运行
+    
+    返回 [(相对路径, mtime_ns, size, 内容摘要, 文件系统编号, [标签])]。
+    """
+    results = []
+    for relative_path in relative_paths:
+        file_path = os.path.join(data_dir, relative_path.replace('/', os.sep))
+        try:
+            st = os.stat(file_path)
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            content = data.decode('utf-8')
+        except Exception as e:
+            print(f"提取标签时出错: {file_path}, 错误: {str(e)}")
+            continue
+        results.append((relative_path, st.st_mtime_ns, st.st_size, content_hash(data), file_key(st),
+                        extract_tags(content)))
+    return results
\ No newline at end of file
@@ -1,19 +1,208 @@
 import os
-import json
-from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
+import time
+import sqlite3
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel,
                            QLineEdit, QPushButton, QListWidget, QListWidgetItem,
-                           QInputDialog, QMessageBox)
-from PyQt5.QtCore import Qt, pyqtSignal
+                           QInputDialog, QMessageBox, QComboBox, QListView)
+from PyQt5.QtCore import Qt, pyqtSignal, QThread, QAbstractListModel, QModelIndex
+from tag_store import TagStore
+from search_index import NOTE_EXTENSIONS
+
+# 标签列表项上次的勾选状态
+FILTER_STATE_ROLE = Qt.UserRole + 1
+# 点击复选框时的下一个状态：包含、排除、不筛选（Qt默认依次切换为半勾选、勾选、未勾选）
+_NEXT_FILTER_STATE = {Qt.Unchecked: Qt.Checked, Qt.Checked: Qt.PartiallyChecked, Qt.PartiallyChecked: Qt.Unchecked}
+
+def popcount(bitmap):
+    """位图中的文件数量"""
+    try:
+        return bitmap.bit_count()
+    except AttributeError:
+        # Python 3.10之前没有int.bit_count
+        return bin(bitmap).count('1')
+
+def iter_bits(bitmap):
+    """依次返回位图中为1的位（文件编号）"""
+    while bitmap:
+        low = bitmap & -bitmap
+        yield low.bit_length() - 1
+        bitmap ^= low
+
+class TagIndex:
+    """标签到文件的反向索引
+    
+    每个文件分配一个紧凑的整数编号，每个标签对应一个以Python整数表示的位图
+    （第i位为1表示编号为i的文件带有该标签），多个标签的AND/OR/NOT筛选就是
+    位图的按位与、或、非，文件数量为位图中1的个数。
+    """
+    
+    def __init__(self):
+        # 文件路径 <-> 编号，删除的文件编号回收后重新分配
+        self.file_ids = {}
+        self.id_paths = []
+        self.free_ids = []
+        # 标签 -> 位图，带有任意标签的文件的位图
+        self.bitmaps = {}
+        self.tagged = 0
+    
+    def file_id(self, file_path, create=True):
+        file_id = self.file_ids.get(file_path)
+        if file_id is None and create:
+            if self.free_ids:
+                file_id = self.free_ids.pop()
+                self.id_paths[file_id] = file_path
+            else:
+                file_id = len(self.id_paths)
+                self.id_paths.append(file_path)
+            self.file_ids[file_path] = file_id
+        return file_id
+    
+    def add(self, file_path, tag):
+        bit = 1 << self.file_id(file_path)
+        self.bitmaps[tag] = self.bitmaps.get(tag, 0) | bit
+        self.tagged |= bit
+    
+    def remove(self, file_path, tag, file_tags=()):
+        """移除文件的一个标签，file_tags为文件剩余的标签（为空时回收文件编号）"""
+        file_id = self.file_id(file_path, create=False)
+        if file_id is None or tag not in self.bitmaps:
+            return
+        self.bitmaps[tag] &= ~(1 << file_id)
+        if not file_tags:
+            self.forget(file_path)
+    
+    def forget(self, file_path):
+        """从所有标签中移除文件并回收编号"""
+        file_id = self.file_ids.pop(file_path, None)
+        if file_id is None:
+            return
+        mask = ~(1 << file_id)
+        for tag, bitmap in self.bitmaps.items():
+            if bitmap >> file_id & 1:
+                self.bitmaps[tag] = bitmap & mask
+        self.tagged &= mask
+        self.id_paths[file_id] = None
+        self.free_ids.append(file_id)
+    
+    def move(self, old_path, new_path):
+        """文件移动后沿用原来的编号"""
+        file_id = self.file_ids.pop(old_path, None)
+        if file_id is not None:
+            self.file_ids[new_path] = file_id
+            self.id_paths[file_id] = new_path
+    
+    def rename_tag(self, old_tag, new_tag):
+        self.bitmaps[new_tag] = self.bitmaps.get(new_tag, 0) | self.bitmaps.pop(old_tag, 0)
+    
+    def delete_tag(self, tag):
+        return self.bitmaps.pop(tag, 0)
+    
+    def count(self, tag, within=None):
+        """带有标签的文件数量，within为限定范围的位图"""
+        bitmap = self.bitmaps.get(tag, 0)
+        return popcount(bitmap if within is None else bitmap & within)
+    
+    def filter(self, include=(), exclude=(), mode="and"):
+        """按标签筛选，返回位图
+        
+        include中的标签全部带有（mode为"and"）或带有任意一个（mode为"or"），
+        并且不带有exclude中的任何标签；include为空时从所有带标签的文件中排除。
+        """
+        if include:
+            bitmaps = [self.bitmaps.get(tag, 0) for tag in include]
+            result = bitmaps[0]
+            for bitmap in bitmaps[1:]:
+                result = result & bitmap if mode == "and" else result | bitmap
+        else:
+            result = self.tagged
+        for tag in exclude:
+            result &= ~self.bitmaps.get(tag, 0)
+        return result
+    
+    def paths(self, bitmap):
+        return [self.id_paths[file_id] for file_id in iter_bits(bitmap)]
+
+class FileListModel(QAbstractListModel):
+    """筛选结果的文件列表，只保存路径，绝对路径和标签提示在显示时才生成"""
+    
+    def __init__(self, manager, parent=None):
+        super().__init__(parent)
+        self.manager = manager
+        self.paths = []
+    
+    def set_paths(self, paths):
+        self.beginResetModel()
+        self.paths = paths
+        self.endResetModel()
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.paths):
+            return None
+        path = self.paths[index.row()]
+        if role == Qt.DisplayRole:
+            return path
+        if role == Qt.UserRole:
+            return self.manager.absolute_path(path)
+        if role == Qt.ToolTipRole:
+            return ", ".join(sorted(self.manager.file_tags.get(path, [])))
+        return None
+
+class TagSyncWorker(QThread):
+    """在后台线程中修复失效的文件路径，并重新提取有变化的笔记的标签"""
+    # 找回的文件 [(旧路径, 新路径)]、标签有变化的文件、检查的笔记数、用时（秒）
+    synced = pyqtSignal(object, object, int, float)
+    
+    def __init__(self, store, entries, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.entries = entries
+        self._cancelled = False
+    
+    def cancel(self):
+        self._cancelled = True
+    
+    def run(self):
+        start_time = time.perf_counter()
+        try:
+            # 先按文件指纹找回在程序之外被移动的文件，避免它们的标签被当作删除
+            moved, removed = self.store.reconcile(self.entries)
+            changed = self.store.sync_content(self.entries, is_cancelled=lambda: self._cancelled)
+        except sqlite3.Error as e:
+            print(f"提取标签时出错: {str(e)}")
+            changed = None
+        finally:
+            # 连接属于后台线程，结束前关闭
+            self.store.close()
+        if changed is not None:
+            self.synced.emit(moved, removed + changed, len(self.entries), time.perf_counter() - start_time)
 
 class TagManager(QWidget):
     tag_selected = pyqtSignal(str)
+    # 在筛选结果中选择的文件
+    file_selected = pyqtSignal(str)
+    # 保存线程中重新提取标签后，标签有变化的文件（在界面线程中刷新）
+    content_updated = pyqtSignal(object)
     
-    def __init__(self, data_dir):
+    # 一次变化的文件超过这个数量时重新加载全部标签，而不是逐个文件更新
+    RELOAD_THRESHOLD = 500
+    
+    def __init__(self, data_dir, cache=None):
         super().__init__()
         self.data_dir = data_dir
-        self.tags_file = os.path.join(data_dir, ".tags.json")
+        # 共享的文件元数据缓存，用于判断哪些笔记需要重新提取标签
+        self.cache = cache
+        self.sync_worker = None
+        self.sync_pending = False
+        self.content_updated.connect(self.refresh_files)
+        self.store = None
+        # 文件 -> 标签，键为数据库中保存的路径（数据目录中的文件为相对路径）
         self.file_tags = {}
         self.all_tags = set()
+        self.index = TagIndex()
+        self.current_file = None
         
         self.layout = QVBoxLayout(self)
         
@@ -34,62 +223,247 @@ class TagManager(QWidget):
         
         self.layout.addLayout(self.add_tag_layout)
         
-        # 标签列表
+        # 筛选方式：勾选的标签全部满足或满足任意一个，半勾选的标签排除
+        self.filter_layout = QHBoxLayout()
+        self.mode_combo = QComboBox()
+        self.mode_combo.addItem("同时带有勾选的标签", "and")
+        self.mode_combo.addItem("带有任一勾选的标签", "or")
+        self.mode_combo.currentIndexChanged.connect(self.update_filter)
+        self.clear_filter_btn = QPushButton("清除筛选")
+        self.clear_filter_btn.clicked.connect(self.clear_filter)
+        self.filter_layout.addWidget(self.mode_combo)
+        self.filter_layout.addWidget(self.clear_filter_btn)
+        self.layout.addLayout(self.filter_layout)
+        
+        # 标签列表（点击复选框依次切换：包含、排除、不筛选）
         self.tags_list = QListWidget()
+        self.tags_list.setToolTip("勾选：包含该标签；半勾选：排除该标签")
         self.tags_list.itemClicked.connect(self.on_tag_selected)
+        self.tags_list.itemChanged.connect(self.on_tag_check_changed)
         self.tags_list.setContextMenuPolicy(Qt.CustomContextMenu)
         self.tags_list.customContextMenuRequested.connect(self.show_tag_context_menu)
         
         self.layout.addWidget(self.tags_list)
         
+        # 筛选结果
+        self.result_label = QLabel("筛选结果:")
+        self.layout.addWidget(self.result_label)
+        # 结果可能有上万个文件，使用模型而不是逐个创建列表项
+        self.result_model = FileListModel(self, self)
+        self.result_list = QListView()
+        self.result_list.setModel(self.result_model)
+        self.result_list.setUniformItemSizes(True)
+        self.result_list.doubleClicked.connect(
+            lambda index: self.file_selected.emit(index.data(Qt.UserRole)))
+        self.layout.addWidget(self.result_list)
+        
         # 当前文件标签
         self.current_file_label = QLabel("当前文件标签:")
         self.layout.addWidget(self.current_file_label)
         
         self.current_file_tags = QListWidget()
         self.current_file_tags.setMaximumHeight(100)
+        self.current_file_tags.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.current_file_tags.customContextMenuRequested.connect(self.show_file_tag_context_menu)
         self.layout.addWidget(self.current_file_tags)
         
         # 加载标签数据
         self.load_tags()
     
     def load_tags(self):
-        if os.path.exists(self.tags_file):
-            try:
-                with open(self.tags_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.file_tags = data.get("file_tags", {})
+        try:
+            # 首次打开时导入旧的.tags.json
+            self.store = TagStore(self.data_dir)
+            self.file_tags, self.all_tags = self.store.load()
+        except sqlite3.Error as e:
+            QMessageBox.warning(self, "加载标签失败", f"无法加载标签数据: {str(e)}")
+            return
                     
-                    # 提取所有标签
-                    self.all_tags = set()
-                    for tags in self.file_tags.values():
-                        self.all_tags.update(tags)
+        # 建立反向索引
+        self.index = TagIndex()
+        for file_path, tags in self.file_tags.items():
+            for tag in tags:
+                self.index.add(file_path, tag)
                     
-                    # 更新标签列表
-                    self.update_tags_list()
-            except Exception as e:
-                QMessageBox.warning(self, "加载标签失败", f"无法加载标签数据: {str(e)}")
+        # 更新标签列表
+        self.update_tags_list()
+    
+    def stored_path(self, file_path):
+        """file_tags和索引中使用的路径"""
+        return self.store.stored_path(file_path) if self.store is not None else os.path.abspath(file_path)
+    
+    def absolute_path(self, path):
+        return self.store.absolute_path(path) if self.store is not None else path
+    
+    def refresh_files(self, file_paths):
+        """从数据库重新读取指定文件的标签（内容标签变化后），file_paths为数据库中保存的路径"""
+        if not file_paths:
+            return
+        if len(file_paths) > self.RELOAD_THRESHOLD:
+            self.load_tags()
+        else:
+            for file_path in file_paths:
+                old = set(self.file_tags.get(file_path, ()))
+                new = self.store.tags_of(file_path)
+                for tag in old - set(new):
+                    self.index.remove(file_path, tag, new)
+                for tag in new:
+                    self.index.add(file_path, tag)
+                if new:
+                    self.file_tags[file_path] = new
+                else:
+                    self.file_tags.pop(file_path, None)
+            self.all_tags = set(self.store.load_tag_names())
+            self.update_tags_list()
+        if self.current_file:
+            self.update_current_file_tags(self.current_file)
+    
+    def sync_content_tags(self):
+        """在后台重新提取有变化的笔记中的标签（#标签和front matter）"""
+        if self.cache is None or self.store is None:
+            return
+        if self.sync_worker is not None and self.sync_worker.isRunning():
+            # 当前同步结束后再同步一次
+            self.sync_pending = True
+            return
+        entries = {}
+        for relative_path in self.cache.paths(NOTE_EXTENSIONS):
+            entry = self.cache.get(relative_path)
+            if entry is not None:
+                entries[relative_path] = entry
+        self.sync_worker = TagSyncWorker(self.store, entries, self)
+        self.sync_worker.synced.connect(self.on_content_synced)
+        self.sync_worker.finished.connect(self.on_sync_finished)
+        self.sync_worker.start()
+    
+    def on_content_synced(self, moved, changed, checked, elapsed):
+        if moved:
+            print(f"已找回 {len(moved)} 个被移动的文件的标签")
+            self.move_entries(moved)
+            self.update_filter()
+        if changed:
+            print(f"已更新 {len(changed)} 个文件的标签（检查 {checked} 个笔记，用时 {elapsed:.1f} 秒）")
+        self.refresh_files(changed)
+    
+    def on_sync_finished(self):
+        if self.sync_pending:
+            self.sync_pending = False
+            self.sync_content_tags()
+    
+    def update_file_content(self, file_path, content):
+        """笔记保存后在保存线程中重新提取它的标签，有变化时在界面线程中刷新
+        
+        标签数据库的连接属于各自的线程，这里只读写数据库，不访问界面和内存中的标签。
+        """
+        store = self.store
+        if store is None:
+            return
+        try:
+            changed = store.update_content(file_path, content)
+        except (OSError, sqlite3.Error) as e:
+            print(f"提取标签时出错: {file_path}, 错误: {str(e)}")
+            return
+        if changed:
+            self.content_updated.emit(changed)
     
-    def save_tags(self):
+    def save_tags(self, method, *args):
+        """调用标签数据库的修改方法method（每次修改一个事务）"""
+        if self.store is None:
+            return
         try:
-            data = {
-                "file_tags": self.file_tags
-            }
-            with open(self.tags_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
+            getattr(self.store, method)(*args)
+        except sqlite3.Error as e:
             QMessageBox.warning(self, "保存标签失败", f"无法保存标签数据: {str(e)}")
     
+    def close_store(self):
+        if self.sync_worker is not None:
+            self.sync_worker.cancel()
+            self.sync_worker.wait()
+        if self.store is not None:
+            self.store.close()
+    
+    def filter_state(self):
+        """返回 (包含的标签, 排除的标签, 方式)"""
+        include, exclude = [], []
+        for row in range(self.tags_list.count()):
+            item = self.tags_list.item(row)
+            state = item.checkState()
+            if state == Qt.Checked:
+                include.append(item.data(Qt.UserRole))
+            elif state == Qt.PartiallyChecked:
+                exclude.append(item.data(Qt.UserRole))
+        return include, exclude, self.mode_combo.currentData()
+    
     def update_tags_list(self):
+        """重建标签列表，保留原来的筛选状态"""
+        include, exclude, _ = self.filter_state()
+        self.tags_list.blockSignals(True)
         self.tags_list.clear()
         for tag in sorted(self.all_tags):
             item = QListWidgetItem(tag)
+            item.setData(Qt.UserRole, tag)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable | Qt.ItemIsUserTristate)
+            state = Qt.Checked if tag in include else Qt.PartiallyChecked if tag in exclude else Qt.Unchecked
+            item.setCheckState(state)
+            item.setData(FILTER_STATE_ROLE, int(state))
             self.tags_list.addItem(item)
+        self.tags_list.blockSignals(False)
+        self.update_filter()
+    
+    def update_filter(self, *args):
+        """按当前的勾选状态筛选文件，并更新每个标签在结果中的文件数量"""
+        include, exclude, mode = self.filter_state()
+        active = bool(include or exclude)
+        result = self.index.filter(include, exclude, mode) if active else None
+        
+        # 每个标签显示带有它的文件数量；有筛选时显示在筛选结果中的数量
+        self.tags_list.blockSignals(True)
+        for row in range(self.tags_list.count()):
+            item = self.tags_list.item(row)
+            tag = item.data(Qt.UserRole)
+            total = self.index.count(tag)
+            if active:
+                item.setText(f"{tag} ({self.index.count(tag, result)}/{total})")
+            else:
+                item.setText(f"{tag} ({total})")
+        self.tags_list.blockSignals(False)
+        
+        if not active:
+            self.result_model.set_paths([])
+            self.result_label.setText("筛选结果: 勾选标签进行筛选")
+            return
+        paths = sorted(self.index.paths(result))
+        self.result_label.setText(f"筛选结果: {len(paths)} 个文件")
+        self.result_model.set_paths(paths)
+    
+    def on_tag_check_changed(self, item):
+        """点击复选框后按包含、排除、不筛选的顺序切换，再重新筛选"""
+        previous = item.data(FILTER_STATE_ROLE)
+        previous = Qt.Unchecked if previous is None else Qt.CheckState(previous)
+        if item.checkState() == previous:
+            return
+        state = _NEXT_FILTER_STATE[previous]
+        self.tags_list.blockSignals(True)
+        item.setCheckState(state)
+        item.setData(FILTER_STATE_ROLE, int(state))
+        self.tags_list.blockSignals(False)
+        self.update_filter()
+    
+    def clear_filter(self):
+        self.tags_list.blockSignals(True)
+        for row in range(self.tags_list.count()):
+            item = self.tags_list.item(row)
+            item.setCheckState(Qt.Unchecked)
+            item.setData(FILTER_STATE_ROLE, int(Qt.Unchecked))
+        self.tags_list.blockSignals(False)
+        self.update_filter()
     
     def update_current_file_tags(self, file_path):
+        self.current_file = file_path
         self.current_file_tags.clear()
-        if file_path in self.file_tags:
-            for tag in sorted(self.file_tags[file_path]):
+        path = self.stored_path(file_path) if file_path else None
+        if path in self.file_tags:
+            for tag in sorted(self.file_tags[path]):
                 item = QListWidgetItem(tag)
                 self.current_file_tags.addItem(item)
     
@@ -99,25 +473,53 @@ class TagManager(QWidget):
             self.all_tags.add(tag)
             self.update_tags_list()
             self.tag_input.clear()
-            self.save_tags()
+            self.save_tags("add_tag", tag)
     
     def add_tag_to_file(self, file_path, tag):
-        if file_path not in self.file_tags:
-            self.file_tags[file_path] = []
+        path = self.stored_path(file_path)
+        if path not in self.file_tags:
+            self.file_tags[path] = []
         
-        if tag not in self.file_tags[file_path]:
-            self.file_tags[file_path].append(tag)
+        if tag not in self.file_tags[path]:
+            self.file_tags[path].append(tag)
+            self.index.add(path, tag)
+            if tag not in self.all_tags:
+                self.all_tags.add(tag)
+                self.update_tags_list()
+            else:
+                self.update_filter()
             self.update_current_file_tags(file_path)
-            self.save_tags()
+            self.save_tags("add_tag_to_file", file_path, tag)
+    
+    def tag_files(self, file_paths, tags):
+        """批量为多个文件添加多个标签，只写入一次数据库"""
+        paths = [self.stored_path(file_path) for file_path in file_paths]
+        pairs = [(path, tag) for path in paths for tag in tags
+                 if tag not in self.file_tags.get(path, ())]
+        if not pairs:
+            return
+        for path, tag in pairs:
+            self.file_tags.setdefault(path, []).append(tag)
+            self.index.add(path, tag)
+        self.save_tags("add_tags", pairs)
+        self.all_tags.update(tags)
+        self.update_tags_list()
+        if self.current_file:
+            self.update_current_file_tags(self.current_file)
     
     def remove_tag_from_file(self, file_path, tag):
-        if file_path in self.file_tags and tag in self.file_tags[file_path]:
-            self.file_tags[file_path].remove(tag)
+        path = self.stored_path(file_path)
+        if path in self.file_tags and tag in self.file_tags[path]:
+            self.file_tags[path].remove(tag)
+            if not self.file_tags[path]:
+                del self.file_tags[path]
+            self.index.remove(path, tag, self.file_tags.get(path))
+            self.update_filter()
             self.update_current_file_tags(file_path)
-            self.save_tags()
+            self.save_tags("remove_tag_from_file", file_path, tag)
     
     def on_tag_selected(self, item):
-        tag = item.text()
+        tag = item.data(Qt.UserRole)
         self.tag_selected.emit(tag)
     
     def show_tag_context_menu(self, position):
@@ -127,7 +529,7 @@ class TagManager(QWidget):
         if not item:
             return
         
-        tag = item.text()
+        tag = item.data(Qt.UserRole)
         
         menu = QMenu()
         
@@ -141,15 +543,31 @@ class TagManager(QWidget):
         
         menu.exec_(self.tags_list.viewport().mapToGlobal(position))
     
+    def show_file_tag_context_menu(self, position):
+        from PyQt5.QtWidgets import QMenu, QAction
+        
+        item = self.current_file_tags.itemAt(position)
+        if not item or not self.current_file:
+            return
+        
+        tag = item.text()
+        menu = QMenu()
+        remove_action = QAction("从当前文件移除", self)
+        remove_action.triggered.connect(lambda: self.remove_tag_from_file(self.current_file, tag))
+        menu.addAction(remove_action)
+        menu.exec_(self.current_file_tags.viewport().mapToGlobal(position))
+    
     def rename_tag(self, old_tag):
         new_tag, ok = QInputDialog.getText(self, "重命名标签", "新标签名:", text=old_tag)
         
         if ok and new_tag and new_tag != old_tag:
-            # 更新所有文件中的标签
-            for file_path, tags in self.file_tags.items():
-                if old_tag in tags:
-                    tags.remove(old_tag)
+            # 只更新带有该标签的文件
+            for file_path in self.index.paths(self.index.bitmaps.get(old_tag, 0)):
+                tags = self.file_tags[file_path]
+                tags.remove(old_tag)
+                if new_tag not in tags:
                     tags.append(new_tag)
+            self.index.rename_tag(old_tag, new_tag)
             
             # 更新标签集合
             self.all_tags.remove(old_tag)
@@ -157,30 +575,88 @@ class TagManager(QWidget):
             
             # 更新界面
             self.update_tags_list()
-            self.save_tags()
+            if self.current_file:
+                self.update_current_file_tags(self.current_file)
+            self.save_tags("rename_tag", old_tag, new_tag)
     
     def delete_tag(self, tag):
-        reply = QMessageBox.question(self, "确认删除", 
+        reply = QMessageBox.question(self, "确认删除",
                                    f"确定要删除标签 '{tag}' 吗?",
                                    QMessageBox.Yes | QMessageBox.No)
         
         if reply == QMessageBox.Yes:
-            # 从所有文件中移除该标签
-            for file_path, tags in self.file_tags.items():
-                if tag in tags:
-                    tags.remove(tag)
+            # 从带有该标签的文件中移除
+            for file_path in self.index.paths(self.index.delete_tag(tag)):
+                tags = self.file_tags[file_path]
+                tags.remove(tag)
+                if not tags:
+                    del self.file_tags[file_path]
+                    self.index.forget(file_path)
             
             # 从标签集合中移除
             self.all_tags.remove(tag)
             
             # 更新界面
             self.update_tags_list()
-            self.save_tags()
+            if self.current_file:
+                self.update_current_file_tags(self.current_file)
+            self.save_tags("delete_tag", tag)
+    
+    def move_entries(self, moves):
+        """文件移动后沿用原来的标签和索引编号，每个文件只修改一次字典，不重建索引"""
+        for old_path, new_path in moves:
+            self.file_tags[new_path] = self.file_tags.pop(old_path)
+            self.index.move(old_path, new_path)
+    
+    def forget_entries(self, paths):
+        for path in paths:
+            del self.file_tags[path]
+            self.index.forget(path)
+    
+    def paths_under(self, file_path):
+        """file_path本身（文件）或其中的所有带标签的文件（文件夹）"""
+        path = self.stored_path(file_path)
+        separator = os.sep if os.path.isabs(path) else '/'
+        prefix = path.rstrip(separator) + separator
+        return [key for key in self.file_tags if key == path or key.startswith(prefix)]
+    
+    def apply_changes(self, changes):
+        """数据目录发生外部变化时，更新被移动或删除的文件的标签（ChangeSet中的相对路径就是保存的路径）"""
+        moves = [(old_path, new_path) for old_path, new_path in changes.moved if old_path in self.file_tags]
+        removed = [path for path in changes.removed if path in self.file_tags]
+        self.move_entries(moves)
+        self.forget_entries(removed)
+        if moves:
+            self.save_tags("move_files", moves)
+        if removed:
+            self.save_tags("remove_files", removed)
+        if moves or removed:
+            self.update_filter()
+        # 新增或修改的笔记重新提取标签（只处理mtime或大小有变化的笔记）
+        if changes.added or changes.modified:
+            self.sync_content_tags()
+    
+    def copy_path(self, source, target):
+        """文件管理器中复制了文件/文件夹，副本继承手动添加的标签"""
+        source_path = self.stored_path(source)
+        target_path = self.stored_path(target)
+        pairs = [(path, target_path + path[len(source_path):]) for path in self.paths_under(source)]
+        if pairs:
+            self.save_tags("copy_tags", pairs)
+            self.refresh_files([target for _, target in pairs])
+    
+    def remove_path(self, file_path):
+        """文件管理器中删除了文件/文件夹"""
+        removed = self.paths_under(file_path)
+        if removed:
+            self.forget_entries(removed)
+            self.save_tags("remove_files", removed)
+            self.update_filter()
     
     def get_files_by_tag(self, tag):
-        """返回包含指定标签的所有文件路径"""
-        files = []
-        for file_path, tags in self.file_tags.items():
-            if tag in tags:
-                files.append(file_path)
-        return files
\ No newline at end of file
+        """返回包含指定标签的所有文件路径（绝对路径）"""
+        return [self.absolute_path(path) for path in self.index.paths(self.index.bitmaps.get(tag, 0))]
+    
+    def filter_files(self, include=(), exclude=(), mode="and"):
+        """按标签筛选文件，参见TagIndex.filter"""
+        return [self.absolute_path(path) for path in self.index.paths(self.index.filter(include, exclude, mode))]
\ No newline at end of file
@@ -0,0 +1,495 @@
+import os
+import json
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from tag_extractor import extract_tags, extract_shard, file_key, PARALLEL_THRESHOLD, SHARD_SIZE
+from file_cache import content_hash
+
+# 标签数据库保存在数据目录下
+TAG_DB_FILE_NAME = ".tags.db"
+# 旧版本的标签文件，首次打开时导入数据库后改名保留
+LEGACY_TAGS_FILE_NAME = ".tags.json"
+# 标签的来源（位标志）：手动添加、从笔记内容中提取
+ORIGIN_MANUAL = 1
+ORIGIN_CONTENT = 2
+
+class TagStore:
+    """保存在SQLite中的标签数据
+    
+    每次修改在一个事务中完成，只写入变化的行；使用WAL模式，写入中途崩溃不会损坏已有数据。
+    数据目录中的文件以相对路径保存（更改数据目录并复制数据后标签仍然有效），
+    数据目录之外的文件保存绝对路径；接口的参数可以是绝对路径或已转换的路径，返回值都是转换后的路径。
+    每个文件标签记录来源（手动添加和/或从内容中提取），重新提取内容标签时不影响手动添加的标签；
+    parsed表记录每个笔记提取标签时的mtime和大小，只重新提取有变化的笔记。
+    带标签的文件同时记录大小、内容摘要和文件系统编号（设备号:inode），程序未运行时被移动或
+    重命名的文件可以由reconcile按这些信息找回新路径。
+    """
+    
+    SCHEMA_VERSION = 3
+    
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.db_file = os.path.join(data_dir, TAG_DB_FILE_NAME)
+        self._local = threading.local()
+        self._create_schema()
+        self.migrate_json(os.path.join(data_dir, LEGACY_TAGS_FILE_NAME))
+    
+    # ---------- 连接与表结构 ----------
+    
+    def _connect(self):
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+    
+    def _create_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    size INTEGER,
+                    digest TEXT,
+                    file_key TEXT
+                );
+                CREATE TABLE IF NOT EXISTS tags (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT UNIQUE NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS file_tags (
+                    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+                    tag_id INTEGER NOT NULL REFERENCES tags(id) ON DELETE CASCADE,
+                    origin INTEGER NOT NULL DEFAULT 1,
+                    PRIMARY KEY (file_id, tag_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS file_tags_tag ON file_tags(tag_id);
+                CREATE TABLE IF NOT EXISTS parsed (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL
+                ) WITHOUT ROWID;
+            """)
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('schema_version', ?)",
+                         (str(self.SCHEMA_VERSION),))
+            version = conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()[0]
+            if version == "1":
+                # 版本1的标签都是手动添加的
+                conn.execute("ALTER TABLE file_tags ADD COLUMN origin INTEGER NOT NULL DEFAULT 1")
+                version = "2"
+            if version == "2":
+                for column in ("size INTEGER", "digest TEXT", "file_key TEXT"):
+                    conn.execute(f"ALTER TABLE files ADD COLUMN {column}")
+                version = "3"
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'schema_version'", (version,))
+    
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+    
+    def _get_meta(self, key):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    # ---------- 路径转换 ----------
+    
+    def stored_path(self, file_path):
+        """数据目录中的文件转换为相对路径，其他文件保持绝对路径；已经是相对路径时原样返回"""
+        if not os.path.isabs(file_path):
+            return file_path.replace(os.sep, '/')
+        relative_path = os.path.relpath(os.path.abspath(file_path), os.path.abspath(self.data_dir))
+        if relative_path.startswith('..') or os.path.isabs(relative_path):
+            return os.path.abspath(file_path)
+        return relative_path.replace(os.sep, '/')
+    
+    def absolute_path(self, stored_path):
+        if os.path.isabs(stored_path):
+            return stored_path
+        return os.path.join(self.data_dir, stored_path.replace('/', os.sep))
+    
+    # ---------- 读取 ----------
+    
+    def load(self):
+        """返回 ({文件路径: [标签]}, 所有标签的集合)"""
+        conn = self._connect()
+        file_tags = {}
+        rows = conn.execute("""
+            SELECT files.path, tags.name FROM file_tags
+            JOIN files ON files.id = file_tags.file_id
+            JOIN tags ON tags.id = file_tags.tag_id
+            ORDER BY files.id, tags.name
+        """)
+        for path, tag in rows:
+            file_tags.setdefault(path, []).append(tag)
+        all_tags = {name for name, in conn.execute("SELECT name FROM tags")}
+        return file_tags, all_tags
+    
+    # ---------- 修改（每个方法一个事务） ----------
+    
+    def _file_id(self, conn, path):
+        """path为stored_path转换后的路径"""
+        conn.execute("INSERT OR IGNORE INTO files (path) VALUES (?)", (path,))
+        return conn.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()[0]
+    
+    def _tag_id(self, conn, tag):
+        conn.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
+        return conn.execute("SELECT id FROM tags WHERE name = ?", (tag,)).fetchone()[0]
+    
+    def _remove_orphan_files(self, conn, paths=None):
+        """删除已经没有标签的文件记录，paths为None时检查所有文件"""
+        orphan = "NOT EXISTS (SELECT 1 FROM file_tags WHERE file_tags.file_id = files.id)"
+        if paths is None:
+            conn.execute(f"DELETE FROM files WHERE {orphan}")
+        else:
+            conn.executemany(f"DELETE FROM files WHERE path = ? AND {orphan}", [(path,) for path in paths])
+    
+    def _record_fingerprint(self, conn, path):
+        """记录文件的大小和文件系统编号（内容摘要在提取标签时记录）"""
+        try:
+            st = os.stat(self.absolute_path(path))
+        except OSError:
+            return
+        conn.execute("UPDATE files SET size = ?, file_key = ? WHERE path = ?", (st.st_size, file_key(st), path))
+    
+    def _insert_pairs(self, conn, pairs):
+        file_ids = {}
+        tag_ids = {}
+        for file_path, tag in pairs:
+            if file_path not in file_ids:
+                path = self.stored_path(file_path)
+                file_ids[file_path] = self._file_id(conn, path)
+                self._record_fingerprint(conn, path)
+            if tag not in tag_ids:
+                tag_ids[tag] = self._tag_id(conn, tag)
+            conn.execute("INSERT INTO file_tags (file_id, tag_id, origin) VALUES (?, ?, ?) "
+                         "ON CONFLICT (file_id, tag_id) DO UPDATE SET origin = origin | excluded.origin",
+                         (file_ids[file_path], tag_ids[tag], ORIGIN_MANUAL))
+    
+    def add_tag(self, tag):
+        """添加一个还没有文件使用的标签"""
+        conn = self._connect()
+        with conn:
+            self._tag_id(conn, tag)
+    
+    def add_tags(self, pairs):
+        """批量添加 (文件路径, 标签)，在一个事务中完成"""
+        conn = self._connect()
+        with conn:
+            self._insert_pairs(conn, pairs)
+    
+    def remove_tags(self, pairs):
+        """批量移除 (文件路径, 标签)，在一个事务中完成"""
+        pairs = [(self.stored_path(file_path), tag) for file_path, tag in pairs]
+        conn = self._connect()
+        with conn:
+            conn.executemany("""
+                DELETE FROM file_tags
+                WHERE file_id = (SELECT id FROM files WHERE path = ?)
+                  AND tag_id = (SELECT id FROM tags WHERE name = ?)
+            """, pairs)
+            self._remove_orphan_files(conn, {path for path, _ in pairs})
+    
+    def add_tag_to_file(self, file_path, tag):
+        self.add_tags([(file_path, tag)])
+    
+    def remove_tag_from_file(self, file_path, tag):
+        self.remove_tags([(file_path, tag)])
+    
+    def rename_tag(self, old_tag, new_tag):
+        """重命名标签，新标签已存在时合并"""
+        conn = self._connect()
+        with conn:
+            row = conn.execute("SELECT id FROM tags WHERE name = ?", (old_tag,)).fetchone()
+            if row is None:
+                return
+            existing = conn.execute("SELECT id FROM tags WHERE name = ?", (new_tag,)).fetchone()
+            if existing is None:
+                conn.execute("UPDATE tags SET name = ? WHERE id = ?", (new_tag, row[0]))
+                return
+            conn.execute("""
+                INSERT INTO file_tags (file_id, tag_id, origin)
+                SELECT file_id, ?, origin FROM file_tags WHERE tag_id = ?
+                ON CONFLICT (file_id, tag_id) DO UPDATE SET origin = origin | excluded.origin
+            """, (existing[0], row[0]))
+            conn.execute("DELETE FROM tags WHERE id = ?", (row[0],))
+    
+    def delete_tag(self, tag):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM tags WHERE name = ?", (tag,))
+            self._remove_orphan_files(conn)
+    
+    def move_files(self, moves):
+        """文件被移动或重命名，moves为 [(旧路径, 新路径)]"""
+        conn = self._connect()
+        with conn:
+            for old_path, new_path in moves:
+                old_path, new_path = self.stored_path(old_path), self.stored_path(new_path)
+                conn.execute("UPDATE OR REPLACE parsed SET path = ? WHERE path = ?", (new_path, old_path))
+                # 新路径已有标签时合并到新路径
+                target = conn.execute("SELECT id FROM files WHERE path = ?", (new_path,)).fetchone()
+                if target is None:
+                    conn.execute("UPDATE files SET path = ? WHERE path = ?", (new_path, old_path))
+                    continue
+                conn.execute("""
+                    INSERT INTO file_tags (file_id, tag_id, origin)
+                    SELECT ?, tag_id, origin FROM file_tags WHERE file_id = (SELECT id FROM files WHERE path = ?)
+                    ON CONFLICT (file_id, tag_id) DO UPDATE SET origin = origin | excluded.origin
+                """, (target[0], old_path))
+                conn.execute("DELETE FROM files WHERE path = ?", (old_path,))
+    
+    def remove_files(self, file_paths):
+        """文件被删除，移除其所有标签"""
+        paths = [(self.stored_path(file_path),) for file_path in file_paths]
+        conn = self._connect()
+        with conn:
+            conn.executemany("DELETE FROM files WHERE path = ?", paths)
+            conn.executemany("DELETE FROM parsed WHERE path = ?", paths)
+    
+    # ---------- 从笔记内容中提取的标签 ----------
+    
+    def load_tag_names(self):
+        return [name for name, in self._connect().execute("SELECT name FROM tags")]
+    
+    def tags_of(self, file_path):
+        """文件当前的所有标签"""
+        return [name for name, in self._connect().execute("""
+            SELECT tags.name FROM file_tags
+            JOIN files ON files.id = file_tags.file_id
+            JOIN tags ON tags.id = file_tags.tag_id
+            WHERE files.path = ? ORDER BY tags.name
+        """, (self.stored_path(file_path),))]
+    
+    def stale_notes(self, entries):
+        """比较提取标签时记录的mtime和大小，返回 (需要重新提取的笔记, 已不存在的笔记)
+        
+        entries为 {相对路径: (mtime_ns, size, 内容摘要)}，通常来自FileStatCache。
+        """
+        parsed = {path: (mtime_ns, size) for path, mtime_ns, size
+                  in self._connect().execute("SELECT path, mtime_ns, size FROM parsed")}
+        stale = [path for path, entry in entries.items() if parsed.get(path) != entry[:2]]
+        missing = [path for path in parsed if path not in entries and not os.path.isabs(path)]
+        return stale, missing
+    
+    def set_content_tags(self, results):
+        """写入提取的标签，results为 [(相对路径, mtime_ns, size, 内容摘要, 文件系统编号, [标签])]
+        
+        只更新来源为内容的标签，手动添加的标签保持不变；不再被任何文件使用的内容标签被删除。
+        返回标签有变化的文件。
+        """
+        changed = []
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO parsed (path, mtime_ns, size) VALUES (?, ?, ?)",
+                             [(path, mtime_ns, size) for path, mtime_ns, size, _, _, _ in results])
+            dropped_tags = set()
+            for path, _, _, _, _, tags in results:
+                row = conn.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+                old = {}
+                if row is not None:
+                    old = dict(conn.execute("""
+                        SELECT tags.name, tags.id FROM file_tags JOIN tags ON tags.id = file_tags.tag_id
+                        WHERE file_tags.file_id = ? AND file_tags.origin & ?
+                    """, (row[0], ORIGIN_CONTENT)))
+                new = set(tags)
+                if new == old.keys():
+                    continue
+                file_id = row[0] if row is not None else self._file_id(conn, path)
+                for tag in new - old.keys():
+                    conn.execute("INSERT INTO file_tags (file_id, tag_id, origin) VALUES (?, ?, ?) "
+                                 "ON CONFLICT (file_id, tag_id) DO UPDATE SET origin = origin | excluded.origin",
+                                 (file_id, self._tag_id(conn, tag), ORIGIN_CONTENT))
+                removed = [old[tag] for tag in old.keys() - new]
+                conn.executemany("UPDATE file_tags SET origin = origin & ? WHERE file_id = ? AND tag_id = ?",
+                                 [(~ORIGIN_CONTENT, file_id, tag_id) for tag_id in removed])
+                conn.execute("DELETE FROM file_tags WHERE file_id = ? AND origin = 0", (file_id,))
+                dropped_tags.update(removed)
+                changed.append(path)
+            self._remove_orphan_files(conn, changed)
+            conn.executemany("DELETE FROM tags WHERE id = ? AND NOT EXISTS "
+                             "(SELECT 1 FROM file_tags WHERE file_tags.tag_id = tags.id)",
+                             [(tag_id,) for tag_id in dropped_tags])
+            # 更新带标签的文件的指纹（没有标签的文件不在files表中）
+            conn.executemany("UPDATE files SET size = ?, digest = ?, file_key = ? WHERE path = ?",
+                             [(size, digest, key, path) for path, _, size, digest, key, _ in results if digest])
+        return changed
+    
+    def update_content(self, file_path, content):
+        """保存笔记后重新提取标签，返回标签有变化的文件"""
+        path = self.stored_path(file_path)
+        if os.path.isabs(path):
+            # 只处理数据目录中的笔记
+            return []
+        st = os.stat(file_path)
+        digest = content_hash(content.encode('utf-8'))
+        return self.set_content_tags([(path, st.st_mtime_ns, st.st_size, digest, file_key(st), extract_tags(content))])
+    
+    def sync_content(self, entries, progress=None, is_cancelled=None, workers=None):
+        """重新提取有变化的笔记的标签，返回标签有变化的文件，取消时返回None
+        
+        笔记较多时分片交给进程池读取和解析，主进程按分片写入；无法创建子进程或子进程异常退出时，
+        其余分片在本进程中解析。
+        """
+        stale, missing = self.stale_notes(entries)
+        changed = self.set_content_tags([(path, 0, 0, None, None, []) for path in missing])
+        if missing:
+            conn = self._connect()
+            with conn:
+                conn.executemany("DELETE FROM parsed WHERE path = ?", [(path,) for path in missing])
+        total = len(stale)
+        if total < PARALLEL_THRESHOLD:
+            changed.extend(self.set_content_tags(extract_shard(self.data_dir, stale)))
+            return changed
+        shards = [stale[i:i + SHARD_SIZE] for i in range(0, total, SHARD_SIZE)]
+        done = 0
+        # 尚未写入的分片序号
+        remaining = set(range(len(shards)))
+        try:
+            executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+        except (OSError, NotImplementedError) as e:
+            print(f"无法启动多进程提取标签，改为单进程: {str(e)}")
+            executor = None
+        if executor is not None:
+            try:
+                futures = {executor.submit(extract_shard, self.data_dir, shard): i for i, shard in enumerate(shards)}
+                for future in as_completed(futures):
+                    if is_cancelled and is_cancelled():
+                        for pending in futures:
+                            pending.cancel()
+                        return None
+                    changed.extend(self.set_content_tags(future.result()))
+                    i = futures[future]
+                    remaining.discard(i)
+                    done += len(shards[i])
+                    if progress:
+                        progress(done, total)
+            except BrokenProcessPool as e:
+                print(f"提取标签的子进程异常退出，其余文件改为单进程: {str(e)}")
+            finally:
+                executor.shutdown(wait=True)
+        for i in sorted(remaining):
+            if is_cancelled and is_cancelled():
+                return None
+            changed.extend(self.set_content_tags(extract_shard(self.data_dir, shards[i])))
+            done += len(shards[i])
+            if progress:
+                progress(done, total)
+        return changed
+    
+    # ---------- 文件身份 ----------
+    
+    def copy_tags(self, pairs):
+        """文件被复制，新文件继承手动添加的标签（内容标签由提取得到），pairs为 [(源文件, 新文件)]"""
+        conn = self._connect()
+        with conn:
+            for source, target in pairs:
+                source, target = self.stored_path(source), self.stored_path(target)
+                rows = conn.execute("""
+                    SELECT file_tags.tag_id FROM file_tags JOIN files ON files.id = file_tags.file_id
+                    WHERE files.path = ? AND file_tags.origin & ?
+                """, (source, ORIGIN_MANUAL)).fetchall()
+                if not rows:
+                    continue
+                file_id = self._file_id(conn, target)
+                self._record_fingerprint(conn, target)
+                conn.executemany("INSERT INTO file_tags (file_id, tag_id, origin) VALUES (?, ?, ?) "
+                                 "ON CONFLICT (file_id, tag_id) DO UPDATE SET origin = origin | excluded.origin",
+                                 [(file_id, tag_id, ORIGIN_MANUAL) for tag_id, in rows])
+    
+    def reconcile(self, entries):
+        """修复路径已经失效的标签记录（文件在程序未运行或未监视时被移动、重命名或删除）
+        
+        entries为 {相对路径: (mtime_ns, size, 内容摘要)}，只包含笔记文件。只检查路径不在entries中、
+        并且已经不存在的带标签文件（其他类型的文件也可以有标签），
+        候选的新路径是还没有提取过标签的文件：先找大小和内容摘要都相同的唯一文件，
+        再按文件系统编号找（移动后又修改过的文件），都找不到时删除其标签。
+        不读取笔记内容，只对候选文件调用stat。返回 ([(旧路径, 新路径)], [删除的路径])。
+        """
+        conn = self._connect()
+        rows = conn.execute("SELECT path, size, digest, file_key FROM files").fetchall()
+        lost = [row for row in rows if row[0] not in entries and not os.path.isabs(row[0])
+                and not os.path.exists(self.absolute_path(row[0]))]
+        if not lost or not entries:
+            return [], []
+        known = {row[0] for row in rows}
+        known.update(path for path, in conn.execute("SELECT path FROM parsed"))
+        fresh = {path for path in entries if path not in known}
+        by_size = {}
+        for path in fresh:
+            by_size.setdefault(entries[path][1], []).append(path)
+        keys = None
+        moved = []
+        removed = []
+        for path, size, digest, key in lost:
+            match = None
+            if digest:
+                same = [candidate for candidate in by_size.get(size, ()) if entries[candidate][2] == digest]
+                if len(same) == 1:
+                    match = same[0]
+            if match is None and key:
+                if keys is None:
+                    keys = {}
+                    for candidate in fresh:
+                        try:
+                            keys[file_key(os.stat(self.absolute_path(candidate)))] = candidate
+                        except OSError:
+                            continue
+                match = keys.get(key)
+            if match is None or match not in fresh:
+                removed.append(path)
+            else:
+                fresh.discard(match)
+                by_size[entries[match][1]].remove(match)
+                moved.append((path, match))
+        with conn:
+            conn.executemany("UPDATE files SET path = ? WHERE path = ?", [(new, old) for old, new in moved])
+            conn.executemany("UPDATE OR REPLACE parsed SET path = ? WHERE path = ?", [(new, old) for old, new in moved])
+            conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+            conn.executemany("DELETE FROM parsed WHERE path = ?", [(path,) for path in removed])
+        return moved, removed
+    
+    def copy_to(self, new_dir):
+        """更改数据目录时复制标签数据库（新目录中已有标签数据库时保留新目录的）"""
+        target_file = os.path.join(new_dir, TAG_DB_FILE_NAME)
+        if os.path.exists(target_file):
+            return
+        target = sqlite3.connect(target_file)
+        try:
+            self._connect().backup(target)
+        finally:
+            target.close()
+    
+    # ---------- 迁移 ----------
+    
+    def migrate_json(self, json_file):
+        """导入旧版本的.tags.json（只在数据库中还没有标签时进行），导入后改名为.tags.json.bak"""
+        if not os.path.exists(json_file) or self._get_meta("migrated_json"):
+            return
+        try:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                file_tags = json.load(f).get("file_tags", {})
+        except Exception as e:
+            print(f"无法读取旧的标签文件: {json_file}, 错误: {str(e)}")
+            return
+        conn = self._connect()
+        with conn:
+            if conn.execute("SELECT 1 FROM tags LIMIT 1").fetchone() is None:
+                self._insert_pairs(conn, [(file_path, tag) for file_path, tags in file_tags.items() for tag in tags])
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_json', '1')")
+        try:
+            os.replace(json_file, json_file + ".bak")
+        except OSError as e:
+            print(f"无法重命名旧的标签文件: {json_file}, 错误: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,237 @@
+import re
+from collections import Counter
+
+try:
+    import jieba
+except ImportError:
+    jieba = None
+
+# 中日韩文字的Unicode范围（假名、汉字、扩展A、兼容汉字、谚文）
+CJK_RANGES = '぀-ヿ㐀-䶿一-鿿豈-﫿가-힯'
+
+# 连续的中日韩文字，或连续的其他文字（字母、数字、下划线）
+_TOKEN_RE = re.compile(rf'([{CJK_RANGES}]+)|([^\W{CJK_RANGES}]+)')
+_HEADING_RE = re.compile(r'^\s*#+\s+(.*)$', re.MULTILINE)
+
+# Markdown语法：链接和图片只保留文字，去掉地址、HTML标签和代码块的围栏行
+_MD_LINK_RE = re.compile(r'!?\[([^\]]*)\]\([^)]*\)')
+_MD_REFERENCE_RE = re.compile(r'^\s*\[[^\]]+\]:\s*\S+.*$', re.MULTILINE)
+_MD_HTML_RE = re.compile(r'<[^>\n]+>')
+_MD_FENCE_RE = re.compile(r'^\s*(```|~~~).*$', re.MULTILINE)
+
+# 查询词项的匹配方式：精确匹配、前缀匹配（以它开头的词项）、子串匹配（包含它的词项）
+EXACT, PREFIX, SUBSTRING = False, True, 2
+
+# 英文词干：按顺序尝试的后缀及替换
+_STEM_SUFFIXES = (('sses', 'ss'), ('ies', 'y'), ('ing', ''), ('ed', ''), ('s', ''))
+
+def stem(word):
+    """去掉英文单词常见的屈折后缀（running -> run，notes -> note）
+    
+    只处理纯字母且长度足够的单词，词干至少有3个字母且包含元音。
+    """
+    if len(word) <= 3 or not word.isascii() or not word.isalpha():
+        return word
+    for suffix, replacement in _STEM_SUFFIXES:
+        if word.endswith(suffix):
+            base = word[:-len(suffix)] + replacement
+            if len(base) < 3 or not any(c in 'aeiouy' for c in base) \
+                    or word.endswith(('ss', 'us', 'is', 'eed')):
+                return word
+            # running -> runn -> run
+            if suffix in ('ing', 'ed') and len(base) > 3 and base[-1] == base[-2] and base[-1] not in 'lsz':
+                base = base[:-1]
+            return base
+    return word
+
+def has_jieba():
+    """是否安装了jieba分词词典"""
+    return jieba is not None
+
+class Analyzer:
+    """把笔记和查询切分为索引词项
+    
+    中文没有空格分隔，连续的中日韩文字按相邻两字（二元组）切分，最后一个字单独作为词项，
+    这样文中出现的每个字都是某个词项的开头：长度不小于2的查询按二元组精确匹配，
+    单字查询按前缀匹配，结果与子串查找一致。安装了jieba时可以改用词典分词。
+    英文单词可以同时索引词干，Markdown的链接地址、HTML标签等语法可以在索引前去掉。
+    设置以字符串形式（spec）保存在每个数据目录的索引中。
+    """
+    
+    def __init__(self, cjk="bigram", stemming=True, strip_markdown=True):
+        if cjk == "jieba" and jieba is None:
+            print("未安装jieba，中文改用二元组切分")
+            cjk = "bigram"
+        self.cjk = cjk
+        self.stemming = stemming
+        self.strip_markdown = strip_markdown
+    
+    @property
+    def spec(self):
+        return f"cjk={self.cjk};stem={int(self.stemming)};markdown={int(self.strip_markdown)}"
+    
+    @classmethod
+    def from_spec(cls, spec):
+        """由spec字符串创建，无法识别的部分使用默认值"""
+        options = dict(part.split('=', 1) for part in (spec or "").split(';') if '=' in part)
+        return cls(cjk=options.get('cjk', 'bigram'),
+                   stemming=options.get('stem', '1') == '1',
+                   strip_markdown=options.get('markdown', '1') == '1')
+    
+    def __eq__(self, other):
+        return isinstance(other, Analyzer) and self.spec == other.spec
+    
+    def __repr__(self):
+        return f"Analyzer({self.spec})"
+    
+    def strip(self, text):
+        """去掉不需要检索的Markdown语法"""
+        if not self.strip_markdown:
+            return text
+        text = _MD_FENCE_RE.sub('', text)
+        text = _MD_REFERENCE_RE.sub('', text)
+        text = _MD_LINK_RE.sub(r'\1', text)
+        return _MD_HTML_RE.sub(' ', text)
+    
+    def _cjk_tokens(self, run):
+        if self.cjk == "jieba":
+            return [word for word in jieba.cut_for_search(run) if word.strip()]
+        if len(run) == 1:
+            return [run]
+        return [run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]]
+    
+    def positions(self, text):
+        """切分文本，返回 [(小写词项, 位置)]
+        
+        二元组的位置为其第一个字的位置，末尾的单字为该字的位置；
+        英文单词的词干与原词不同时两者都会出现，位置相同。
+        """
+        tokens = []
+        position = 0
+        for cjk_run, word in _TOKEN_RE.findall(text.lower()):
+            if cjk_run:
+                if self.cjk == "jieba":
+                    for token in self._cjk_tokens(cjk_run):
+                        tokens.append((token, position))
+                        position += 1
+                    continue
+                tokens.extend((token, position + i) for i, token in enumerate(self._cjk_tokens(cjk_run)))
+                position += len(cjk_run)
+            else:
+                tokens.append((word, position))
+                if self.stemming:
+                    base = stem(word)
+                    if base != word:
+                        tokens.append((base, position))
+                position += 1
+        return tokens
+    
+    def tokens(self, text):
+        """切分文本，返回小写词项列表"""
+        return [token for token, _ in self.positions(text)]
+    
+    def analyze(self, title, content):
+        """统计笔记的词项，返回 ({词项: (词频, 标题词频, [位置])}, 文档长度)
+        
+        标题（文件名）和Markdown标题行中的词项另外计入标题词频，位置只记录正文中的位置。
+        文档长度只计原文中的词项，与原词位置相同的词干不重复计入。
+        """
+        content = self.strip(content)
+        positions = {}
+        length = 0
+        last_position = -1
+        for token, position in self.positions(content):
+            positions.setdefault(token, []).append(position)
+            if position != last_position:
+                length += 1
+                last_position = position
+        heading_tokens = self.tokens(title)
+        for heading in _HEADING_RE.findall(content):
+            heading_tokens.extend(self.tokens(heading))
+        htf = Counter(heading_tokens)
+        terms = {term: (len(positions.get(term, ())), htf.get(term, 0), positions.get(term, []))
+                 for term in positions.keys() | htf.keys()}
+        return terms, length
+    
+    def query_terms(self, keyword, prefix=False):
+        """把查询切分为 [(词项, 匹配方式)]，所有词项都需要出现，匹配方式为EXACT、PREFIX或SUBSTRING
+        
+        中文二元组总是精确匹配（查询的最后一个字已包含在最后一个二元组中），单字查询按前缀匹配；
+        英文单词在启用词干时取词干，按子串匹配（dex能找到index，由索引用三字母组查找包含它的词项），
+        只有一个字母时按前缀（prefix为True时）或精确匹配。
+        """
+        terms = {}
+        for cjk_run, word in _TOKEN_RE.findall(keyword.lower()):
+            if cjk_run:
+                if self.cjk == "jieba":
+                    words = self._cjk_tokens(cjk_run)
+                    for word in words[:-1]:
+                        terms[word] = EXACT
+                    terms[words[-1]] = PREFIX if prefix else EXACT
+                elif len(cjk_run) == 1:
+                    terms[cjk_run] = PREFIX
+                else:
+                    for i in range(len(cjk_run) - 1):
+                        terms[cjk_run[i:i + 2]] = EXACT
+            else:
+                base = stem(word) if self.stemming else word
+                if len(base) >= 2:
+                    terms[base] = SUBSTRING
+                else:
+                    terms[base] = terms.get(base, EXACT) or (PREFIX if prefix else EXACT)
+        return list(terms.items())
+    
+    def phrase_terms(self, phrase, prefix=False):
+        """把短语切分为 [(词项, 相对位置, 是否前缀匹配)]，用于按位置匹配
+        
+        英文使用原词而不是词干；单独的一个中文字按前缀匹配（它在文中可能是二元组的开头），
+        prefix为True时最后一个英文单词按前缀匹配。
+        """
+        terms = []
+        position = 0
+        for cjk_run, word in _TOKEN_RE.findall(phrase.lower()):
+            if cjk_run:
+                if self.cjk == "jieba":
+                    for token in self._cjk_tokens(cjk_run):
+                        terms.append((token, position, False))
+                        position += 1
+                elif len(cjk_run) == 1:
+                    terms.append((cjk_run, position, True))
+                    position += 1
+                else:
+                    terms.extend((cjk_run[i:i + 2], position + i, False) for i in range(len(cjk_run) - 1))
+                    position += len(cjk_run)
+            else:
+                terms.append((word, position, False))
+                position += 1
+        if prefix and terms and not terms[-1][2]:
+            term, position, _ = terms[-1]
+            terms[-1] = (term, position, True)
+        return terms
+    
+    def highlight_parts(self, keyword, prefix=False):
+        """生成在原文中高亮查询的正则表达式片段集合
+        
+        中文按子串匹配；英文高亮包含查询的整个单词，只有一个字母时从单词开头匹配，
+        启用词干或前缀匹配时匹配以它开头的整个单词。
+        """
+        word_char = r"[^\W" + CJK_RANGES + "]"
+        parts = set()
+        for cjk_run, word in _TOKEN_RE.findall(keyword.lower()):
+            if cjk_run:
+                parts.add(re.escape(cjk_run))
+            else:
+                base = stem(word) if self.stemming else word
+                if len(base) >= 2:
+                    parts.add(word_char + "*" + re.escape(base) + word_char + "*")
+                    continue
+                tail = word_char + "*" if prefix or self.stemming else "(?!" + word_char + ")"
+                parts.add("(?<!" + word_char + ")" + re.escape(base) + tail)
+        return parts
+    
+    def highlight_pattern(self, keyword, prefix=False):
+        """高亮查询的正则表达式，没有可高亮的内容时返回None"""
+        parts = self.highlight_parts(keyword, prefix)
+        if not parts:
+            return None
+        return re.compile("|".join(sorted(parts, key=len, reverse=True)), re.IGNORECASE)
\ No newline at end of file
@@ -0,0 +1,182 @@
+import os
+from collections import deque
+from PyQt5.QtCore import QObject, QFileSystemWatcher, QThread, QTimer, pyqtSignal
+
+from file_cache import ChangeSet
+
+class ScanWorker(QThread):
+    """在后台线程中重新扫描一组目录"""
+    # 合并后的ChangeSet、因其他线程正在完整扫描而没有扫描的目录
+    scanned = pyqtSignal(object, object)
+    
+    def __init__(self, file_cache, dirs, parent=None):
+        super().__init__(parent)
+        self.file_cache = file_cache
+        self.dirs = dirs
+        self._cancelled = False
+    
+    def cancel(self):
+        self._cancelled = True
+    
+    def run(self):
+        changes = ChangeSet()
+        skipped = []
+        for i, directory in enumerate(self.dirs):
+            if self._cancelled:
+                return
+            result = self.file_cache.scan_dir(directory, blocking=False)
+            if result is None:
+                # 后台正在进行完整扫描，剩下的目录稍后重试
+                skipped = self.dirs[i:]
+                break
+            changes.merge(result)
+        # 跨目录的移动表现为一个目录中的删除和另一个目录中的新增
+        changes.pair_moves(lambda path: self.file_cache.get(path)[2])
+        self.scanned.emit(changes, skipped)
+
+class VaultWatcher(QObject):
+    """监视数据目录，把外部的新建、修改、删除和重命名合并成增量变化通知
+    
+    优先使用QFileSystemWatcher（Linux下为inotify）监视目录，目录变化后只重新扫描
+    该目录；短时间内的多次变化合并为一次通知。另有一个轮询计时器每次只检查少量
+    目录，用于发现原地修改的文件以及无法监视的目录，不会触发整个数据目录的重新扫描。
+    目录的重新扫描（stat和计算内容摘要）在ScanWorker线程中进行，同一时间只有一个。
+    mode为 "auto"（监视加轮询）、"poll"（只轮询）或 "off"。
+    """
+    # ChangeSet，其中的路径为相对数据目录的路径
+    changes_detected = pyqtSignal(object)
+    
+    # 变化合并的等待时间
+    DEBOUNCE_MS = 300
+    # 轮询间隔以及每次轮询检查的目录数
+    POLL_INTERVAL_MS = 1000
+    POLL_BATCH = 20
+    
+    def __init__(self, file_cache, mode="auto", parent=None):
+        super().__init__(parent)
+        self.file_cache = file_cache
+        self.data_dir = file_cache.data_dir
+        self.mode = mode
+        self.watcher = None
+        # 等待重新扫描的目录（绝对路径）
+        self.pending_dirs = set()
+        # 轮询时依次检查的目录
+        self.sweep_queue = deque()
+        self.watched_files = []
+        self.scan_worker = None
+        
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(self.DEBOUNCE_MS)
+        self.debounce_timer.timeout.connect(self.process_pending)
+        
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(self.POLL_INTERVAL_MS)
+        self.poll_timer.timeout.connect(self.poll)
+    
+    def start(self):
+        if self.mode == "off":
+            return
+        if self.mode != "poll":
+            self.watcher = QFileSystemWatcher(self)
+            self.watcher.directoryChanged.connect(self.on_directory_changed)
+            self.watcher.fileChanged.connect(self.on_file_changed)
+            self.watch_known_dirs()
+        self.poll_timer.start()
+    
+    def stop(self):
+        self.debounce_timer.stop()
+        self.poll_timer.stop()
+        worker = self.scan_worker
+        if worker is not None:
+            self.scan_worker = None
+            worker.cancel()
+            worker.scanned.disconnect(self.on_scanned)
+            worker.finished.disconnect(self.on_scan_finished)
+            # 停止后通常会保存文件缓存，等扫描线程退出
+            worker.wait()
+            worker.deleteLater()
+        if self.watcher is not None:
+            paths = self.watcher.directories() + self.watcher.files()
+            if paths:
+                self.watcher.removePaths(paths)
+            self.watcher = None
+    
+    def watch_known_dirs(self):
+        """监视文件缓存中已知的所有目录"""
+        dirs = [self.data_dir] + [self.file_cache.absolute_path(d) for d in sorted(self.file_cache.dirs)]
+        self._watch_dirs(dirs)
+    
+    def _watch_dirs(self, dirs):
+        if self.watcher is None:
+            return
+        current = set(self.watcher.directories())
+        new_dirs = [d for d in dirs if d not in current and os.path.isdir(d)]
+        if new_dirs:
+            failed = self.watcher.addPaths(new_dirs)
+            if failed:
+                # 超出系统的监视数量限制时，这些目录只能依靠轮询发现变化
+                print(f"无法监视 {len(failed)} 个目录，将改为轮询")
+    
+    def watch_file(self, file_path):
+        """额外监视当前打开的文件，使原地修改也能立即被发现"""
+        if self.watcher is None:
+            return
+        if self.watched_files:
+            self.watcher.removePaths(self.watched_files)
+        self.watched_files = [file_path] if file_path and os.path.isfile(file_path) else []
+        if self.watched_files:
+            self.watcher.addPaths(self.watched_files)
+    
+    def on_directory_changed(self, directory):
+        self.pending_dirs.add(directory)
+        self.debounce_timer.start()
+    
+    def on_file_changed(self, file_path):
+        self.pending_dirs.add(os.path.dirname(file_path))
+        self.debounce_timer.start()
+        # 文件被替换（先写临时文件再重命名）后监视会失效，需要重新添加
+        if file_path in self.watched_files and os.path.exists(file_path) \
+                and file_path not in self.watcher.files():
+            self.watcher.addPath(file_path)
+    
+    def poll(self):
+        """每次只检查少量目录，逐步覆盖整个数据目录"""
+        if not self.sweep_queue:
+            if self.scan_worker is not None:
+                # 扫描线程可能正在修改目录集合
+                return
+            self.sweep_queue.extend([self.data_dir] + [self.file_cache.absolute_path(d)
+                                                       for d in sorted(self.file_cache.dirs)])
+        for _ in range(min(self.POLL_BATCH, len(self.sweep_queue))):
+            self.pending_dirs.add(self.sweep_queue.popleft())
+        if not self.debounce_timer.isActive():
+            self.process_pending()
+    
+    def process_pending(self):
+        """在后台线程中重新扫描有变化的目录，扫描结束后发出合并后的变化"""
+        if self.scan_worker is not None or not self.pending_dirs:
+            # 正在扫描时，新的目录在这次扫描结束后处理
+            return
+        dirs = list(self.pending_dirs)
+        self.pending_dirs.clear()
+        self.scan_worker = ScanWorker(self.file_cache, dirs, self)
+        self.scan_worker.scanned.connect(self.on_scanned)
+        self.scan_worker.finished.connect(self.on_scan_finished)
+        self.scan_worker.start()
+        
+    def on_scanned(self, changes, skipped):
+        if skipped:
+            self.pending_dirs.update(skipped)
+            self.debounce_timer.start()
+        if changes.new_dirs:
+            self._watch_dirs([self.file_cache.absolute_path(d) for d in changes.new_dirs])
+        if changes:
+            self.changes_detected.emit(changes)
+    
+    def on_scan_finished(self):
+        self.scan_worker.deleteLater()
+        self.scan_worker = None
+        # 扫描期间又有变化的目录
+        if self.pending_dirs and not self.debounce_timer.isActive():
+            self.process_pending()
\ No newline at end of file